@@ -0,0 +1,46 @@
+# import
+## batteries
+import random
+import threading
+from time import sleep, monotonic
+
+# classes
+class Backoff:
+    """
+    Jittered exponential backoff, shared among threads.
+    Each failure pushes back the time at which the next call may start (for all threads);
+    each success reduces the delay for the next failure.
+    """
+    def __init__(self, base: float=10, cap: float=300):
+        self.base = base
+        self.cap = cap
+        self._failures = 0
+        self._not_before = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Sleep until calls are allowed."""
+        while True:
+            with self._lock:
+                delay = self._not_before - monotonic()
+            if delay <= 0:
+                return
+            sleep(delay)
+
+    def failure(self) -> float:
+        """
+        Record a failure.
+        Returns:
+            Delay (seconds) before the next call
+        """
+        with self._lock:
+            self._failures += 1
+            delay = min(self.cap, self.base * 2 ** (self._failures - 1))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            self._not_before = max(self._not_before, monotonic() + delay)
+            return delay
+
+    def success(self) -> None:
+        """Record a success."""
+        with self._lock:
+            self._failures = max(0, self._failures - 1)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# import
+## batteries
+from __future__ import print_function
+import os
+import sys
+import argparse
+import logging
+import pandas as pd
+## pipeline
+from barcode_screen import screen_barcodes, plausible_whitelists
+
+# logging
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
+
+# argparse
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
+                      argparse.RawDescriptionHelpFormatter):
+    pass
+
+desc = 'Pre-screen the cell barcode whitelists of a sample, prior to the STAR param search.'
+epi = """DESCRIPTION:
+All whitelists are loaded into one index per barcode length (2-bit packed barcodes, in a
+sorted array, with a bit mask of the whitelists containing each barcode), and the
+barcode read (read 1) is read once. For each whitelist and offset (0 to --max-offset),
+the fraction of reads with a prefix matching the whitelist exactly, or with 1 mismatch
+(incl. a single N), is reported.
+
+Whitelists with a matching fraction (exact or 1 mismatch) at offset 0, as used by STARsolo,
+of >= --min-frac are written to the output barcodes table (same format as the input table),
+so only those are used for the STAR param search. If no whitelist passes, all are written.
+
+The whitelists are provided as a barcodes table (columns: name, cell_barcode_length,
+umi_length, file_path), or as --whitelist NAME:LENGTH:FILE (once per whitelist; e.g.,
+staged files); for the latter, the barcodes table rows are matched by name.
+
+Examples:
+barcode-screen.py --barcodes data/barcodes.csv read_1.fastq
+barcode-screen.py --barcodes barcodes.csv --whitelist 3M-february-2018:16:barcodes1/3M-february-2018.txt read_1.fastq
+"""
+parser = argparse.ArgumentParser(description=desc, epilog=epi,
+                                 formatter_class=CustomFormatter)
+parser.add_argument('fastq_r1', type=str,
+                    help='Read 1 (cell barcode read) fastq file')
+parser.add_argument('--barcodes', type=str, required=True,
+                    help='Barcodes table (columns: name, cell_barcode_length, umi_length, file_path)')
+parser.add_argument('--whitelist', type=str, action='append', default=None,
+                    help='Whitelist as NAME:LENGTH:FILE (repeat for each); overrides the file_path of the barcodes table')
+parser.add_argument('--num-reads', type=int, default=100000,
+                    help='Number of reads to screen')
+parser.add_argument('--max-offset', type=int, default=0,
+                    help='Max offset of the cell barcode in read 1 to screen')
+parser.add_argument('--min-frac', type=float, default=0.1,
+                    help='Min fraction of reads matching a whitelist (exact or 1 mismatch; offset 0)')
+parser.add_argument('--outfile', type=str, default='barcode_screen.csv',
+                    help='Output table of the fraction of matching reads per whitelist & offset')
+parser.add_argument('--barcodes-outfile', type=str, default='plausible_barcodes.csv',
+                    help='Output barcodes table of the plausible whitelists')
+
+# functions
+def parse_whitelist(whitelist: str) -> tuple:
+    """
+    Parse a NAME:LENGTH:FILE whitelist argument.
+    Args:
+        whitelist: Whitelist argument
+    Returns:
+        (name, barcode length, file)
+    """
+    name,length,path = whitelist.split(":", 2)
+    return name, int(length), path
+
+def main(args):
+    # set pandas display options
+    pd.set_option('display.max_columns', 30)
+    pd.set_option('display.width', 300)
+
+    # whitelists
+    barcodes = pd.read_csv(args.barcodes)
+    barcodes["name"] = barcodes["name"].str.replace(r"\s", "_", regex=True)
+    if args.whitelist:
+        whitelists = [parse_whitelist(x) for x in args.whitelist]
+        names = {x[0] for x in whitelists}
+        barcodes = barcodes[barcodes["name"].isin(names)]
+    else:
+        whitelists = list(zip(barcodes["name"], barcodes["cell_barcode_length"].astype(int), barcodes["file_path"]))
+    if not whitelists:
+        logging.error("No whitelists provided")
+        sys.exit(1)
+
+    # screen
+    screen = screen_barcodes(args.fastq_r1, whitelists, num_reads=args.num_reads, max_offset=args.max_offset)
+    print(screen.round(4).to_string(index=False), file=sys.stderr)
+
+    # plausible whitelists
+    names = plausible_whitelists(screen, args.min_frac)
+    if names:
+        logging.info(f"Plausible whitelists (>= {args.min_frac}): {', '.join(names)}")
+        barcodes = barcodes[barcodes["name"].isin(names)]
+    else:
+        logging.warning(f"No whitelist with >= {args.min_frac} matching reads; keeping all whitelists")
+
+    # write output
+    for outfile,df in ((args.outfile, screen), (args.barcodes_outfile, barcodes)):
+        outdir = os.path.dirname(outfile)
+        if outdir:
+            os.makedirs(outdir, exist_ok=True)
+        df.to_csv(outfile, index=False)
+        logging.info(f"Output written to: {outfile}")
+
+## script main
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
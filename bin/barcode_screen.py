@@ -0,0 +1,217 @@
+# import
+## batteries
+import gzip
+import logging
+from itertools import islice
+from typing import Dict, List, Sequence, Tuple
+## 3rd party
+import numpy as np
+import pandas as pd
+## pipeline
+from fastq_utils import open_fastq, iter_records
+
+# constants
+## 2-bit codes of the bases; all other characters (e.g., N) are invalid (4)
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _i,_base in enumerate(b"ACGT"):
+    BASE_CODES[_base] = _i
+    BASE_CODES[ord(chr(_base).lower())] = _i
+## max barcode length that can be packed into a uint64
+MAX_K = 32
+## max number of whitelists (bits of the uint64 membership masks)
+MAX_WHITELISTS = 64
+
+# classes
+class WhitelistIndex:
+    """
+    All barcode whitelists of one barcode length, in one structure: the sorted union of the
+    2-bit packed barcodes (uint64), with a bit mask per barcode of the whitelists that contain it.
+    A batch of k-mers is looked up in all whitelists at once via binary search.
+    """
+    def __init__(self, k: int, names: List[str], barcodes: List[np.ndarray]) -> None:
+        """
+        Args:
+            k: Barcode length
+            names: Whitelist names
+            barcodes: Packed barcodes of each whitelist (see `pack_kmers`)
+        """
+        if len(names) > MAX_WHITELISTS:
+            raise ValueError(f"Too many whitelists of length {k}: {len(names)} > {MAX_WHITELISTS}")
+        self.k = k
+        self.names = list(names)
+        kmers = np.concatenate(barcodes) if barcodes else np.empty(0, dtype=np.uint64)
+        bits = np.concatenate([
+            np.full(len(x), np.uint64(1) << np.uint64(i), dtype=np.uint64) for i,x in enumerate(barcodes)
+        ]) if barcodes else np.empty(0, dtype=np.uint64)
+        order = np.argsort(kmers, kind="stable")
+        kmers,bits = kmers[order],bits[order]
+        # union of the barcodes; OR of the whitelist bits of each barcode
+        starts = np.flatnonzero(np.r_[True, kmers[1:] != kmers[:-1]]) if len(kmers) else np.empty(0, dtype=np.int64)
+        self.kmers = kmers[starts]
+        self.masks = np.bitwise_or.reduceat(bits, starts) if len(starts) else np.empty(0, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self.kmers)
+
+    def lookup(self, kmers: np.ndarray) -> np.ndarray:
+        """
+        Look up k-mers in all whitelists.
+        Args:
+            kmers: Packed k-mers (uint64)
+        Returns:
+            Whitelist bit masks (uint64) of the k-mers; 0 = in no whitelist
+        """
+        if len(self.kmers) == 0:
+            return np.zeros(kmers.shape, dtype=np.uint64)
+        idx = np.searchsorted(self.kmers, kmers).clip(max=len(self.kmers) - 1)
+        return np.where(self.kmers[idx] == kmers, self.masks[idx], np.uint64(0))
+
+# functions
+def pack_kmers(codes: np.ndarray) -> np.ndarray:
+    """
+    Pack 2-bit base codes into uint64 k-mers.
+    Args:
+        codes: Base codes (uint8; shape: [n, k]; values 0-3)
+    Returns:
+        Packed k-mers (uint64; shape: [n])
+    """
+    k = codes.shape[1]
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+    return np.bitwise_or.reduce(codes.astype(np.uint64) << shifts, axis=1) if k else np.zeros(len(codes), dtype=np.uint64)
+
+def read_whitelist(path: str, k: int) -> np.ndarray:
+    """
+    Read a barcode whitelist (one barcode per line; plain or gzip-compressed).
+    Barcodes that are not of length `k`, or contain non-ACGT characters, are skipped.
+    Args:
+        path: Whitelist file
+        k: Barcode length
+    Returns:
+        Packed barcodes (uint64, unique & sorted)
+    """
+    if k > MAX_K:
+        raise ValueError(f"Barcode length > {MAX_K}: {k}")
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as inF:
+        lines = [x for x in inF.read().split() if len(x) == k]
+    if not lines:
+        logging.warning(f"No barcodes of length {k} in: {path}")
+        return np.empty(0, dtype=np.uint64)
+    codes = BASE_CODES[np.frombuffer(b"".join(lines), dtype=np.uint8).reshape(-1, k)]
+    codes = codes[(codes < 4).all(axis=1)]
+    return np.unique(pack_kmers(codes))
+
+def build_indices(whitelists: Sequence[Tuple[str, int, str]]) -> Dict[int, WhitelistIndex]:
+    """
+    Load the whitelists, into one index per barcode length.
+    Args:
+        whitelists: (name, barcode length, file) of each whitelist
+    Returns:
+        {barcode length: index}
+    """
+    by_length = {}
+    for name,k,path in whitelists:
+        barcodes = read_whitelist(path, int(k))
+        logging.info(f"Loaded {len(barcodes)} barcodes (length {k}): {name}")
+        by_length.setdefault(int(k), ([], []))
+        by_length[int(k)][0].append(name)
+        by_length[int(k)][1].append(barcodes)
+    return {k: WhitelistIndex(k, names, barcodes) for k,(names,barcodes) in by_length.items()}
+
+def read_prefixes(fastq_file: str, width: int, num_reads: int) -> np.ndarray:
+    """
+    Read the first `width` bases of the first `num_reads` reads (one pass; shorter reads are padded with N).
+    Args:
+        fastq_file: Fastq file (plain, gzip- or zstd-compressed)
+        width: Number of bases per read
+        num_reads: Max number of reads
+    Returns:
+        Base codes (uint8; shape: [reads, width]; invalid bases = 4)
+    """
+    inF = open_fastq(fastq_file)
+    try:
+        seqs = [
+            rec.split(b"\n", 2)[1][:width].ljust(width, b"N")
+            for rec in islice(iter_records(inF), num_reads)
+        ]
+    finally:
+        inF.close()
+    if not seqs:
+        return np.empty((0, width), dtype=np.uint8)
+    return BASE_CODES[np.frombuffer(b"".join(seqs), dtype=np.uint8).reshape(-1, width)]
+
+def match_masks(codes: np.ndarray, index: WhitelistIndex) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Match barcodes (e.g., read prefixes) to all whitelists of an index,
+    exactly and with up to 1 mismatch (incl. a single N).
+    Args:
+        codes: Base codes of the barcodes (uint8; shape: [n, k])
+        index: Whitelist index
+    Returns:
+        (exact match masks, exact-or-1-mismatch match masks), uint64 whitelist bit masks per barcode
+    """
+    n,k = codes.shape
+    num_n = (codes > 3).sum(axis=1)
+    kmers = pack_kmers(np.where(codes > 3, 0, codes))
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+    exact = np.where(num_n == 0, index.lookup(kmers), np.uint64(0))
+    mm1 = exact.copy()
+    # no N: all 3k substitutions
+    no_n = np.flatnonzero(num_n == 0)
+    kmers_no_n = kmers[no_n]
+    mm1_no_n = mm1[no_n]
+    for shift in shifts:
+        for d in (1, 2, 3):
+            mm1_no_n |= index.lookup(kmers_no_n ^ (np.uint64(d) << shift))
+    mm1[no_n] = mm1_no_n
+    # a single N: the 4 bases at the N position
+    one_n = np.flatnonzero(num_n == 1)
+    if len(one_n):
+        n_shift = shifts[np.argmax(codes[one_n] > 3, axis=1)]
+        for d in (0, 1, 2, 3):
+            mm1[one_n] |= index.lookup(kmers[one_n] ^ (np.uint64(d) << n_shift))
+    return exact, mm1
+
+def screen_barcodes(
+    fastq_file: str, whitelists: Sequence[Tuple[str, int, str]], num_reads: int=100000, max_offset: int=0
+    ) -> pd.DataFrame:
+    """
+    Fraction of reads with a cell barcode (the read prefix at each offset) in each whitelist.
+    All whitelists are loaded once (see `build_indices`), and the fastq file is read once.
+    Args:
+        fastq_file: Fastq file with the cell barcodes (read 1)
+        whitelists: (name, barcode length, file) of each whitelist
+        num_reads: Number of reads to screen
+        max_offset: Max offset of the barcode in the reads (STARsolo CB_UMI_Simple: 0)
+    Returns:
+        Table of: barcodes_name, cell_barcode_length, offset, reads, exact_frac, mm1_frac
+    """
+    indices = build_indices(whitelists)
+    max_k = max(indices) if indices else 0
+    codes = read_prefixes(fastq_file, max_k + max_offset, num_reads)
+    logging.info(f"Screening {len(codes)} reads of: {fastq_file}")
+    rows = []
+    for k,index in sorted(indices.items()):
+        for offset in range(max_offset + 1):
+            exact,mm1 = match_masks(codes[:, offset:offset + k], index)
+            for i,name in enumerate(index.names):
+                bit = np.uint64(1) << np.uint64(i)
+                rows.append({
+                    "barcodes_name": name, "cell_barcode_length": k, "offset": offset, "reads": len(codes),
+                    "exact_frac": float(((exact & bit) > 0).mean()) if len(codes) else 0.0,
+                    "mm1_frac": float(((mm1 & bit) > 0).mean()) if len(codes) else 0.0,
+                })
+    columns = ["barcodes_name", "cell_barcode_length", "offset", "reads", "exact_frac", "mm1_frac"]
+    return pd.DataFrame(rows, columns=columns)
+
+def plausible_whitelists(screen: pd.DataFrame, min_frac: float) -> List[str]:
+    """
+    Whitelists with a fraction of reads matching (exact or 1 mismatch) at offset 0 of >= `min_frac`.
+    Args:
+        screen: Screen table (see `screen_barcodes`)
+        min_frac: Min fraction of matching reads
+    Returns:
+        Whitelist names
+    """
+    df = screen[(screen["offset"] == 0) & (screen["mm1_frac"] >= min_frac)]
+    return df["barcodes_name"].drop_duplicates().tolist()
@@ -0,0 +1,201 @@
+# import
+## batteries
+import os
+import shlex
+import asyncio
+import logging
+from time import monotonic
+from subprocess import Popen, PIPE, DEVNULL
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Union
+
+# constants
+## max number of bytes of stdout (head) & stderr (tail) that are kept
+MAX_OUTPUT = 1 << 24
+MAX_ERR = 1 << 20
+## size of the reads from stdout
+READ_SIZE = 1 << 16
+## interval (seconds) at which the peak RSS of a running command is sampled
+RSS_INTERVAL = 0.5
+
+# classes
+class CmdResult(NamedTuple):
+    """
+    Result of a command: exit code, captured output & resource usage.
+    """
+    cmd: str
+    returncode: int
+    output: bytes
+    err: bytes
+    wall: float
+    cpu: float
+    max_rss_mb: float
+    timed_out: bool
+
+# functions
+def _fmt_cmd(cmd: Union[str, Sequence]) -> List[str]:
+    if isinstance(cmd, str):
+        return shlex.split(cmd)
+    return [str(x) for x in cmd]
+
+async def _read_stdout(stream: asyncio.StreamReader, max_bytes: int) -> bytes:
+    """
+    Read a stream to EOF, keeping the first `max_bytes`.
+    """
+    out = bytearray()
+    while True:
+        data = await stream.read(READ_SIZE)
+        if not data:
+            return bytes(out)
+        if len(out) < max_bytes:
+            out += data[:max_bytes - len(out)]
+
+async def _read_stderr(stream: asyncio.StreamReader, max_bytes: int, prog: Optional[str]) -> bytes:
+    """
+    Read a stream to EOF, line by line, keeping the last `max_bytes`.
+    Args:
+        stream: Stream
+        max_bytes: Max number of bytes kept
+        prog: If not None, each line is logged (prefixed by `prog`) as it arrives
+    Returns:
+        The (tail of the) stream
+    """
+    err = bytearray()
+    while True:
+        try:
+            line = await stream.readline()
+        except ValueError:
+            # line longer than the stream buffer limit
+            line = await stream.read(READ_SIZE)
+        if not line:
+            return bytes(err)
+        if prog is not None and line.strip():
+            logging.info(f"[{prog}] {line.decode(errors='replace').rstrip()}")
+        err += line
+        if len(err) > max_bytes:
+            del err[:len(err) - max_bytes]
+
+def _peak_rss_mb(pid: int) -> Optional[float]:
+    """
+    Get the peak RSS (VmHWM) of a running process from /proc (Linux).
+    (`ru_maxrss` of a child includes the RSS of the parent at fork, so it is not used.)
+    Args:
+        pid: Process ID
+    Returns:
+        Peak RSS (MB); None if not available
+    """
+    try:
+        with open(f"/proc/{pid}/status") as inF:
+            for line in inF:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+async def _connect(pipe, loop: asyncio.AbstractEventLoop) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader(limit=READ_SIZE)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader
+
+async def run_cmd_async(cmd: Union[str, Sequence], timeout: Optional[float]=None, log_stderr: bool=True,
+                        max_output: int=MAX_OUTPUT, max_err: int=MAX_ERR) -> CmdResult:
+    """
+    Run a command (without a shell), streaming its stderr lines to the logger.
+    The process is reaped via wait4(), so its CPU time is recorded; its peak RSS is
+    sampled every `RSS_INTERVAL` seconds while it runs (0 if it exits before the first sample).
+    Args:
+        cmd: Command (list of arguments, or a string that is split as by a shell)
+        timeout: Timeout (seconds); the process is killed after the timeout
+        log_stderr: Log each stderr line as it arrives
+        max_output: Max number of bytes of stdout kept (the head)
+        max_err: Max number of bytes of stderr kept (the tail)
+    Returns:
+        Command result
+    """
+    cmd = _fmt_cmd(cmd)
+    cmd_str = " ".join(cmd)
+    logging.info(f"Running: {cmd_str}")
+    loop = asyncio.get_running_loop()
+    start = monotonic()
+    try:
+        proc = Popen(cmd, stdin=DEVNULL, stdout=PIPE, stderr=PIPE)
+    except OSError as e:
+        return CmdResult(cmd_str, 127, b"", str(e).encode(), 0.0, 0.0, 0.0, False)
+    prog = os.path.basename(cmd[0]) if log_stderr else None
+    readers = asyncio.gather(
+        _read_stdout(await _connect(proc.stdout, loop), max_output),
+        _read_stderr(await _connect(proc.stderr, loop), max_err, prog)
+    )
+    wait = loop.run_in_executor(None, os.wait4, proc.pid, 0)
+    timed_out = False
+    max_rss_mb = 0.0
+    deadline = None if timeout is None else start + timeout
+    while not wait.done():
+        interval = RSS_INTERVAL if deadline is None else max(0, min(RSS_INTERVAL, deadline - monotonic()))
+        try:
+            await asyncio.wait_for(asyncio.shield(wait), interval)
+        except asyncio.TimeoutError:
+            max_rss_mb = max(max_rss_mb, _peak_rss_mb(proc.pid) or 0.0)
+            if deadline is not None and monotonic() >= deadline:
+                timed_out = True
+                logging.warning(f"Timeout ({timeout} sec): {cmd_str}")
+                proc.kill()
+                break
+    _,status,rusage = await wait
+    # the process is reaped; prevent Popen from waiting on it
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    output,err = await readers
+    result = CmdResult(
+        cmd=cmd_str,
+        returncode=proc.returncode,
+        output=output,
+        err=err,
+        wall=monotonic() - start,
+        cpu=rusage.ru_utime + rusage.ru_stime,
+        max_rss_mb=max_rss_mb,
+        timed_out=timed_out
+    )
+    logging.info(
+        f"Finished: {os.path.basename(cmd[0])} (exit={result.returncode}, wall={result.wall:.2f}s, "
+        f"cpu={result.cpu:.2f}s, max_rss={result.max_rss_mb:.1f}MB)"
+    )
+    return result
+
+async def run_cmds_async(cmds: Iterable[Union[str, Sequence]], max_concurrency: int=4, **kwargs) -> List[CmdResult]:
+    """
+    Run commands concurrently, with at most `max_concurrency` running at once.
+    Args:
+        cmds: Commands
+        max_concurrency: Max number of concurrent commands
+        kwargs: Passed to `run_cmd_async`
+    Returns:
+        Command results, in the order of `cmds`
+    """
+    sem = asyncio.Semaphore(max(max_concurrency, 1))
+    async def run(cmd):
+        async with sem:
+            return await run_cmd_async(cmd, **kwargs)
+    return await asyncio.gather(*[run(cmd) for cmd in cmds])
+
+def run_cmd(cmd: Union[str, Sequence], **kwargs) -> CmdResult:
+    """
+    Run a command (blocking); see `run_cmd_async`.
+    Args:
+        cmd: Command
+        kwargs: Passed to `run_cmd_async`
+    Returns:
+        Command result
+    """
+    return asyncio.run(run_cmd_async(cmd, **kwargs))
+
+def run_cmds(cmds: Iterable[Union[str, Sequence]], max_concurrency: int=4, **kwargs) -> List[CmdResult]:
+    """
+    Run commands concurrently (blocking); see `run_cmds_async`.
+    Args:
+        cmds: Commands
+        max_concurrency: Max number of concurrent commands
+        kwargs: Passed to `run_cmd_async`
+    Returns:
+        Command results, in the order of `cmds`
+    """
+    return asyncio.run(run_cmds_async(cmds, max_concurrency, **kwargs))
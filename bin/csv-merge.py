@@ -5,7 +5,8 @@ import os
 import sys
 import argparse
 import logging
-import pandas as pd
+## pipeline
+from table_utils import read_csv, write_csv, union_columns
 
 # logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
@@ -18,6 +19,8 @@ class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
 desc = 'Merge csv files'
 epi = """DESCRIPTION:
 Merge multiple csv files into a single table.
+Columns are combined in order of first appearance; values are copied as-is
+(stdlib csv only, for a fast startup).
 """
 parser = argparse.ArgumentParser(description=desc, epilog=epi,
                                  formatter_class=CustomFormatter)
@@ -31,18 +34,19 @@ parser.add_argument('--outfile', type=str, default='merged.csv',
 # functions
 def main(args):
     # read in files
-    tables = [pd.read_csv(f) for f in args.csv_files]
+    tables = [read_csv(f) for f in args.csv_files]
     # merge
-    df = pd.concat(tables, ignore_index=True)
+    cols = union_columns([columns for columns,_ in tables])
+    records = [record for _,table in tables for record in table]
     # add sample name, if provided
     if args.sample:
         # add sample name
-        df['sample'] = args.sample
+        for record in records:
+            record['sample'] = args.sample
         # reorder columns
-        cols = ['sample'] + [c for c in df.columns if c != 'sample']
-        df = df[cols]
+        cols = ['sample'] + [c for c in cols if c != 'sample']
     # write
-    df.to_csv(args.outfile, index=False)
+    write_csv(args.outfile, records, cols)
     logging.info(f'Output written to: {args.outfile}')
 
 ## script main
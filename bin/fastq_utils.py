@@ -0,0 +1,485 @@
+# import
+## batteries
+import os
+import gzip
+import math
+import zlib
+import random
+from itertools import islice
+from subprocess import Popen, PIPE, DEVNULL
+from collections import Counter
+from typing import Any, BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+# constants
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+## intermediate fastq compression methods => file extension
+COMPRESSION_EXT = {"zstd": ".zst", "bgzf": ".gz"}
+## reads no longer than this (bp) are considered index/technical reads (e.g., i7/i5 indices)
+INDEX_READ_MAX_LENGTH = 12
+## block size for binary reads
+BLOCK_SIZE = 1 << 16
+## block size for streaming whole files
+STREAM_BLOCK_SIZE = 1 << 22
+## max distance (bytes) from the expected offset to search for the mate of a read (stride sampling)
+MATE_SEARCH_WINDOW = 1 << 20
+## subsampling modes
+SAMPLE_MODES = ("head", "reservoir", "stride")
+
+# classes
+class ReadLengthStats(NamedTuple):
+    """
+    Read length statistics for a sample of reads from a fastq file.
+    """
+    num_reads: int
+    mean: float
+    min: int
+    max: int
+    mode: int
+    is_index: bool
+
+# functions
+def is_gzip(fastq_file: str) -> bool:
+    """
+    Determine if a file is gzip-compressed, based on the magic bytes.
+    Args:
+        fastq_file: Fastq file
+    Returns:
+        True if gzip-compressed
+    """
+    return compression_format(fastq_file) == "gzip"
+
+def compression_format(fastq_file: str) -> Optional[str]:
+    """
+    Determine the compression format of a file, based on the magic bytes.
+    Args:
+        fastq_file: Fastq file
+    Returns:
+        "gzip" (including bgzf), "zstd", or None (uncompressed)
+    """
+    with open(fastq_file, "rb") as inF:
+        magic = inF.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic == ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+def compress_cmd(method: str, threads: int=1) -> List[str]:
+    """
+    Create a command that compresses stdin to stdout.
+    Args:
+        method: Compression method ("zstd" or "bgzf")
+        threads: Number of compression threads
+    Returns:
+        Command
+    """
+    if method == "zstd":
+        return ["zstd", "-q", "-c", f"-T{threads}"]
+    if method == "bgzf":
+        return ["bgzip", "-c", "-@", str(threads)]
+    raise ValueError(f"Invalid compression method: {method}")
+
+def decompress_cmd(fastq_file: str) -> List[str]:
+    """
+    Create a command that decompresses a file to stdout.
+    Args:
+        fastq_file: Compressed fastq file
+    Returns:
+        Command
+    """
+    fmt = compression_format(fastq_file)
+    if fmt == "zstd":
+        return ["zstd", "-q", "-d", "-c", fastq_file]
+    if fmt == "gzip":
+        return ["gzip", "-d", "-c", fastq_file]
+    return ["cat", fastq_file]
+
+def compress_file(fastq_file: str, method: str, threads: int=1) -> str:
+    """
+    Compress a file in place (the uncompressed file is removed).
+    Args:
+        fastq_file: Fastq file
+        method: Compression method ("zstd" or "bgzf")
+        threads: Number of compression threads
+    Returns:
+        Path of the compressed file
+    """
+    out_file = fastq_file + COMPRESSION_EXT[method]
+    with open(fastq_file, "rb") as inF, open(out_file, "wb") as outF:
+        proc = Popen(compress_cmd(method, threads), stdin=inF, stdout=outF)
+        if proc.wait() != 0:
+            raise IOError(f"Failed to compress {fastq_file}: exit code {proc.returncode}")
+    os.remove(fastq_file)
+    return out_file
+
+def read_head(fastq_file: str, max_bytes: int) -> bytes:
+    """
+    Read up to `max_bytes` of (decompressed) data from the start of a file.
+    gzip files (including multi-member files, such as bgzf) are decompressed
+    directly via zlib, and only as many blocks as needed are read.
+    zstd files are decompressed via `zstd`, which is stopped once enough data is read.
+    Args:
+        fastq_file: Fastq file (plain, gzip- or zstd-compressed)
+        max_bytes: Max number of (decompressed) bytes to return
+    Returns:
+        The file head
+    """
+    with open(fastq_file, "rb") as inF:
+        block = inF.read(BLOCK_SIZE)
+        # zstd
+        if block.startswith(ZSTD_MAGIC):
+            with open_fastq(fastq_file) as zF:
+                return zF.read(max_bytes)
+        # plain text
+        if not block.startswith(GZIP_MAGIC):
+            if len(block) >= max_bytes:
+                return block[:max_bytes]
+            return block + inF.read(max_bytes - len(block))
+        # gzip
+        out = bytearray()
+        dobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while block and len(out) < max_bytes:
+            out += dobj.decompress(block, max_bytes - len(out))
+            if dobj.eof:
+                # start of the next gzip member
+                block = dobj.unused_data or inF.read(BLOCK_SIZE)
+                dobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            elif dobj.unconsumed_tail:
+                block = dobj.unconsumed_tail
+            else:
+                block = inF.read(BLOCK_SIZE)
+        return bytes(out)
+
+def sample_read_lengths(fastq_file: str, num_reads: int=200, max_bytes: int=1 << 20) -> ReadLengthStats:
+    """
+    Get read length statistics from the first `num_reads` reads of a fastq file.
+    Only a bounded window (`max_bytes`) at the start of the file is read;
+    the sequence lines are measured in place, without decoding.
+    Args:
+        fastq_file: Fastq file (plain, gzip- or zstd-compressed)
+        num_reads: Max number of reads to sample
+        max_bytes: Max number of (decompressed) bytes to read
+    Returns:
+        Read length statistics
+    """
+    data = read_head(fastq_file, max_bytes)
+    lengths = Counter()
+    num_lines = num_reads * 4
+    start = 0
+    line_num = 0
+    while line_num < num_lines:
+        end = data.find(b"\n", start)
+        if end < 0:
+            break
+        if line_num % 4 == 1:
+            seq_len = end - start
+            if seq_len > 0 and data[end - 1] == 13:  # \r
+                seq_len -= 1
+            lengths[seq_len] += 1
+        start = end + 1
+        line_num += 1
+    return read_length_stats(lengths)
+
+def read_length_stats(lengths: Counter) -> ReadLengthStats:
+    """
+    Summarize read lengths.
+    Args:
+        lengths: Counts of reads per read length
+    Returns:
+        Read length statistics
+    """
+    num_reads = sum(lengths.values())
+    if num_reads == 0:
+        return ReadLengthStats(0, 0.0, 0, 0, 0, False)
+    max_len = max(lengths)
+    return ReadLengthStats(
+        num_reads=num_reads,
+        mean=sum(k * v for k,v in lengths.items()) / num_reads,
+        min=min(lengths),
+        max=max_len,
+        mode=lengths.most_common(1)[0][0],
+        is_index=max_len <= INDEX_READ_MAX_LENGTH
+    )
+
+def filter_read_lengths(read_stats: Dict[Any, ReadLengthStats], min_read_length: int) -> Dict[Any, float]:
+    """
+    Filter reads (files or read numbers) by read length; index/technical reads are always removed.
+    Args:
+        read_stats: Read length statistics per read
+        min_read_length: Minimum mean read length
+    Returns:
+        Mean read length of each read that passed the filter
+    """
+    return {
+        k: stats.mean for k,stats in read_stats.items() 
+        if stats.mean >= min_read_length and not stats.is_index
+    }
+
+def assign_reads(read_lens: Dict[Any, float]) -> Dict[str, Any]:
+    """
+    Assign read 1 & read 2 among reads (files or read numbers), by mean read length:
+    - If there is only one read, it is read 1.
+    - Otherwise, the 2 longest reads are used:
+      * If the lengths differ, the longer is read 2 (cDNA) and the shorter is read 1 (barcode + UMI).
+      * If the lengths are the same, they are assigned in sorted (name) order.
+    Args:
+        read_lens: Mean read length per read
+    Returns:
+        {"R1": <read>, "R2": <read>}; "R2" is absent if there is only one read
+    """
+    if not read_lens:
+        return {}
+    if len(read_lens) == 1:
+        return {"R1": next(iter(read_lens))}
+    top_two = sorted(read_lens.items(), key=lambda x: x[1], reverse=True)[:2]
+    if top_two[0][1] == top_two[1][1]:
+        first,second = sorted(k for k,_ in top_two)
+        return {"R1": first, "R2": second}
+    return {"R1": top_two[1][0], "R2": top_two[0][0]}
+
+def open_fastq(fastq_file: str) -> BinaryIO:
+    """
+    Open a (plain, gzip- or zstd-compressed) fastq file for binary reading.
+    Compression is determined from the magic bytes, not the file extension.
+    zstd files are read from the stdout of `zstd -d`.
+    Args:
+        fastq_file: Fastq file
+    Returns:
+        Binary file object
+    """
+    fmt = compression_format(fastq_file)
+    if fmt == "gzip":
+        return gzip.open(fastq_file, "rb")
+    if fmt == "zstd":
+        proc = Popen(decompress_cmd(fastq_file), stdout=PIPE, stdin=DEVNULL, bufsize=STREAM_BLOCK_SIZE)
+        return proc.stdout
+    return open(fastq_file, "rb", buffering=STREAM_BLOCK_SIZE)
+
+def iter_records(inF: BinaryIO, block_size: int=STREAM_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Iterate over fastq records (4 lines each), reading the file in large blocks.
+    Args:
+        inF: Binary file object
+        block_size: Number of bytes to read per block
+    Yields:
+        Records, including the trailing newline
+    """
+    leftover = b""
+    pending = []
+    while True:
+        block = inF.read(block_size)
+        if not block:
+            break
+        lines = (leftover + block).split(b"\n")
+        leftover = lines.pop()
+        if pending:
+            lines = pending + lines
+        n = len(lines) - len(lines) % 4
+        for i in range(0, n, 4):
+            yield b"\n".join(lines[i:i+4]) + b"\n"
+        pending = lines[n:]
+    if leftover:
+        pending.append(leftover)
+    if len(pending) == 4:
+        yield b"\n".join(pending) + b"\n"
+
+def iter_read_sets(fastq_files: Sequence[str]) -> Iterator[Tuple[bytes, ...]]:
+    """
+    Iterate over records of 1 or more synchronized fastq files (e.g., R1 & R2).
+    Iteration stops at the end of the shortest file.
+    Args:
+        fastq_files: Fastq files
+    Yields:
+        Tuples of records (one per file)
+    """
+    handles = [open_fastq(f) for f in fastq_files]
+    try:
+        yield from zip(*[iter_records(h) for h in handles])
+    finally:
+        for h in handles:
+            h.close()
+
+def head_reads(fastq_files: Sequence[str], num_reads: int) -> List[Tuple[bytes, ...]]:
+    """
+    Select the first `num_reads` reads.
+    Args:
+        fastq_files: Fastq files (e.g., R1 & R2)
+        num_reads: Number of reads to select
+    Returns:
+        Tuples of records (one per file)
+    """
+    return list(islice(iter_read_sets(fastq_files), num_reads))
+
+def reservoir_reads(fastq_files: Sequence[str], num_reads: int, seed: int=0) -> List[Tuple[bytes, ...]]:
+    """
+    Select a uniform random sample of `num_reads` reads via reservoir sampling (Algorithm L).
+    All reads are streamed, but random numbers are only drawn for the selected reads.
+    Args:
+        fastq_files: Fastq files (e.g., R1 & R2)
+        num_reads: Number of reads to select
+        seed: Random seed
+    Returns:
+        Tuples of records (one per file), in file order
+    """
+    if num_reads <= 0:
+        return []
+    rng = random.Random(seed)
+    reads = iter_read_sets(fastq_files)
+    reservoir = list(enumerate(islice(reads, num_reads)))
+    if len(reservoir) == num_reads:
+        w = math.exp(math.log(1 - rng.random()) / num_reads)
+        idx = num_reads - 1
+        while True:
+            skip = int(math.log(1 - rng.random()) / math.log(1 - w)) if w < 1 else 0
+            read = next(islice(reads, skip, None), None)
+            if read is None:
+                break
+            idx += skip + 1
+            reservoir[rng.randrange(num_reads)] = (idx, read)
+            w *= math.exp(math.log(1 - rng.random()) / num_reads)
+    reservoir.sort(key=lambda x: x[0])
+    return [read for _,read in reservoir]
+
+def stride_reads(fastq_files: Sequence[str], num_reads: int, seed: int=0) -> List[Tuple[bytes, ...]]:
+    """
+    Select `num_reads` reads spread evenly across uncompressed fastq files, by seeking.
+    The first file is split into `num_reads` equal byte ranges, and the first record
+    after a random offset in each range is selected; mates are found in the other
+    files by read name, near the offset expected from the previous mate.
+    Only the selected records are read, so the run time does not depend on file size.
+    Args:
+        fastq_files: Uncompressed fastq files (e.g., R1 & R2)
+        num_reads: Number of reads to select
+        seed: Random seed
+    Returns:
+        Tuples of records (one per file), in file order
+    """
+    if num_reads <= 0:
+        return []
+    rng = random.Random(seed)
+    sizes = [os.path.getsize(f) for f in fastq_files]
+    handles = [open(f, "rb") for f in fastq_files]
+    try:
+        # small files: read all
+        first = record_at(handles[0], 0)[0]
+        if first is None or sizes[0] / num_reads < 2 * len(first):
+            return head_reads(fastq_files, num_reads)
+        # sample
+        step = sizes[0] / num_reads
+        reads, last_end = [], 0
+        anchors = [0] * len(handles)
+        for i in range(num_reads):
+            offset = int((i + rng.random()) * step)
+            rec,start = record_at(handles[0], offset)
+            if rec is not None and start < last_end:
+                # same record as the previous range; use the next record instead
+                rec,start = record_at(handles[0], last_end - 1)
+            if rec is None:
+                continue
+            last_end = start + len(rec)
+            read = [rec]
+            for j in range(1, len(handles)):
+                # expected offset, relative to the last record found in both files
+                expected = anchors[j] + int((start - anchors[0]) * sizes[j] / sizes[0])
+                mate,mate_start = find_record(handles[j], read_name(rec), expected)
+                if mate is None:
+                    break
+                read.append(mate)
+                anchors[j] = mate_start
+            if len(read) == len(handles):
+                reads.append(tuple(read))
+                anchors[0] = start
+        return reads
+    finally:
+        for h in handles:
+            h.close()
+
+def record_at(inF: BinaryIO, offset: int) -> Tuple[Optional[bytes], Optional[int]]:
+    """
+    Get the first complete fastq record at or after a byte offset.
+    Args:
+        inF: Binary file object (seekable)
+        offset: Byte offset
+    Returns:
+        (record, offset of the record); (None, None) if no record was found
+    """
+    inF.seek(offset)
+    if offset > 0:
+        # skip the (possibly partial) current line
+        inF.readline()
+    lines, starts = [], []
+    for _ in range(8):
+        starts.append(inF.tell())
+        lines.append(inF.readline())
+    # a header line is followed by the sequence and a "+" line
+    # (a quality line starting with "@" is followed by a sequence line)
+    for j in range(5):
+        if lines[j].startswith(b"@") and lines[j+2].startswith(b"+") and lines[j+3]:
+            return b"".join(lines[j:j+4]), starts[j]
+    return None, None
+
+def find_record(inF: BinaryIO, name: bytes, offset: int, window: int=MATE_SEARCH_WINDOW) -> Tuple[Optional[bytes], Optional[int]]:
+    """
+    Find a fastq record by read name, near an expected byte offset.
+    The search range around the offset is widened (up to `window`) until the record is found.
+    Args:
+        inF: Binary file object (seekable)
+        name: Read name (see `read_name`)
+        offset: Expected byte offset of the record
+        window: Max distance (bytes) from the expected offset to search
+    Returns:
+        (record, offset of the record); (None, None) if not found
+    """
+    dist = 1 << 12
+    while True:
+        dist = min(dist, window)
+        rec,start = record_at(inF, max(0, offset - dist))
+        if rec is None:
+            return None, None
+        inF.seek(start)
+        for rec in iter_records(inF, min(2 * dist, BLOCK_SIZE)):
+            if read_name(rec) == name:
+                return rec, start
+            start += len(rec)
+            if start > offset + dist:
+                break
+        if dist >= window:
+            return None, None
+        dist <<= 3
+
+def read_name(record: bytes) -> bytes:
+    """
+    Get the read name of a fastq record (without any /1 or /2 suffix).
+    Args:
+        record: Fastq record
+    Returns:
+        Read name
+    """
+    name = record[1:record.find(b"\n")].split(None, 1)[0]
+    if name[-2:] in (b"/1", b"/2"):
+        name = name[:-2]
+    return name
+
+def subsample_reads(fastq_files: Sequence[str], num_reads: int, mode: str="head", seed: int=0) -> List[Tuple[bytes, ...]]:
+    """
+    Subsample reads from 1 or more synchronized fastq files (e.g., R1 & R2).
+    Args:
+        fastq_files: Fastq files (plain, gzip- or zstd-compressed)
+        num_reads: Number of reads to select
+        mode: "head" (first reads), "reservoir" (uniform random sample),
+              or "stride" (evenly-spaced, seek-based; uncompressed files only,
+              otherwise "reservoir" is used)
+        seed: Random seed
+    Returns:
+        Tuples of records (one per file), in file order
+    """
+    if mode not in SAMPLE_MODES:
+        raise ValueError(f"Invalid subsample mode: {mode}")
+    if mode == "stride" and any(compression_format(f) for f in fastq_files):
+        mode = "reservoir"
+    if mode == "stride":
+        return stride_reads(fastq_files, num_reads, seed)
+    if mode == "reservoir":
+        return reservoir_reads(fastq_files, num_reads, seed)
+    return head_reads(fastq_files, num_reads)
@@ -7,7 +7,10 @@ import re
 import sys
 import argparse
 import logging
-import pandas as pd
+## pipeline
+from table_utils import write_csv
+from star_summary import read_summary
+from param_cache import CACHE_URI, get_backend, put_cached
 
 # logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
@@ -45,15 +48,19 @@ parser.add_argument('--organism', type=str, default=None,
                     help='Organism')
 parser.add_argument('--star-index', type=str, default=None,
                     help='STAR index path')
+parser.add_argument('--barcodes-stamp', type=str, default="",
+                    help='Barcodes file stamp (param cache key); "" = from the local file, if any')
+parser.add_argument('--star-index-stamp', type=str, default="",
+                    help='STAR index stamp (param cache key); "" = from the local directory, if any')
 parser.add_argument('--outfile', type=str, default="star_params.csv",
                     help='Output file path')
+parser.add_argument('--read-fingerprint', type=str, default=None,
+                    help='Read fingerprint (from param-cache.py); if provided, the output is added to the param cache')
+parser.add_argument('--cache', type=str, default=CACHE_URI,
+                    help='Param cache location: "db", or a directory; "" = disabled')
 
 # functions
 def main(args):
-    # set pandas display optionqs
-    pd.set_option('display.max_columns', 30)
-    pd.set_option('display.width', 300)
-
     # create param table
     star_params = {
         "sample" : args.sample,
@@ -66,32 +73,22 @@ def main(args):
         "organism" : args.organism,
         "star_index" : args.star_index
     }
-    # convert to dataframe
-    star_params = pd.DataFrame([star_params])
-
-    # print to stderr
-    #print("#-- raw dataframe --#", file=sys.stderr)
-    #star_params.to_csv(sys.stderr, index=False)
-
-    # read star summary
-    star_summary = pd.read_csv(args.star_summary_csv, header=None)
-    star_summary["sample"] = args.sample
-    star_summary["accession"] = args.accession 
-    # pivot
-    star_summary = star_summary.pivot(index=["sample", "accession"], columns=0, values=1) 
-    star_summary["sample"] = star_summary.index.get_level_values('sample')  
-    star_summary["accession"] = star_summary.index.get_level_values('accession')
-    star_summary.reset_index(drop=True, inplace=True)
+    columns = list(star_params.keys())
 
-    # merge dataframes on sample and accession
-    star_params = star_params.merge(star_summary, on=["sample", "accession"], how="inner")
-
-    # print to stderr
-    #print("#-- final dataframe --#", file=sys.stderr)
-    #star_params.to_csv(sys.stderr, index=False)
+    # read star summary; add the metrics as columns (sorted, as a pivot)
+    star_summary = read_summary(args.star_summary_csv)
+    metrics = sorted(k for k in star_summary if k not in star_params)
+    star_params.update({k: star_summary[k] for k in metrics})
+    records = [star_params] if star_summary else []
 
     # write to file
-    star_params.to_csv(args.outfile, index=False)
+    write_csv(args.outfile, records, columns + metrics)
+
+    # add to the param cache; an empty STAR summary is not cached (the param set must be rerun)
+    backend = get_backend(args.cache)
+    if args.read_fingerprint and backend is not None and records:
+        with open(args.outfile) as inF:
+            put_cached(backend, args.read_fingerprint, vars(args), inF.read())
 
 
 ## script main
@@ -4,17 +4,23 @@ from __future__ import print_function
 import os
 import re
 import sys
-import gzip
 import argparse
 import logging
+import tempfile
+import threading
 from glob import glob
 from time import sleep
-from shutil import which, rmtree
-from typing import Dict
-from subprocess import Popen, PIPE
-import pandas as pd
-from db_utils import db_connect, db_upsert, add_to_log
+from shutil import which, rmtree, copyfileobj
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from subprocess import Popen, PIPE, DEVNULL
+from db_utils import LogSink
+from telemetry import Telemetry, file_size_gb
+from fastq_utils import sample_read_lengths, filter_read_lengths, assign_reads, iter_records
+from fastq_utils import COMPRESSION_EXT, compress_cmd, compress_file
+from read_stream import CHUNK_SIZE, QueueWriter, fasterq_dump_stdout_cmd, read_number
 from prefetch import prefetch_workflow
+from cmd_runner import run_cmd
 
 # logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
@@ -29,10 +35,25 @@ epi = """DESCRIPTION:
 Run fastq-dump or fasterq-dump on an SRA file or accession.
 If the --maxSpotId option is >0, then (parallel-)fastq-dump is used; otherwise, prefetch + fasterq-dump is used.
 If --threads >1, parallel-fastq-dump is used instead of fastq-dump.
+
+With --compress (zstd or bgzf), the read files are written compressed (e.g., read_1.fastq.zst):
+- fasterq-dump: reads are streamed from `fasterq-dump --split-spot --stdout` into one
+  (multi-threaded) compressor per read, so uncompressed fastq files are never written
+- parallel-fastq-dump: each chunk is compressed by its worker
+- fastq-dump: the read files are compressed after the dump
+Read files are detected & read by content, so compressed files can be used by all
+downstream steps (e.g., STAR with `--readFilesCommand zstd -dc` or `zcat`).
+
+Multiple accessions (e.g., all SRRs of one SRX): the reads of all accessions are written to
+one set of read files (<outdir>/read_1.fastq & read_2.fastq). With fasterq-dump, up to
+--prefetch-jobs accessions are prefetched concurrently, while the downloaded accessions are
+dumped (in order); the total size of the SRA files downloading or awaiting the dump is limited
+to --max-inflight-gb (sizes via --sra-size-gb, comma-separated; unknown sizes count as 0).
+Read 1 & read 2 are assigned per accession; accessions lacking read 1 or read 2 are skipped.
 """
 parser = argparse.ArgumentParser(description=desc, epilog=epi,
                                  formatter_class=CustomFormatter)
-parser.add_argument('sra_file', type=str, help='SRA file or accession')
+parser.add_argument('sra_file', type=str, nargs='+', help='SRA file(s) or accession(s)')
 parser.add_argument('--sample', type=str, default="",
                     help='Sample name')
 parser.add_argument('--accession', type=str, default="",
@@ -53,116 +74,230 @@ parser.add_argument('--outdir', type=str, default='prefetch_out',
                     help='Output directory')
 parser.add_argument('--min-read-length', type=int, default=28,
                     help='Minimum read length')  
+parser.add_argument('--compress', type=str, default='none', choices=['none'] + list(COMPRESSION_EXT),
+                    help='Compression of the output read files')
+parser.add_argument('--queue-size', type=int, default=16,
+                    help='Max number of 4 MB chunks buffered per compressor (--compress)')
 # prefetch
 parser.add_argument('--max-size-gb', type=int, default=300,
                     help='Max file size in Gb')
+parser.add_argument('--sra-size-gb', type=str, default="",
+                    help='Comma-separated SRA file sizes (GB) of the accessions (e.g., via sra-stat); used for --max-inflight-gb')
+parser.add_argument('--prefetch-jobs', type=int, default=2,
+                    help='Max number of concurrent prefetch downloads (multiple accessions)')
+parser.add_argument('--max-inflight-gb', type=float, default=200,
+                    help='Max total size (GB) of the SRA files downloading or waiting to be dumped (multiple accessions)')
 parser.add_argument('--tries', type=int, default=3,
                     help='Number of tries to download')
 parser.add_argument('--gcp-download', action='store_true', default=False,
                     help='Obtain sequence data from SRA GCP mirror')
+parser.add_argument('--no-db', action='store_true', default=False,
+                    help='Do not write the log & timing records to the database (write them to the JSONL spill file)')
+
+# classes
+class PrefetchQueue:
+    """
+    Prefetch accessions concurrently, in order, ahead of their use.
+    Downloads are limited by the number of concurrent jobs, and by the total size of
+    the SRA files that are downloading or waiting to be dumped (`max_inflight_gb`),
+    which bounds both the share of the network bandwidth & the local disk usage.
+    At least one accession is always in flight, regardless of its size.
+    """
+    def __init__(self, fetch: Callable[[str], Optional[str]], accessions: List[str], 
+                 sizes_gb: List[float], max_jobs: int=2, max_inflight_gb: float=200):
+        self.accessions = accessions
+        self.sizes_gb = sizes_gb
+        self.max_inflight_gb = max_inflight_gb
+        self._fetch = fetch
+        self._inflight_gb = 0.0
+        self._inflight = 0
+        self._futures: Dict[int, Future] = {}
+        self._closed = False
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=max(max_jobs, 1))
+        self._feeder = threading.Thread(target=self._feed, daemon=True)
+        self._feeder.start()
+
+    def _feed(self) -> None:
+        for i,accession in enumerate(self.accessions):
+            size_gb = self.sizes_gb[i]
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or self._inflight == 0 or 
+                    self._inflight_gb + size_gb <= self.max_inflight_gb
+                )
+                if self._closed:
+                    return
+                self._inflight += 1
+                self._inflight_gb += size_gb
+                logging.info(f"Queueing prefetch of {accession} ({size_gb:.2f} GB; {self._inflight_gb:.2f} GB in flight)")
+                self._futures[i] = self._pool.submit(self._fetch, accession)
+                self._cond.notify_all()
+
+    def get(self, i: int) -> Optional[str]:
+        """
+        Wait for the prefetch of the i-th accession.
+        Args:
+            i: Index of the accession
+        Returns:
+            Path of the prefetched SRA file, or None if the download failed
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: i in self._futures)
+            future = self._futures[i]
+        try:
+            return future.result()
+        except Exception as e:
+            logging.warning(f"Prefetch of {self.accessions[i]} failed: {e}")
+            return None
+
+    def release(self, i: int) -> None:
+        """
+        Release the i-th accession (dumped & deleted), so more accessions can be prefetched.
+        Args:
+            i: Index of the accession
+        """
+        with self._cond:
+            self._inflight -= 1
+            self._inflight_gb -= self.sizes_gb[i]
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        """
+        Stop queueing prefetches, cancel the queued ones, and wait for the running ones.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._pool.shutdown(wait=True, cancel_futures=True)
 
 # functions
-def run_cmd(cmd: str) -> tuple:
+def parse_sizes(sizes: str) -> List[float]:
+    """
+    Parse comma-separated file sizes; unknown (non-numeric) sizes are 0.
+    Args:
+        sizes: Comma-separated sizes (e.g., "1.5,,0.2")
+    Returns:
+        Sizes
     """
-    Run sub-command and return returncode, output, and error.
+    parsed = []
+    for x in sizes.split(",") if sizes else []:
+        try:
+            parsed.append(float(x))
+        except ValueError:
+            parsed.append(0.0)
+    return parsed
+
+def run_fasterq_dump_compressed(sra_path: str, accession: str, outdir: str, args: argparse.Namespace) -> Tuple[int, bytes, bytes]:
+    """
+    Run fasterq-dump, streaming the reads into one compressor per read (e.g., `zstd -T<threads>`).
+    Output files: `<outdir>/<accession>_<read_number>.fastq<ext>`, as with `fasterq-dump --split-files`.
     Args:
-        cmd: Command to run
+        sra_path: Prefetched SRA file
+        accession: SRA accession (output file prefix)
+        outdir: Output directory
+        args: Command-line arguments
     Returns:
         tuple: (returncode, output, error)
     """
-    cmd = [str(i) for i in cmd]
-    logging.info(f'Running: {" ".join(cmd)}')
-    p = Popen(cmd, stdout=PIPE, stderr=PIPE)
-    output, err = p.communicate()
-    return p.returncode, output, err
+    cmd = fasterq_dump_stdout_cmd(
+        sra_path, args.threads, args.bufsize, args.curcache, args.mem, args.temp,
+        min_read_len=args.min_read_length
+    )
+    logging.info(f'Running: {" ".join(cmd)} | {" ".join(compress_cmd(args.compress, args.threads))}')
+    errF = tempfile.TemporaryFile()
+    proc = Popen(cmd, stdout=PIPE, stderr=errF, stdin=DEVNULL, bufsize=0)
+
+    # one compressor (and writer thread) per read number, started on first sight
+    writers = {}
+    def get_writer(read_num: bytes) -> QueueWriter:
+        out_file = os.path.join(outdir, f"{accession}_{read_num.decode()}.fastq{COMPRESSION_EXT[args.compress]}")
+        with open(out_file, "wb") as outF:
+            cproc = Popen(compress_cmd(args.compress, args.threads), stdin=PIPE, stdout=outF)
+        writer = QueueWriter(None, cproc, args.queue_size)
+        writer.start()
+        return writer
+
+    # route records by read number
+    num_records = 0
+    error = None
+    try:
+        chunks, chunk_size = {}, 0
+        for rec in iter_records(proc.stdout):
+            read_num = read_number(rec)
+            chunks.setdefault(read_num, []).append(rec)
+            chunk_size += len(rec)
+            num_records += 1
+            if chunk_size >= CHUNK_SIZE:
+                for k,chunk in chunks.items():
+                    if k not in writers:
+                        writers[k] = get_writer(k)
+                    writers[k].put(b"".join(chunk))
+                chunks, chunk_size = {}, 0
+        for k,chunk in chunks.items():
+            if k not in writers:
+                writers[k] = get_writer(k)
+            writers[k].put(b"".join(chunk))
+        for writer in writers.values():
+            writer.put(None)
+    except IOError as e:
+        error = str(e)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+
+    # wait for fasterq-dump & the compressors
+    returncode = proc.wait()
+    for k,writer in writers.items():
+        if error is not None:
+            # the writer threads (daemons) are abandoned
+            writer.proc.kill()
+            writer.proc.wait()
+            continue
+        writer.join()
+        if writer.proc.wait() != 0 and error is None:
+            error = f"Compression of read {k.decode()} failed with exit code {writer.proc.returncode}"
+    errF.seek(0)
+    err = errF.read()
+    errF.close()
+    if error is not None:
+        return returncode or 1, b"", err + error.encode()
+    out_gb = sum(w.bytes_written for w in writers.values()) / 1e9
+    output = f"Wrote {num_records} reads ({len(writers)} read files; {out_gb:.2f} GB uncompressed)"
+    return returncode, output.encode(), err
 
 def get_read_lengths(fastq_file: str, num_lines: int) -> float:
     """
-    Read a fastq file and return the first num_lines.
+    Read a fastq file and return the average read length of the first num_lines.
     Args:
         fastq_file: Fastq file
         num_lines: Number of lines to read
     Returns:
         average read length
     """
-    _open = gzip.open if fastq_file.endswith('.gz') else open
-
-    # get read lengths
-    read_lens = []
-    with _open(fastq_file) as f:
-        for i, line in enumerate(f):
-            if fastq_file.endswith('.gz'):
-                line = line.decode()   
-            if i % 4 == 1:
-                read_lens.append(len(line.strip()))
-            if i >= num_lines:
-                break
-    # return average read length
-    return sum(read_lens) / len(read_lens)
-
-def rename_read_files(read_lens_filt: Dict[str, int], outdir: str) -> Dict[str, str]:
+    return sample_read_lengths(fastq_file, num_reads=max(num_lines // 4, 1)).mean
+
+def rename_read_files(read_lens_filt: Dict[str, float], outdir: str) -> Dict[str, str]:
     """
-    Rename reads in `read_lens_filt` to:
-    - 'read_1.fastq' if there's only one file.
-    - If two or more files exist:
-      * Compare the top 2 by read length.
-      * If lengths differ, rename the largest to 'read_2.fastq' and second largest to 'read_1.fastq'.
-      * If lengths are the same, rename them by alphabetical order to 'read_1.fastq' and 'read_2.fastq'.
+    Rename reads in `read_lens_filt` to 'read_1.fastq' and 'read_2.fastq'
+    (see `fastq_utils.assign_reads` for how read 1 & read 2 are assigned).
+    Any compression extension is kept (e.g., 'read_1.fastq.zst').
     Returns a dictionary { "R1": <path>, "R2": <path> } with the renamed files.
     """
-    read_files_filt = {}
-    num_files = len(read_lens_filt)
-
-    # Handle only 1 file
-    if num_files == 1:
+    if len(read_lens_filt) == 1:
         logging.info("Only one read file found; renaming to read_1.fastq")
-        old_name = list(read_lens_filt.keys())[0]
-        new_name = os.path.join(outdir, "read_1.fastq")
-
+    else:
+        logging.info(">=2 read files found; picking two largest to rename")
+    read_files_filt = {}
+    for read_num,old_name in sorted(assign_reads(read_lens_filt).items()):
+        comp_ext = re.search(r"\.f(ast)?q(\.gz|\.zst)?$", old_name).group(2) or ""
+        new_name = os.path.join(outdir, f"read_{read_num[1]}.fastq{comp_ext}")
         if old_name == new_name:
             raise ValueError(f"New fastq name is the same as old name: {new_name}")
-
         os.rename(old_name, new_name)
-        read_files_filt["R1"] = new_name
+        read_files_filt[read_num] = new_name
         logging.info(f"Renamed {old_name} to {new_name}")
-        return read_files_filt
-
-    # Handle 2 or more files
-    logging.info(">=2 read files found; picking two largest to rename")
-    ## Sort by descending read length and then take the top 2
-    sorted_by_length_desc = sorted(read_lens_filt.items(), key=lambda x: x[1], reverse=True)
-    top_two = sorted_by_length_desc[:2]
-
-    # If the two longest have the same read length, re-sort them by filename ascending
-    if top_two[0][1] == top_two[1][1]:
-        logging.info("Top 2 files have the same read length; renaming by alphabetical order")
-        # Sort by filename (x[0]) ascending
-        top_two.sort(key=lambda x: x[0])
-
-        # Rename in ascending order:
-        #  - first becomes read_1.fastq
-        #  - second becomes read_2.fastq
-        for i, (old_name, _) in enumerate(top_two, start=1):
-            new_name = os.path.join(outdir, f"read_{i}.fastq")
-            if old_name == new_name:
-                raise ValueError(f"New fastq name is the same as old name: {new_name}")
-            os.rename(old_name, new_name)
-            read_files_filt[f"R{i}"] = new_name
-            logging.info(f"Renamed {old_name} to {new_name}")
-    else:
-        logging.info("Top 2 files differ in read length; largest file => read_2, second => read_1")
-        # Assign read_2 to the largest read, read_1 to the second largest
-        for i, (old_name, _) in enumerate(top_two, start=1):
-            read_num = 2 if i == 1 else 1
-            new_name = os.path.join(outdir, f"read_{read_num}.fastq")
-
-            if old_name == new_name:
-                raise ValueError(f"New fastq name is the same as old name: {new_name}")
-
-            os.rename(old_name, new_name)
-            read_files_filt[f"R{read_num}"] = new_name
-            logging.info(f"Renamed {old_name} to {new_name}")
-
     return read_files_filt
 
 def check_output(sra_file: str, outdir: str, min_read_length: int) -> None:
@@ -183,7 +318,7 @@ def check_output(sra_file: str, outdir: str, min_read_length: int) -> None:
 
     # list output files
     read_files = []
-    for file_ext in ['fastq', 'fastq.gz', 'fq', 'fq.gz']:
+    for file_ext in ['fastq', 'fastq.gz', 'fastq.zst', 'fq', 'fq.gz', 'fq.zst']:
         read_files += glob(os.path.join(outdir, f"{accession}*.{file_ext}"))
     if not read_files:
         msg = f"No read files found; files present: {out_files_str}"
@@ -197,15 +332,18 @@ def check_output(sra_file: str, outdir: str, min_read_length: int) -> None:
     # determine which read files are the read 1 and read 2
     read_lens = {}
     for read_file in read_files:
-        read_lens[read_file] = get_read_lengths(read_file, 800)
-        logging.info(f"Read length for {read_file}: {read_lens[read_file]}")
+        stats = sample_read_lengths(read_file, num_reads=200)
+        read_lens[read_file] = stats
+        logging.info(
+            f"Read length for {read_file}: mean={stats.mean:.1f}, min={stats.min}, max={stats.max}, mode={stats.mode}"
+        )
+        if stats.is_index:
+            logging.info(f"Index/technical reads detected: {read_file}")
     
-    # filter read files by length
-    read_lens_filt = {}
-    for k,v in read_lens.items():
-        if v >= min_read_length:
-            read_lens_filt[k] = v
-        else:
+    # filter read files by length; index/technical reads are always removed
+    read_lens_filt = filter_read_lengths(read_lens, min_read_length)
+    for k in read_lens:
+        if k not in read_lens_filt:
             # delete the read file
             os.remove(k)
 
@@ -253,15 +391,44 @@ def write_log(logF, sample: str, accession: str, step: str, success: bool, msg:
         msg = msg[:100] + '...'
     logF.write(','.join([sample, accession, step, str(success), msg]) + '\n')
 
-def main(args, log_df):
-    # check for fastq-dump and fasterq-dump
-    for exe in ['fastq-dump', 'fasterq-dump', 'prefetch', 'vdb-dump']:
-        if not which(exe):
-            logging.error(f'{exe} not found in PATH')
-            sys.exit(1)
+def prefetch_sra(accession: str, args: argparse.Namespace, log: LogSink, telemetry: Telemetry) -> Optional[str]:
+    """
+    Prefetch an SRA accession into the temporary directory.
+    Args:
+        accession: SRA accession
+        args: Command-line arguments
+        log: Log record sink
+        telemetry: Timing record sink
+    Returns:
+        Path of the prefetched SRA file, or None if the download failed
+    """
+    return prefetch_workflow(
+        sample=args.sample, 
+        accession=accession, 
+        log=log,
+        max_size_gb=args.max_size_gb,
+        gcp_download=args.gcp_download,
+        tries=args.tries,
+        outdir=os.path.join(args.temp, "prefetch"),
+        telemetry=telemetry
+    )
 
-    # get accession
-    accession = os.path.splitext(os.path.basename(args.sra_file))[0]
+def dump_reads(sra_file: str, accession: str, outdir: str, args: argparse.Namespace, 
+               log: LogSink, telemetry: Telemetry, prefetch_outdir: Optional[str]=None) -> str:
+    """
+    Run fast(er)q-dump on one accession, and check (filter & rename) the output read files.
+    Args:
+        sra_file: SRA file or accession
+        accession: SRA accession (for logging)
+        outdir: Output directory
+        args: Command-line arguments
+        log: Log record sink
+        telemetry: Timing record sink
+        prefetch_outdir: Prefetched SRA file (required for fasterq-dump)
+    Returns:
+        Status of the output check ("Success" or "Failure")
+    """
+    file_prefix = os.path.splitext(os.path.basename(sra_file))[0]
 
     # run fast(er)q-dump
     cmd = []
@@ -271,32 +438,21 @@ def main(args, log_df):
             cmd = [
                 "parallel-fastq-dump.py",
                 "--split-files",
-                "--outdir", args.outdir,
+                "--outdir", outdir,
                 "--threads", args.threads,
                 "--maxSpotId", args.maxSpotId,
-                "--sra-id", args.sra_file
+                "--compress", args.compress,
+                "--sra-id", sra_file
             ]
         else:
             cmd = [
                 "fastq-dump",
                 "--split-files",
-                "--outdir", args.outdir,  
+                "--outdir", outdir,  
                 "--maxSpotId", args.maxSpotId,
-                args.sra_file
+                sra_file
             ]
     else:
-        # prefetch
-        prefetch_outdir = prefetch_workflow(
-            sample=args.sample, 
-            accession=args.accession, 
-            log_df=log_df,
-            max_size_gb=args.max_size_gb,
-            gcp_download=args.gcp_download,
-            tries=args.tries,
-            outdir=os.path.join(args.temp, "prefetch")
-        )
-        if prefetch_outdir is None:
-            return None
         # fasterq-dump
         cmd = [
             "fasterq-dump",  
@@ -309,11 +465,22 @@ def main(args, log_df):
             "--min-read-len", args.min_read_length,
             "--mem", args.mem, 
             "--temp", args.temp,
-            "--outdir", args.outdir,
+            "--outdir", outdir,
             prefetch_outdir
         ]
     ## run command
-    returncode, output, err = run_cmd(cmd)
+    sra_gb = file_size_gb(prefetch_outdir)
+    with telemetry.span(cmd[0], accession=accession, input_gb=sra_gb) as span:
+        if cmd[0] == "fasterq-dump" and args.compress != "none":
+            returncode, output, err = run_fasterq_dump_compressed(prefetch_outdir, file_prefix, outdir, args)
+        else:
+            res = run_cmd(cmd)
+            returncode, output, err = res.returncode, res.output, res.err
+        if returncode == 0 and cmd[0] == "fastq-dump" and args.compress != "none":
+            for read_file in glob(os.path.join(outdir, f"{file_prefix}*.fastq")):
+                logging.info(f"Compressing {read_file} ({args.compress})")
+                compress_file(read_file, args.compress, args.threads)
+        span.status = "Success" if returncode == 0 else "Failure"
     if returncode == 0:
         msg = output.decode().split('\n')
     else:
@@ -323,14 +490,109 @@ def main(args, log_df):
         msg = "No command output"
     ## add to log
     status = "Success" if returncode == 0 else "Failure"
-    add_to_log(log_df, args.sample, args.accession, "fq-dump", cmd[0], status, msg)
+    log.add(args.sample, accession, "fq-dump", cmd[0], status, msg)
     if returncode != 0:
         logging.warning(err)
-        return None
+        return status
 
     # Check the fq-dump output
-    status,msg = check_output(args.sra_file, args.outdir, args.min_read_length)
-    add_to_log(log_df, args.sample, args.accession, "fq-dump", f"check_{cmd[0]}_output", status, msg)
+    with telemetry.span(f"check_{cmd[0]}_output", accession=accession, input_gb=sra_gb) as span:
+        status,msg = check_output(sra_file, outdir, args.min_read_length)
+        span.status = status
+    log.add(args.sample, accession, "fq-dump", f"check_{cmd[0]}_output", status, msg)
+    return status
+
+def append_read_files(acc_outdir: str, outdir: str) -> None:
+    """
+    Append the read files (read_1.fastq*, read_2.fastq*) of one accession to those of the sample.
+    The first accession's files are moved into place.
+    Compressed files can be concatenated as-is (multi-frame zstd / multi-member gzip).
+    Args:
+        acc_outdir: Output directory of the accession
+        outdir: Output directory of the sample
+    """
+    for read_file in sorted(glob(os.path.join(acc_outdir, "read_[12].fastq*"))):
+        out_file = os.path.join(outdir, os.path.basename(read_file))
+        if not os.path.exists(out_file):
+            os.replace(read_file, out_file)
+            continue
+        with open(read_file, "rb") as inF, open(out_file, "ab") as outF:
+            copyfileobj(inF, outF, CHUNK_SIZE)
+        os.remove(read_file)
+
+def dump_sample(args: argparse.Namespace, log: LogSink, telemetry: Telemetry) -> int:
+    """
+    Dump the reads of multiple accessions (e.g., all SRRs of an SRX) into one set of
+    read files (read_1.fastq & read_2.fastq) for the sample.
+    For fasterq-dump, accessions are prefetched concurrently (see `PrefetchQueue`),
+    while the already-downloaded accessions are dumped, in order.
+    Args:
+        args: Command-line arguments
+        log: Log record sink
+        telemetry: Timing record sink
+    Returns:
+        Number of accessions with reads in the output files
+    """
+    accessions = [os.path.splitext(os.path.basename(x))[0] for x in args.sra_file]
+    sizes_gb = parse_sizes(args.sra_size_gb)
+    sizes_gb += [0.0] * (len(accessions) - len(sizes_gb))
+
+    prefetched = None
+    if not (args.maxSpotId and args.maxSpotId > 0):
+        prefetched = PrefetchQueue(
+            lambda acc: prefetch_sra(acc, args, log, telemetry), accessions, sizes_gb, 
+            max_jobs=args.prefetch_jobs, max_inflight_gb=args.max_inflight_gb
+        )
+
+    num_success = 0
+    try:
+        for i,(sra_file,accession) in enumerate(zip(args.sra_file, accessions)):
+            prefetch_outdir = None
+            if prefetched is not None:
+                prefetch_outdir = prefetched.get(i)
+                if prefetch_outdir is None:
+                    prefetched.release(i)
+                    continue
+            acc_outdir = os.path.join(args.outdir, accession)
+            os.makedirs(acc_outdir, exist_ok=True)
+            status = dump_reads(sra_file, accession, acc_outdir, args, log, telemetry, prefetch_outdir)
+            if prefetched is not None:
+                rmtree(prefetch_outdir, ignore_errors=True)
+                prefetched.release(i)
+            if status == "Success":
+                with telemetry.span("append_read_files", accession=accession):
+                    append_read_files(acc_outdir, args.outdir)
+                num_success += 1
+            rmtree(acc_outdir, ignore_errors=True)
+    finally:
+        if prefetched is not None:
+            prefetched.close()
+    logging.info(f"Reads of {num_success} of {len(accessions)} accessions written to {args.outdir}")
+    return num_success
+
+def main(args, log: LogSink, telemetry: Telemetry):
+    # check for fastq-dump and fasterq-dump
+    for exe in ['fastq-dump', 'fasterq-dump', 'prefetch', 'vdb-dump']:
+        if not which(exe):
+            logging.error(f'{exe} not found in PATH')
+            sys.exit(1)
+
+    # multiple accessions: one set of read files for the sample
+    if len(args.sra_file) > 1:
+        dump_sample(args, log, telemetry)
+        rmtree(args.temp, ignore_errors=True)
+        return None
+
+    # prefetch
+    sra_file = args.sra_file[0]
+    prefetch_outdir = None
+    if not (args.maxSpotId and args.maxSpotId > 0):
+        prefetch_outdir = prefetch_sra(args.accession, args, log, telemetry)
+        if prefetch_outdir is None:
+            return None
+
+    # run fast(er)q-dump & check the output
+    dump_reads(sra_file, args.accession, args.outdir, args, log, telemetry, prefetch_outdir)
 
     # unlink temp files
     rmtree(args.temp, ignore_errors=True)
@@ -341,19 +603,8 @@ if __name__ == '__main__':
 
     # setup
     os.makedirs(args.outdir, exist_ok=True)
-    log_df = pd.DataFrame(
-        columns=["sample", "accession", "process", "step", "status", "message"]
-    )
 
-    # run main
-    main(args, log_df)
-
-    # write log
-    #log_file = os.path.join(args.outdir, "fq-dump_log.csv")
-    #log_df.to_csv(sys.stdout, index=False)
-    #log_df.to_csv(log_file, index=False)
-    #logging.info(f'Log written to: {log_file}')
-    
-    # upsert log to database
-    with db_connect() as conn:
-        db_upsert(log_df, "screcounter_log", conn)
\ No newline at end of file
+    # run main; log & timing records are upserted to the database in batches
+    with LogSink(use_db=not args.no_db) as log, \
+         Telemetry("fq-dump", args.sample, args.accession, use_db=not args.no_db) as telemetry:
+        main(args, log, telemetry)
\ No newline at end of file
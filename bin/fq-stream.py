@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# import
+from __future__ import print_function
+import os
+import sys
+import shlex
+import argparse
+import logging
+import tempfile
+from shutil import which, rmtree
+from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE, DEVNULL
+from db_utils import LogSink
+from telemetry import Telemetry, file_size_gb
+from fastq_utils import iter_records
+from read_stream import CHUNK_SIZE, QueueWriter, fasterq_dump_stdout_cmd, iter_spots, assign_spot_reads
+from prefetch import prefetch_workflow
+
+# logging
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
+
+# argparse
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
+                      argparse.RawDescriptionHelpFormatter):
+    pass
+
+desc = 'Stream fasterq-dump reads into a command (e.g., STAR), without writing fastq files'
+epi = """DESCRIPTION:
+For each accession: prefetch, then `fasterq-dump --split-spot --stdout`.
+The read 1 & read 2 of each spot are written to named pipes (FIFOs), which are read
+by the command given after "--" (with {R1} & {R2} replaced by the FIFO paths).
+
+Read 1 & read 2 are assigned from the read lengths of the first --sample-spots spots
+of each accession (same rules as fq-dump.py); spots lacking read 1 or read 2 are skipped.
+Multiple accessions are streamed, in order, into the same FIFOs (one command run);
+the next accession is prefetched while the current one is streamed.
+Accessions that fail before any of their reads are streamed (prefetch, or read assignment)
+are skipped; the run fails if an accession fails mid-stream, or if no accession is streamed.
+
+Examples:
+fq-stream.py --sample SRX123 SRR001 SRR002 -- \\
+  STAR --readFilesIn {R2} {R1} --genomeDir star_index ...
+"""
+parser = argparse.ArgumentParser(description=desc, epilog=epi,
+                                 formatter_class=CustomFormatter)
+parser.add_argument('accession', type=str, nargs='+', help='SRA accession(s)')
+parser.add_argument('--sample', type=str, default="",
+                    help='Sample name')
+parser.add_argument('--threads', type=int, default=4,
+                    help='Number of fasterq-dump threads')
+parser.add_argument('--bufsize', type=str, default='5MB',
+                    help='Buffer size')
+parser.add_argument('--curcache', type=str, default='50MB',
+                    help='Current cache size')
+parser.add_argument('--mem', type=str, default='5GB',
+                    help='Memory')
+parser.add_argument('--temp', type=str, default='TMP_FILES',
+                    help='Temporary directory')
+parser.add_argument('--min-read-length', type=int, default=28,
+                    help='Minimum read length')
+parser.add_argument('--sample-spots', type=int, default=1000,
+                    help='Number of spots used to assign read 1 & read 2')
+parser.add_argument('--fifo-dir', type=str, default=None,
+                    help='Directory for the FIFOs; default: a new temporary directory')
+parser.add_argument('--queue-size', type=int, default=16,
+                    help='Max number of 4 MB chunks buffered per FIFO')
+# prefetch
+parser.add_argument('--max-size-gb', type=int, default=300,
+                    help='Max file size in Gb')
+parser.add_argument('--tries', type=int, default=3,
+                    help='Number of tries to download')
+parser.add_argument('--gcp-download', action='store_true', default=False,
+                    help='Obtain sequence data from SRA GCP mirror')
+parser.add_argument('--no-db', action='store_true', default=False,
+                    help='Do not write the log & timing records to the database (write them to the JSONL spill file)')
+
+# functions
+def stream_accession(sra_path: str, accession: str, args: argparse.Namespace,
+                     start_reader, writers: Dict[str, QueueWriter]) -> Tuple[str,str,bool]:
+    """
+    Stream the reads of one accession into the FIFOs.
+    A failure before any reads were written to the FIFOs (e.g., read 1 & read 2 could not be
+    assigned) leaves the FIFOs untouched, so the accession can be skipped.
+    Args:
+        sra_path: Prefetched SRA file
+        accession: SRA accession
+        args: Command-line arguments
+        start_reader: Function that starts the reader (if not already running) and returns the writers
+        writers: FIFO writers (R1 & R2); empty if the reader has not been started
+    Returns:
+        Status, message, and whether any reads were written to the FIFOs
+    """
+    cmd = fasterq_dump_stdout_cmd(
+        sra_path, args.threads, args.bufsize, args.curcache, args.mem, args.temp
+    )
+    logging.info(f'Running: {" ".join(cmd)}')
+    proc = Popen(cmd, stdout=PIPE, stdin=DEVNULL, bufsize=0)
+    wrote = False
+    try:
+        spots = iter_spots(iter_records(proc.stdout))
+
+        # assign read 1 & read 2 from the first spots
+        prefix = []
+        for _,reads in spots:
+            prefix.append(reads)
+            if len(prefix) >= args.sample_spots:
+                break
+        assignment = assign_spot_reads(prefix, args.min_read_length)
+        if "R2" not in assignment:
+            return "Failure",f"Read 1 & read 2 could not be assigned; reads available: {len(assignment)}",False
+        r1, r2 = assignment["R1"], assignment["R2"]
+        logging.info(f"{accession}: read 1 = read {r1.decode()}, read 2 = read {r2.decode()}")
+        if not writers:
+            writers.update(start_reader())
+
+        # demultiplex
+        num_spots = num_skipped = 0
+        chunks = {"R1": [], "R2": []}
+        chunk_size = 0
+        for reads in prefix_then(prefix, spots):
+            rec1, rec2 = reads.get(r1), reads.get(r2)
+            if rec1 is None or rec2 is None:
+                num_skipped += 1
+                continue
+            chunks["R1"].append(rec1)
+            chunks["R2"].append(rec2)
+            chunk_size += len(rec1) + len(rec2)
+            num_spots += 1
+            if chunk_size >= CHUNK_SIZE:
+                wrote = True
+                for k,writer in writers.items():
+                    writer.put(b"".join(chunks[k]))
+                    chunks[k] = []
+                chunk_size = 0
+        for k,writer in writers.items():
+            if chunks[k]:
+                wrote = True
+                writer.put(b"".join(chunks[k]))
+    except IOError as e:
+        return "Failure",str(e),wrote
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+    if proc.wait() != 0:
+        return "Failure",f"fasterq-dump failed with exit code {proc.returncode}",wrote
+    msg = f"Streamed {num_spots} spots ({num_skipped} spots lacking read 1 or read 2 skipped)"
+    logging.info(f"{accession}: {msg}")
+    return "Success",msg,wrote
+
+def prefix_then(prefix: List[Dict[bytes, bytes]], spots):
+    """
+    Yield the already-read prefix spots, then the remaining spots.
+    """
+    yield from prefix
+    for _,reads in spots:
+        yield reads
+
+def main(args, cmd: List[str], log: LogSink, telemetry: Telemetry) -> int:
+    # check for executables
+    for exe in ['fasterq-dump', 'prefetch', 'vdb-dump']:
+        if not which(exe):
+            logging.error(f'{exe} not found in PATH')
+            sys.exit(1)
+    if not cmd:
+        logging.error('No command provided (after "--")')
+        sys.exit(1)
+
+    # FIFOs
+    fifo_dir = args.fifo_dir or tempfile.mkdtemp(prefix="fq-stream_")
+    os.makedirs(fifo_dir, exist_ok=True)
+    fifos = {k: os.path.join(fifo_dir, f"{k}.fastq") for k in ["R1", "R2"]}
+    for path in fifos.values():
+        if not os.path.exists(path):
+            os.mkfifo(path)
+
+    # reader command, started once the first accession's reads are assigned
+    reader = {}
+    def start_reader() -> Dict[str, QueueWriter]:
+        reader_cmd = [x.replace("{R1}", fifos["R1"]).replace("{R2}", fifos["R2"]) for x in cmd]
+        logging.info(f'Running: {shlex.join(reader_cmd)}')
+        reader["proc"] = Popen(reader_cmd)
+        writers = {k: QueueWriter(path, reader["proc"], args.queue_size) for k,path in fifos.items()}
+        for writer in writers.values():
+            writer.start()
+        return writers
+
+    # prefetch (one accession ahead) & stream;
+    # accessions that fail before any reads are written are skipped (as joinReads for staged reads)
+    writers = {}
+    skipped = {}
+    num_success = 0
+    partial = False
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        def submit_prefetch(i: int):
+            # at most one pending prefetch, so only one SRA file is downloaded ahead (disk usage)
+            if i >= len(args.accession):
+                return None
+            return pool.submit(
+                prefetch_workflow, sample=args.sample, accession=args.accession[i], log=log,
+                max_size_gb=args.max_size_gb, gcp_download=args.gcp_download, tries=args.tries,
+                outdir=os.path.join(args.temp, "prefetch"), telemetry=telemetry
+            )
+        pending = submit_prefetch(0)
+        for i,accession in enumerate(args.accession):
+            sra_path = pending.result()
+            # prefetch the next accession while this one is streamed
+            pending = submit_prefetch(i + 1)
+            if sra_path is None:
+                logging.warning(f'{accession}: prefetch failed; skipping the accession')
+                skipped[accession] = "Prefetch failed"
+                continue
+            with telemetry.span("fasterq-dump", accession=accession, input_gb=file_size_gb(sra_path)) as span:
+                status,msg,wrote = stream_accession(sra_path, accession, args, start_reader, writers)
+                span.status = status
+            log.add(args.sample, accession, "fq-stream", "fasterq-dump", status, msg)
+            rmtree(sra_path, ignore_errors=True)
+            if status == "Success":
+                num_success += 1
+            elif wrote:
+                # the reader has already consumed reads of this accession; a partial sample must not be used
+                logging.error(f'{accession}: {msg}')
+                partial = True
+                if pending is not None:
+                    pending.cancel()
+                break
+            else:
+                logging.warning(f'{accession}: {msg}; skipping the accession')
+                skipped[accession] = msg
+
+    # close the FIFOs & wait for the reader
+    returncode = 1
+    if writers:
+        for writer in writers.values():
+            if writer.error is None and reader["proc"].poll() is None:
+                writer.put(None)
+        if partial:
+            reader["proc"].terminate()
+        returncode = reader["proc"].wait()
+        for writer in writers.values():
+            writer.unblock()
+            writer.join()
+            logging.info(f'Wrote {writer.bytes_written / 1e9:.2f} GB to {writer.path}')
+        # success: >=1 accession streamed, and no partially streamed accession
+        if partial or num_success == 0:
+            returncode = returncode or 1
+    for accession in args.accession:
+        if accession in skipped:
+            log.add(args.sample, accession, "fq-stream", "Final", "Failure", f"Skipped: {skipped[accession]}")
+            continue
+        log.add(args.sample, accession, "fq-stream", "Final",
+                "Success" if returncode == 0 else "Failure", f"Command exit code: {returncode}")
+
+    # clean up
+    rmtree(args.temp, ignore_errors=True)
+    if not args.fifo_dir:
+        rmtree(fifo_dir, ignore_errors=True)
+    return returncode
+
+## script main
+if __name__ == '__main__':
+    # the command to run is given after "--"
+    argv, cmd = sys.argv[1:], []
+    if "--" in argv:
+        idx = argv.index("--")
+        argv, cmd = argv[:idx], argv[idx+1:]
+    args = parser.parse_args(argv)
+
+    # run main; log & timing records are upserted to the database in batches
+    with LogSink(use_db=not args.no_db) as log, \
+         Telemetry("fq-stream", args.sample, use_db=not args.no_db) as telemetry:
+        returncode = main(args, cmd, log, telemetry)
+    sys.exit(returncode)
@@ -15,7 +15,8 @@ from pypika import Query, Table, Criterion
 from psycopg2.extras import execute_values
 from psycopg2.extensions import connection
 ## pipeline
-from db_utils import db_connect, db_upsert
+from db_utils import get_conn, db_upsert
+from sra_stat_cache import get_cached_stats
 
 
 # logging
@@ -42,6 +43,8 @@ parser.add_argument('--database', type=str, default=["sra", "gds"], nargs="+",
                     help='Only return records from these databases')
 parser.add_argument('--organisms', type=str, default="human,mouse", 
                     help='Organisms to filter by; comma-separated list')
+parser.add_argument('--max-sra-size', type=float, default=None,
+                    help='Skip accessions with a cached sra-stat file size (GB) greater than this')
 parser.add_argument('--outfile', type=str, default="accessions.csv",
                     help='Output file name')
 
@@ -146,7 +149,7 @@ def main(args):
     process = "Get db accessions"
 
     # get unprocessed records
-    with db_connect() as conn:
+    with get_conn() as conn:
         df = db_get_unprocessed_records(
             conn, process, args.database, max_srx=args.max_srx, organisms=args.organisms
         )
@@ -162,8 +165,15 @@ def main(args):
     srr_per_srx = df.groupby("sample")["accession"].count()
     logging.info(f"No. of target SRR per SRX: {srr_per_srx.to_dict()}")
 
-    ## write out records
-    df.to_csv(args.outfile, index=False)
+    ## write out records, skipping accessions that are known (cached sra-stat) to be too large
+    df_out = df
+    if args.max_sra_size is not None:
+        cached = get_cached_stats(df["accession"])
+        too_large = [acc for acc,stats in cached.items() if stats["file_size_gb"] > args.max_sra_size]
+        logging.info(f"No. of accessions with cached sra-stat results: {len(cached)}")
+        logging.info(f"No. of accessions skipped (cached file size > {args.max_sra_size} GB): {len(too_large)}")
+        df_out = df[~df["accession"].isin(too_large)]
+    df_out.to_csv(args.outfile, index=False)
 
     # write to log table in scRecounter database
     ## convert df
@@ -177,7 +187,7 @@ def main(args):
 
     ## upsert log to database
     logging.info("Updating scRecounter log table...")
-    with db_connect() as conn:
+    with get_conn() as conn:
         db_upsert(df, "screcounter_log", conn)
 
 ## script main
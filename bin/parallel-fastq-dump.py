@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
-import sys, os, shutil, tempfile, subprocess, argparse, logging
+import sys, os, re, time, shutil, tempfile, subprocess, argparse, logging
+from concurrent.futures import ThreadPoolExecutor
+from telemetry import Telemetry
 
 __version__ = "0.6.7"
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.DEBUG)
@@ -9,6 +11,8 @@ class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescri
 desc = "parallel fastq-dump wrapper, extra args will be passed through"
 epi = """DESCRIPTION:
 Example: parallel-fastq-dump --sra-id SRR2244401 --threads 4 --outdir out/ --split-files --gzip
+With --compress, each chunk is compressed (zstd or bgzf) by its worker, and the
+compressed chunks are concatenated (multi-frame zstd / multi-member bgzf files).
 """
 
 parser = argparse.ArgumentParser(description=desc, epilog=epi, formatter_class=CustomFormatter)
@@ -18,44 +22,144 @@ parser.add_argument("-O","--outdir", help="output directory", default=".")
 parser.add_argument("-T","--tmpdir", help="temporary directory", default=None)
 parser.add_argument("-N","--minSpotId", help="Minimum spot id", default=1, type=int)
 parser.add_argument("-X","--maxSpotId", help="Maximum spot id", default=None, type=int)
+parser.add_argument("-C","--chunks-per-thread", help="number of spot-range chunks per thread", default=4, type=int)
+parser.add_argument("--min-chunk-spots", help="minimum number of spots per chunk", default=100000, type=int)
+parser.add_argument("--chunk-tries", help="number of tries per chunk", default=3, type=int)
+parser.add_argument("--compress", help="compress the output files", default="none", choices=["none","zstd","bgzf"])
+parser.add_argument("--sample", help="sample name (for the timing records)", default="")
+parser.add_argument("--no-db", help="do not write the timing records to the database (JSONL spill file only)", action="store_true", default=False)
 parser.add_argument("-V","--version", help="shows version", action="store_true", default=False)
 
-def pfd(args: argparse.Namespace, srr_id: str, extra_args: list[str]) -> None:
+def pfd(args: argparse.Namespace, srr_id: str, extra_args: list[str], telemetry: Telemetry) -> None:
     """Parallel fastq-dump.
+    The spot range is cut into many small chunks, which a pool of `--threads`
+    workers pull from a queue, so a slow chunk does not leave the other workers idle.
+    Chunks are merged in order (completed chunks wait on disk until all prior chunks are merged).
     Args:
         args: Parsed command-line arguments.
         srr_id: Identifier for the SRA run.
         extra_args: Additional arguments to pass to fastq-dump.
+        telemetry: Timing records of each stage.
     """
     tmp_dir = tempfile.TemporaryDirectory(prefix="pfd_", dir=args.tmpdir)
     logging.info(f"tempdir: {tmp_dir.name}")
-    n_spots = get_spot_count(srr_id)
+    with telemetry.span("Spot count", accession=srr_id):
+        n_spots = get_spot_count(srr_id)
     logging.info(f"{srr_id} spots: {n_spots}")
     start = max(args.minSpotId, 1)
     end = min(args.maxSpotId, n_spots) if args.maxSpotId is not None else n_spots
-    blocks = split_blocks(start, end, args.threads)
-    logging.info(f"blocks: {blocks}")
-    ps = []
-    for i in range(args.threads):
-        d = os.path.join(tmp_dir.name, str(i))
-        os.mkdir(d)
-        cmd = ["fastq-dump","-N",str(blocks[i][0]),"-X",str(blocks[i][1]),"-O",d]+extra_args+[srr_id]
+    total = end - start + 1
+    n_chunks = max(args.threads * args.chunks_per_thread, 1)
+    n_chunks = max(min(n_chunks, total // max(args.min_chunk_spots, 1), total), 1)
+    blocks = split_blocks(start, end, n_chunks)
+    logging.info(f"No. of chunks: {len(blocks)}")
+    # limit the number of completed-but-unmerged chunks on disk
+    max_ahead = 2 * args.threads
+    wfd, futures, next_chunk = {}, {}, 0
+    with telemetry.span("fastq-dump", accession=srr_id), ThreadPoolExecutor(max_workers=args.threads) as pool:
+        for i in range(len(blocks)):
+            while next_chunk < len(blocks) and next_chunk < i + max_ahead:
+                d = os.path.join(tmp_dir.name, str(next_chunk))
+                futures[next_chunk] = pool.submit(dump_chunk, srr_id, blocks[next_chunk], d, extra_args, args.chunk_tries, args.compress)
+                next_chunk += 1
+            if not futures.pop(i).result():
+                logging.warning(f"fastq-dump failed for chunk {i}: {blocks[i]}")
+                for f in futures.values(): f.cancel()
+                sys.exit(1)
+            merge_block(os.path.join(tmp_dir.name, str(i)), args.outdir, wfd)
+    for fd in wfd.values(): os.close(fd)
+
+def dump_chunk(srr_id: str, block: list[int], outdir: str, extra_args: list[str], tries: int=3, compress: str="none") -> bool:
+    """Run fastq-dump on one chunk of spots, retrying on failure.
+    Args:
+        srr_id: Identifier for the SRA run.
+        block: [first spot ID, last spot ID].
+        outdir: Output directory for the chunk.
+        extra_args: Additional arguments to pass to fastq-dump.
+        tries: Number of tries.
+        compress: Compression method for the chunk files ("none", "zstd" or "bgzf").
+    Returns:
+        True if fastq-dump (and compression) succeeded.
+    """
+    cmd = ["fastq-dump","-N",str(block[0]),"-X",str(block[1]),"-O",outdir]+extra_args+[srr_id]
+    for i in range(tries):
+        # start each attempt from an empty directory
+        shutil.rmtree(outdir, ignore_errors=True)
+        os.mkdir(outdir)
         logging.info(f"CMD: {' '.join(cmd)}")
-        p = subprocess.Popen(cmd)
-        ps.append(p)
-    wfd = {}
-    for i,p in enumerate(ps):
-        exit_code = p.wait()
-        if exit_code != 0:
-            logging.warning(f"fastq-dump error! exit code: {exit_code}")
-            sys.exit(1)
-        tmp_path = os.path.join(tmp_dir.name, str(i))
-        for fo in os.listdir(tmp_path):
-            if fo not in wfd: wfd[fo] = open(os.path.join(args.outdir, fo), "wb")
-            with open(os.path.join(tmp_path, fo), "rb") as fd:
-                shutil.copyfileobj(fd, wfd[fo])
-            os.remove(os.path.join(tmp_path, fo))
-    for fd in wfd.values(): fd.close()
+        exit_code = subprocess.Popen(cmd).wait()
+        if exit_code == 0 and compress != "none":
+            try:
+                compress_chunk(outdir, compress)
+            except IOError as e:
+                logging.warning(str(e))
+                exit_code = -1
+        if exit_code == 0: return True
+        logging.warning(f"fastq-dump error! exit code: {exit_code}; attempt {i+1}/{tries}")
+        if i + 1 < tries: time.sleep(2 ** i)
+    return False
+
+def compress_chunk(outdir: str, method: str) -> None:
+    """Compress all output files of one chunk (in place).
+    Args:
+        outdir: Output directory of the chunk.
+        method: Compression method ("zstd" or "bgzf").
+    """
+    from fastq_utils import compress_file
+    for fo in sorted(os.listdir(outdir)):
+        compress_file(os.path.join(outdir, fo), method)
+
+def merge_block(tmp_path: str, outdir: str, wfd: dict[str, int]) -> None:
+    """Merge the output files of one block into the final output files.
+    The first block's files are moved into place (no copy); later blocks
+    are appended in-kernel (see append_file).
+    Args:
+        tmp_path: Block output directory.
+        outdir: Final output directory.
+        wfd: Open file descriptors of the final output files, by file name.
+    """
+    for fo in sorted(os.listdir(tmp_path)):
+        src = os.path.join(tmp_path, fo)
+        dst = os.path.join(outdir, fo)
+        if fo not in wfd:
+            try:
+                os.replace(src, dst)
+                wfd[fo] = os.open(dst, os.O_WRONLY)
+                os.lseek(wfd[fo], 0, os.SEEK_END)
+                continue
+            except OSError:
+                # e.g., tmpdir on a different filesystem
+                wfd[fo] = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        append_file(src, wfd[fo])
+        os.remove(src)
+
+def append_file(src: str, dst_fd: int) -> None:
+    """Append a file to an open file, without copying through user space if possible.
+    Uses copy_file_range (which may share extents on reflink-capable filesystems),
+    then sendfile, then a buffered copy as fallbacks.
+    Args:
+        src: File to append.
+        dst_fd: File descriptor of the output file, positioned at its end.
+    """
+    with open(src, "rb") as fd:
+        size, offset = os.fstat(fd.fileno()).st_size, 0
+        for copy in (_copy_file_range, _sendfile):
+            try:
+                while offset < size:
+                    n = copy(fd.fileno(), dst_fd, offset, size - offset)
+                    if n == 0: break
+                    offset += n
+                return
+            except (OSError, AttributeError):
+                if offset > 0: raise
+        with open(dst_fd, "ab", closefd=False) as out:
+            shutil.copyfileobj(fd, out)
+
+def _copy_file_range(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+def _sendfile(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    return os.sendfile(dst_fd, src_fd, offset, count)
 
 def split_blocks(start: int, end: int, n_pieces: int) -> list[list[int]]:
     """Split a range of spot IDs into smaller blocks.
@@ -77,12 +181,20 @@ def split_blocks(start: int, end: int, n_pieces: int) -> list[list[int]]:
     return out
 
 def get_spot_count(sra_id: str) -> int:
-    """Get spot count using sra-stat.
+    """Get spot count from the sra-stat cache (see sra_stat_cache), or else via sra-stat.
     Args:
         sra_id: Identifier for the SRA run.
     Returns:
         Total number of spots in the specified SRA.
     """
+    accession = os.path.splitext(os.path.basename(sra_id))[0]
+    if re.fullmatch(r"[SED]RR\d+", accession):
+        try:
+            from sra_stat_cache import get_cached_stats
+            cached = get_cached_stats([accession], require=["spot_count"])
+            if accession in cached: return cached[accession]["spot_count"]
+        except ImportError:
+            pass
     cmd = ["sra-stat","--meta","--quick",sra_id]
     logging.info(f"CMD: {' '.join(cmd)}")
     p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -136,7 +248,8 @@ def main() -> None:
             os.makedirs(args.outdir)
         if args.tmpdir and not os.path.isdir(args.tmpdir) and args.tmpdir != ".":
             os.makedirs(args.tmpdir)
-        for si in args.sra_id: pfd(args, si, extra_args)
+        with Telemetry("parallel-fastq-dump", args.sample, use_db=not args.no_db) as telemetry:
+            for si in args.sra_id: pfd(args, si, extra_args, telemetry)
     else:
         parser.print_help()
         sys.exit(1)
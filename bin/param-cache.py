@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# import
+## batteries
+from __future__ import print_function
+import os
+import sys
+import json
+import argparse
+import logging
+import pandas as pd
+## pipeline
+from param_cache import CACHE_URI, MAX_ENTRIES, MAX_BYTES, get_backend, read_fingerprint, get_cached
+
+# logging
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
+
+# argparse
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
+                      argparse.RawDescriptionHelpFormatter):
+    pass
+
+desc = 'Look up cached STAR param search results.'
+epi = """DESCRIPTION:
+STAR param search results (the rows written by format-star-params.py) are cached,
+keyed by a content hash of the (subsampled) reads plus the parameters that determine the
+STAR run: strand, barcodes file, cell barcode length, UMI length & STAR index, plus the
+size & modification time of the barcodes file & STAR index files ("barcodes_stamp" &
+"star_index_stamp", set by makeParamSets; else from the local files), so that changed
+files at the same paths are cache misses.
+
+For the parameter sets (JSON list, as created by makeParamSets), the cached rows are
+written to --hits-outfile (only if there are any hits), and the parameter sets without a cached
+result are written to --misses-outfile, each with the "read_fingerprint" that format-star-params.py
+(--read-fingerprint) uses to add the result to the cache.
+
+Cache location (--cache; default: $SCRECOUNTER_PARAM_CACHE): "db" = the scRecounter database
+(screcounter_param_cache); otherwise, a (shared) directory. The least recently used entries
+are evicted beyond $SCRECOUNTER_PARAM_CACHE_MAX_ENTRIES entries or $SCRECOUNTER_PARAM_CACHE_MAX_GB
+(enforced on ~1 in $SCRECOUNTER_PARAM_CACHE_EVICT_INTERVAL writes).
+If the cache is disabled, all parameter sets are misses.
+
+Example:
+param-cache.py --cache /mnt/shared/param_cache --param-sets param_sets.json read_1.fastq read_2.fastq
+"""
+parser = argparse.ArgumentParser(description=desc, epilog=epi,
+                                 formatter_class=CustomFormatter)
+parser.add_argument('fastq_1', type=str,
+                    help='Read 1 fastq file')
+parser.add_argument('fastq_2', type=str,
+                    help='Read 2 fastq file')
+parser.add_argument('--param-sets', type=str, required=True,
+                    help='Parameter sets (JSON)')
+parser.add_argument('--cache', type=str, default=CACHE_URI,
+                    help='Cache location: "db", or a directory; "" = disabled')
+parser.add_argument('--hits-outfile', type=str, default='cached_star_params.csv',
+                    help='Output table of the cached STAR param search results')
+parser.add_argument('--misses-outfile', type=str, default='uncached_param_sets.json',
+                    help='Output parameter sets (JSON) without a cached result')
+
+# functions
+def main(args):
+    # load the parameter sets
+    with open(args.param_sets) as inF:
+        param_sets = json.load(inF)
+    logging.info(f"No. of parameter sets: {len(param_sets)}")
+
+    # look up
+    fingerprint = read_fingerprint([args.fastq_1, args.fastq_2])
+    logging.info(f"Read fingerprint: {fingerprint}")
+    backend = get_backend(args.cache, MAX_ENTRIES, MAX_BYTES)
+    hits = get_cached(backend, fingerprint, param_sets) if backend is not None else {}
+    logging.info(f"Cache hits: {len(hits)}; misses: {len(param_sets) - len(hits)}")
+
+    # write output
+    if hits:
+        pd.concat([hits[i] for i in sorted(hits)], ignore_index=True).to_csv(args.hits_outfile, index=False)
+        logging.info(f"Output written to: {args.hits_outfile}")
+    misses = [dict(p, read_fingerprint=fingerprint) for i,p in enumerate(param_sets) if i not in hits]
+    with open(args.misses_outfile, "w") as outF:
+        json.dump(misses, outF, indent=2)
+    logging.info(f"Output written to: {args.misses_outfile}")
+
+## script main
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,340 @@
+# import
+## batteries
+from __future__ import annotations
+import os
+import json
+import random
+import hashlib
+import logging
+from io import StringIO
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Sequence, Union
+## 3rd party: pandas is imported where needed (format-star-params.py only writes to the cache)
+if TYPE_CHECKING:
+    import pandas as pd
+
+# constants
+## cache location: "" = disabled; "db" = the scRecounter database; otherwise, a (shared) local directory
+CACHE_URI = os.getenv("SCRECOUNTER_PARAM_CACHE", "")
+## size caps; the least recently used entries are evicted beyond the caps
+MAX_ENTRIES = int(os.getenv("SCRECOUNTER_PARAM_CACHE_MAX_ENTRIES", 100000))
+MAX_BYTES = int(float(os.getenv("SCRECOUNTER_PARAM_CACHE_MAX_GB", 1)) * 1e9)
+## the caps are enforced on ~1 in EVICT_INTERVAL puts (at random: each task puts only a few entries),
+## since eviction scans all entries; the caps can be exceeded by about EVICT_INTERVAL entries
+EVICT_INTERVAL = int(os.getenv("SCRECOUNTER_PARAM_CACHE_EVICT_INTERVAL", 100))
+## bumped if the STAR param search command (or the cache key) changes (invalidates all entries)
+CACHE_VERSION = 2
+## parameters that determine a STAR param search result (with the reads)
+KEY_PARAMS = ["strand", "barcodes_file", "cell_barcode_length", "umi_length", "star_index"]
+## file stamps of the barcodes file & STAR index (see `file_stamp`), so that a changed file at the same path is a miss
+STAMP_PARAMS = {"barcodes_stamp": "barcodes_file", "star_index_stamp": "star_index"}
+TABLE_NAME = "screcounter_param_cache"
+CREATE_STMT = f"""
+CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    value TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    accessed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+_TABLE_CREATED = False
+READ_SIZE = 1 << 22
+
+# classes
+class LocalCacheBackend:
+    """
+    Cache entries as files in a (shared) directory: <root>/<key[:2]>/<key>.csv.
+    Reads update the file modification time, which is used for LRU eviction.
+    Writes are atomic (write to a temporary file, then rename).
+    """
+    def __init__(self, root: str, max_entries: int=MAX_ENTRIES, max_bytes: int=MAX_BYTES,
+                 evict_interval: int=EVICT_INTERVAL) -> None:
+        self.root = root
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+
+    def _path(self, key: str) -> str:
+        """
+        File of a cache entry.
+        """
+        return os.path.join(self.root, key[:2], f"{key}.csv")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get a cache entry.
+        Args:
+            key: Cache key
+        Returns:
+            Value; None if not cached
+        """
+        path = self._path(key)
+        try:
+            with open(path) as inF:
+                value = inF.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        """
+        Add (or replace) a cache entry, then evict entries beyond the size caps (see `EVICT_INTERVAL`).
+        Args:
+            key: Cache key
+            value: Value
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as outF:
+            outF.write(value)
+        os.replace(tmp_path, path)
+        if should_evict(self.evict_interval):
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used entries beyond the size caps.
+        Returns:
+            Number of removed entries
+        """
+        entries = []
+        for root,_,files in os.walk(self.root):
+            for f in files:
+                if not f.endswith(".csv"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, f))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(root, f)))
+        entries.sort(reverse=True)
+        total,removed = 0,0
+        for i,(_,size,path) in enumerate(entries):
+            total += size
+            if i >= self.max_entries or total > self.max_bytes:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            logging.info(f"Param cache: evicted {removed} entries")
+        return removed
+
+class DbCacheBackend:
+    """
+    Cache entries in the scRecounter database (screcounter_param_cache).
+    Reads update `accessed_at`, which is used for LRU eviction.
+    """
+    def __init__(self, max_entries: int=MAX_ENTRIES, max_bytes: int=MAX_BYTES,
+                 evict_interval: int=EVICT_INTERVAL) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+
+    def _create_table(self, conn) -> None:
+        """
+        Create the cache table, if it does not exist (once per process).
+        """
+        global _TABLE_CREATED
+        if _TABLE_CREATED:
+            return
+        with conn.cursor() as cur:
+            cur.execute(CREATE_STMT)
+        conn.commit()
+        _TABLE_CREATED = True
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get a cache entry.
+        Args:
+            key: Cache key
+        Returns:
+            Value; None if not cached
+        """
+        from db_utils import get_conn
+        with get_conn() as conn:
+            self._create_table(conn)
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"UPDATE {TABLE_NAME} SET accessed_at = now() WHERE cache_key = %s RETURNING value", (key,)
+                )
+                row = cur.fetchone()
+            conn.commit()
+        return row[0] if row else None
+
+    def put(self, key: str, value: str) -> None:
+        """
+        Add (or replace) a cache entry, then evict entries beyond the size caps (see `EVICT_INTERVAL`).
+        Args:
+            key: Cache key
+            value: Value
+        """
+        from db_utils import get_conn, db_upsert_rows
+        row = (key, value, len(value.encode()), datetime.now(timezone.utc))
+        with get_conn() as conn:
+            self._create_table(conn)
+            db_upsert_rows([row], ["cache_key", "value", "size_bytes", "accessed_at"], TABLE_NAME, conn)
+        if should_evict(self.evict_interval):
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used entries beyond the size caps.
+        Returns:
+            Number of removed entries
+        """
+        from db_utils import get_conn
+        stmt = f"""
+        DELETE FROM {TABLE_NAME} WHERE cache_key IN (
+            SELECT cache_key FROM (
+                SELECT cache_key,
+                       row_number() OVER (ORDER BY accessed_at DESC) AS n,
+                       sum(size_bytes) OVER (ORDER BY accessed_at DESC) AS total
+                FROM {TABLE_NAME}
+            ) AS t WHERE n > %s OR total > %s
+        )
+        """
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                # the window sort only if over the caps
+                cur.execute(f"SELECT count(*), coalesce(sum(size_bytes), 0) FROM {TABLE_NAME}")
+                num_entries,num_bytes = cur.fetchone()
+                if num_entries <= self.max_entries and num_bytes <= self.max_bytes:
+                    return 0
+                cur.execute(stmt, (self.max_entries, self.max_bytes))
+                removed = cur.rowcount
+            conn.commit()
+        if removed:
+            logging.info(f"Param cache: evicted {removed} entries")
+        return removed
+
+# functions
+def should_evict(interval: int=EVICT_INTERVAL) -> bool:
+    """
+    Whether to enforce the size caps on this put: on ~1 in `interval` puts, at random.
+    Args:
+        interval: Mean number of puts per eviction; <=1 = every put
+    Returns:
+        True if the caps should be enforced
+    """
+    return interval <= 1 or random.random() < 1 / interval
+
+def get_backend(uri: str=CACHE_URI, max_entries: int=MAX_ENTRIES, max_bytes: int=MAX_BYTES):
+    """
+    Get the cache backend.
+    Args:
+        uri: "" = disabled; "db" = the scRecounter database; otherwise, a local directory
+        max_entries: Max number of entries
+        max_bytes: Max total size of the entries
+    Returns:
+        Cache backend (with `get(key)` & `put(key, value)`); None if disabled
+    """
+    if not uri:
+        return None
+    if uri == "db":
+        return DbCacheBackend(max_entries, max_bytes)
+    return LocalCacheBackend(uri, max_entries, max_bytes)
+
+def read_fingerprint(fastq_files: Sequence[str]) -> str:
+    """
+    Content hash of the (subsampled) reads used for the STAR param search.
+    Args:
+        fastq_files: Fastq files (R1 & R2)
+    Returns:
+        SHA-256 hex digest
+    """
+    h = hashlib.sha256()
+    for fastq_file in fastq_files:
+        h.update(f"{os.path.getsize(fastq_file)}\n".encode())
+        with open(fastq_file, "rb") as inF:
+            while True:
+                block = inF.read(READ_SIZE)
+                if not block:
+                    break
+                h.update(block)
+    return h.hexdigest()
+
+def file_stamp(path: Optional[str]) -> str:
+    """
+    Number of files, total size & latest modification time (ms) of a local file, or of the files
+    in a local directory (e.g., a STAR index). Same format as fileStamp() in lib/star_params.groovy.
+    Args:
+        path: File or directory
+    Returns:
+        "<files>:<bytes>:<mtime_ms>"; "" if not found (e.g., a remote path)
+    """
+    if not path or not os.path.exists(path):
+        return ""
+    if os.path.isdir(path):
+        files = [os.path.join(path, f) for f in os.listdir(path)]
+        stats = [os.stat(f) for f in files if os.path.isfile(f)]
+    else:
+        stats = [os.stat(path)]
+    mtime = max((st.st_mtime_ns // 1000000 for st in stats), default=0)
+    return f"{len(stats)}:{sum(st.st_size for st in stats)}:{mtime}"
+
+def cache_key(fingerprint: str, params: dict) -> str:
+    """
+    Cache key of a STAR param search result: the read fingerprint, the `KEY_PARAMS`
+    & the `STAMP_PARAMS` (from the parameter set, as set by the pipeline; else from the local files).
+    Args:
+        fingerprint: Read fingerprint (see `read_fingerprint`)
+        params: Parameter set
+    Returns:
+        SHA-256 hex digest
+    """
+    key = {"version": CACHE_VERSION, "reads": fingerprint}
+    key.update({k: str(params.get(k)) for k in KEY_PARAMS})
+    key.update({k: params.get(k) or file_stamp(params.get(path_key)) for k,path_key in STAMP_PARAMS.items()})
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def get_cached(backend, fingerprint: str, param_sets: Iterable[dict]) -> Dict[int, pd.DataFrame]:
+    """
+    Get the cached STAR param search results of parameter sets.
+    The sample & accession of the cached rows are set to those of the parameter set.
+    Any backend error is logged, and treated as a cache miss.
+    Args:
+        backend: Cache backend (see `get_backend`)
+        fingerprint: Read fingerprint
+        param_sets: Parameter sets
+    Returns:
+        {index of the parameter set: STAR param search row (see format-star-params.py)} for all hits
+    """
+    import pandas as pd
+    hits = {}
+    for i,params in enumerate(param_sets):
+        try:
+            value = backend.get(cache_key(fingerprint, params))
+        except Exception as e:
+            logging.warning(f"Param cache lookup failed: {e}")
+            return hits
+        if value is None:
+            continue
+        df = pd.read_csv(StringIO(value))
+        if df.shape[0] == 0:
+            # no STAR summary row (written by older versions): a miss
+            continue
+        for col in ("sample", "accession", "barcodes_name", "organism"):
+            if col in params:
+                df[col] = params[col]
+        hits[i] = df
+    return hits
+
+def put_cached(backend, fingerprint: str, params: dict, df: Union[pd.DataFrame, str]) -> None:
+    """
+    Write a STAR param search result to the cache.
+    Any backend error is logged, and otherwise ignored.
+    Args:
+        backend: Cache backend (see `get_backend`)
+        fingerprint: Read fingerprint
+        params: Parameter set
+        df: STAR param search row (see format-star-params.py), as a DataFrame or CSV text
+    """
+    value = df if isinstance(df, str) else df.to_csv(index=False)
+    try:
+        backend.put(cache_key(fingerprint, params), value)
+    except Exception as e:
+        logging.warning(f"Param cache update failed: {e}")
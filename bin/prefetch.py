@@ -4,14 +4,17 @@ from __future__ import print_function
 import os
 import re
 import sys
+import socket
+import asyncio
 import argparse
 import logging
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
 from time import sleep
 from shutil import which
-from subprocess import Popen, PIPE
-import pandas as pd
-from db_utils import db_connect, db_upsert, add_to_log
+from db_utils import LogSink
+from telemetry import Telemetry, file_size_gb
+from cmd_runner import CmdResult, run_cmd, run_cmd_async
+from sra_download import RESUMABLE, MAX_RETRY_TIME, DownloadError, download_sra
 
 # logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
@@ -24,6 +27,12 @@ class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
 desc = 'Run sra-tools prefetch'
 epi = """DESCRIPTION:
 Run sra-tools prefetch with handling of errors
+
+With --resumable (or SCRECOUNTER_RESUMABLE_DOWNLOAD=true), the SRA file is instead downloaded
+via HTTP range requests (see sra_download.py): partial downloads are resumed, the md5 is
+validated during the download, and retries are limited by a total retry time
+(--max-retry-time) instead of a number of tries. If the file cannot be located or
+downloaded, prefetch is used.
 """
 parser = argparse.ArgumentParser(description=desc, epilog=epi,
                                  formatter_class=CustomFormatter)
@@ -38,33 +47,40 @@ parser.add_argument('--sample', type=str, default="",
                     help='Sample name')
 parser.add_argument('--gcp-download', action='store_true', default=False,
                     help='Obtain sequence data from SRA GCP mirror')
+parser.add_argument('--resumable', action='store_true', default=RESUMABLE,
+                    help='Use the resumable downloader instead of prefetch')
+parser.add_argument('--max-retry-time', type=float, default=MAX_RETRY_TIME,
+                    help='Max total retry time (seconds) of the resumable downloader')
+parser.add_argument('--no-db', action='store_true', default=False,
+                    help='Do not write the log & timing records to the database (write them to the JSONL spill file)')
+
+# constants
+## hosts resolved (DNS warm-up) while the pre-download checks run
+DOWNLOAD_HOSTS = ["locate.ncbi.nlm.nih.gov", "sra-pub-run-odp.s3.amazonaws.com", "sra-downloadb.be-md.ncbi.nlm.nih.gov"]
+GCP_DOWNLOAD_HOSTS = ["storage.googleapis.com"]
+VDB_CONFIG_CMD = ["vdb-config", "--report-cloud-identity", "yes"]
 
 # functions
-def run_cmd(cmd: str) -> Tuple[int,bytes,bytes]:
+def run_vdb_config() -> Tuple[str,str]:
     """
-    Run sub-command and return returncode, output, and error.
-    Args:
-        cmd: Command to run
+    Run vdb-config with error handling.
     Returns:
-        (returncode, output, error)
+        Status and message
     """
-    logging.info(f'Running: {cmd}')
-    p = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True)
-    output, err = p.communicate()
-    return p.returncode, output, err
+    return check_vdb_config(run_cmd(VDB_CONFIG_CMD))
 
-def run_vdb_config() -> Tuple[str,str]:
+def check_vdb_config(res: CmdResult) -> Tuple[str,str]:
     """
-    Run vdb-config with error handling.
+    Check the result of vdb-config.
+    Args:
+        res: vdb-config result
     Returns:
         Status and message
     """
-    cmd = f"vdb-config --report-cloud-identity yes"
-    rc,output,err = run_cmd(cmd)
-    if rc != 0:
+    if res.returncode != 0:
         logging.warning('vdb-config failed')
-        logging.warning(err)
-        return "Failure",f'vdb-config failed: {err}'
+        logging.warning(res.err)
+        return "Failure",f'vdb-config failed: {res.err}'
     return "Success","vdb-config successful"
 
 def prefetch(accession: str, tries: int, max_size_gb: int, outdir: str) -> Tuple[str,str]:
@@ -79,25 +95,25 @@ def prefetch(accession: str, tries: int, max_size_gb: int, outdir: str) -> Tuple
         Status and message
     """
     logging.info(f"Downloading {accession}")
-    cmd = f"prefetch --max-size {max_size_gb}G --output-directory {outdir} {accession}"
-    err = ""
+    cmd = ["prefetch", "--max-size", f"{max_size_gb}G", "--output-directory", outdir, accession]
+    err = b""
     for i in range(tries):
         logging.info(f"Attempt: {i+1}/{tries}")
-        rc,output,err = run_cmd(cmd)
-        if rc == 0:
+        res = run_cmd(cmd)
+        err = res.err
+        if res.returncode == 0:
             logging.info("Download successful")
             # run vdb-validate
             sra_dir = os.path.join(outdir, accession)
-            rc,output,err = run_cmd(f"vdb-validate {sra_dir}")
-            if rc == 0:
+            res = run_cmd(["vdb-validate", sra_dir])
+            err = res.err
+            if res.returncode == 0:
                 logging.info("Validation successful")
                 return "Success","Download and validation successful"
             else:
                 logging.warning("Validation failed")
-                logging.warning(err)
         else:
             logging.warning("Download failed")
-            logging.warning(err)
         # sleep prior to next attempt
         sleep_time = 20 * (i + 1)
         logging.info(f"Sleeping for {sleep_time} seconds...")
@@ -106,26 +122,68 @@ def prefetch(accession: str, tries: int, max_size_gb: int, outdir: str) -> Tuple
     err = err.decode().replace('\n', ' ')
     return "Failure",f"Failed to download and validate: {err}"
     
+def resumable_download(accession: str, max_size_gb: float, outdir: str, gcp_download: bool=False,
+                       max_retry_time: float=MAX_RETRY_TIME) -> Tuple[str,str]:
+    """
+    Download an SRA file with the resumable downloader (see sra_download.py).
+    vdb-validate is only run if the md5 of the file is not available.
+    Args:
+        accession: SRA accession
+        max_size_gb: Max file size in Gb
+        outdir: Output directory
+        gcp_download: Use GCP mirror
+        max_retry_time: Max total retry time (seconds)
+    Returns:
+        Status and message
+    """
+    logging.info(f"Downloading {accession} (resumable)")
+    try:
+        sra_file,md5 = download_sra(
+            accession, outdir, gcp_download=gcp_download, 
+            max_size_gb=max_size_gb, max_retry_time=max_retry_time
+        )
+    except DownloadError as e:
+        logging.warning(f"Resumable download failed: {e}")
+        return "Failure",f"Resumable download failed: {e}"
+    if md5:
+        return "Success","Download successful; md5 validated"
+    res = run_cmd(["vdb-validate", os.path.join(outdir, accession)])
+    if res.returncode != 0:
+        logging.warning("Validation failed")
+        os.remove(sra_file)
+        return "Failure",f"Validation failed: {res.err.decode().replace(chr(10), ' ')}"
+    return "Success","Download and validation successful"
+
 def run_vdb_dump(accession: str, min_size: int=1e6) -> Tuple[str,str]:
     """
     Run vdb-dump with error handling.
     Args:
-        sra_file: SRA file
-        outdir: Output directory
+        accession: SRA accession
+        min_size: Min file size (bytes)
     Returns:
         Status and message
     """
-    cmd = f"vdb-dump --info {accession}"
-    rc,output,err = run_cmd(cmd)
-    if rc != 0:
+    return check_vdb_dump(run_cmd(["vdb-dump", "--info", accession]), accession, min_size)
+
+def check_vdb_dump(res: CmdResult, accession: str, min_size: int=1e6) -> Tuple[str,str]:
+    """
+    Check the result of `vdb-dump --info`: accession, file size & platform.
+    Args:
+        res: vdb-dump result
+        accession: SRA accession
+        min_size: Min file size (bytes)
+    Returns:
+        Status and message
+    """
+    if res.returncode != 0:
         logging.warning("Dump failed")
-        logging.warning(err)
-        return "Failure",f'vdb-dump failed: {err}'
+        logging.warning(res.err)
+        return "Failure",f'vdb-dump failed: {res.err}'
 
     # parse the output
     regex = re.compile(r' *: ')
     data = {}
-    for line in output.decode().split('\n'):
+    for line in res.output.decode().split('\n'):
         line = regex.split(line.rstrip(), 1)
         if len(line) < 2:
             continue
@@ -153,6 +211,36 @@ def run_vdb_dump(accession: str, min_size: int=1e6) -> Tuple[str,str]:
     # all checks passed
     return "Success","Validation successful"
 
+async def warm_dns(hosts: List[str]) -> None:
+    """
+    Resolve hosts (errors are ignored), so that the download does not wait on DNS lookups.
+    Args:
+        hosts: Host names
+    """
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *[loop.getaddrinfo(host, 443, type=socket.SOCK_STREAM) for host in hosts], 
+        return_exceptions=True
+    )
+    resolved = [host for host,x in zip(hosts, results) if not isinstance(x, Exception)]
+    logging.info(f"DNS warm-up: resolved {len(resolved)} of {len(hosts)} hosts")
+
+async def pre_download_checks(accession: str, gcp_download: bool=False) -> Tuple[Optional[CmdResult], CmdResult]:
+    """
+    Run vdb-config (if `gcp_download`) & vdb-dump, and warm up DNS, concurrently.
+    Args:
+        accession: SRA accession
+        gcp_download: Use GCP mirror
+    Returns:
+        (vdb-config result or None, vdb-dump result)
+    """
+    hosts = DOWNLOAD_HOSTS + (GCP_DOWNLOAD_HOSTS if gcp_download else [])
+    vdb_config = run_cmd_async(VDB_CONFIG_CMD) if gcp_download else asyncio.sleep(0)
+    res_config,res_dump,_ = await asyncio.gather(
+        vdb_config, run_cmd_async(["vdb-dump", "--info", accession]), warm_dns(hosts)
+    )
+    return res_config,res_dump
+
 def write_log(logF, sample: str, accession: str, step: str, msg: str) -> None:
     """
     Write log to file.
@@ -167,40 +255,59 @@ def write_log(logF, sample: str, accession: str, step: str, msg: str) -> None:
         msg = msg[:100] + '...'
     logF.write(','.join([sample, accession, step, msg]) + '\n')
 
-def prefetch_workflow(sample: str, accession: str, log_df: pd.DataFrame, outdir:str, 
-                      gcp_download: bool=False, tries: int=3, max_size_gb: float=1000) -> Optional[str]:
+def prefetch_workflow(sample: str, accession: str, log: LogSink, outdir:str, 
+                      gcp_download: bool=False, tries: int=3, max_size_gb: float=1000,
+                      resumable: bool=RESUMABLE, max_retry_time: float=MAX_RETRY_TIME,
+                      telemetry: Optional[Telemetry]=None) -> Optional[str]:
     """
     Run prefetch workflow.
     Args:
         sample: Sample name
         accession: SRA accession
-        log_df: Log dataframe
+        log: Log record sink
         outdir: Output directory
         gcp_download: Use GCP mirror
         tries: Number of tries
         max_size_gb: Max file size in Gb
+        resumable: Use the resumable downloader (prefetch is used if it fails)
+        max_retry_time: Max total retry time (seconds) of the resumable downloader
+        telemetry: Timing record sink; if None, timings are only logged
     """
+    if telemetry is None:
+        telemetry = Telemetry("prefetch", sample, accession, enabled=False)
+
     # check for prefetch in path
     for exe in ['prefetch', 'vdb-dump']:
         if not which(exe):
             logging.error(f'{exe} not found in PATH')
             sys.exit(1)
 
-    # run vdb-config
+    # run vdb-config & vdb-dump (concurrently)
+    with telemetry.span("pre-download checks", accession=accession):
+        res_config,res_dump = asyncio.run(pre_download_checks(accession, gcp_download))
     if gcp_download:
-        status,msg = run_vdb_config()
-        add_to_log(log_df, sample, accession, "prefetch", "vdb-config", status, msg)
-
-    # run vdb-dump
-    status,msg = run_vdb_dump(accession)
-    add_to_log(log_df, sample, accession, "prefetch", "vdb-dump", status, msg)
+        status,msg = check_vdb_config(res_config)
+        log.add(sample, accession, "prefetch", "vdb-config", status, msg)
+    status,msg = check_vdb_dump(res_dump, accession)
+    log.add(sample, accession, "prefetch", "vdb-dump", status, msg)
     if status != "Success":
        logging.warning(f'vdb-dump validation failed: {msg}')
        return None
 
-    # run prefetch
-    status,msg = prefetch(accession, tries, max_size_gb, outdir)
-    add_to_log(log_df, sample, accession, "prefetch", "prefetch", status, msg)
+    # run the resumable download, else prefetch
+    status = None
+    if resumable:
+        with telemetry.span("resumable_download", accession=accession) as span:
+            status,msg = resumable_download(accession, max_size_gb, outdir, gcp_download, max_retry_time)
+            span.status = status
+            span.input_gb = file_size_gb(os.path.join(outdir, accession))
+        log.add(sample, accession, "prefetch", "resumable_download", status, msg)
+    if status != "Success":
+        with telemetry.span("prefetch", accession=accession) as span:
+            status,msg = prefetch(accession, tries, max_size_gb, outdir)
+            span.status = status
+            span.input_gb = file_size_gb(os.path.join(outdir, accession))
+        log.add(sample, accession, "prefetch", "prefetch", status, msg)
     if status != "Success":
         logging.warning(f'Failed to download: {msg}')
         return None
@@ -223,25 +330,23 @@ if __name__ == '__main__':
 
     # setup
     os.makedirs(args.outdir, exist_ok=True)
-    log_df = pd.DataFrame(
-        columns=["sample", "accession", "process", "step", "status", "message"]
-    )
 
-    # run workflow
-    prefetch_workflow(
-        args.sample, args.accession, log_df, 
-        outdir=args.outdir, 
-        gcp_download=args.gcp_download, 
-        tries=args.tries, 
-        max_size_db=args.max_size_gb
-    )
+    # run workflow; log & timing records are upserted to the database in batches
+    with LogSink(use_db=not args.no_db) as log, \
+         Telemetry("prefetch", args.sample, args.accession, use_db=not args.no_db) as telemetry:
+        prefetch_workflow(
+            args.sample, args.accession, log, 
+            outdir=args.outdir, 
+            gcp_download=args.gcp_download, 
+            tries=args.tries, 
+            max_size_gb=args.max_size_gb,
+            resumable=args.resumable,
+            max_retry_time=args.max_retry_time,
+            telemetry=telemetry
+        )
 
-    # write log
-    log_file = os.path.join(args.outdir, "prefetch_log.csv")
-    log_df.to_csv(log_file, index=False)
-    logging.info(f'Log written to: {log_file}')
-    
-    # upsert log to database
-    with db_connect() as conn:
-        db_upsert(log_df, "screcounter_log", conn)
+        # write log
+        log_file = os.path.join(args.outdir, "prefetch_log.csv")
+        log.to_df().to_csv(log_file, index=False)
+        logging.info(f'Log written to: {log_file}')
     
\ No newline at end of file
@@ -0,0 +1,161 @@
+# import
+## batteries
+import os
+import queue
+import threading
+from subprocess import Popen
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+## pipeline
+from fastq_utils import read_length_stats, filter_read_lengths, assign_reads
+
+# constants
+## target size (bytes) of the chunks passed to writers
+CHUNK_SIZE = 1 << 22
+
+# classes
+class QueueWriter(threading.Thread):
+    """
+    Write chunks of bytes from a bounded queue to a FIFO (`path`), or else to the stdin of `proc`.
+    If `proc` exits, `put()` raises instead of blocking.
+    """
+    def __init__(self, path: Optional[str], proc: Popen, maxsize: int=16):
+        super().__init__(daemon=True)
+        self.path = path
+        self.proc = proc
+        self.error: Optional[Exception] = None
+        self.bytes_written = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def run(self) -> None:
+        try:
+            outF = open(self.path, "wb") if self.path else self.proc.stdin
+            with outF:
+                while True:
+                    chunk = self._queue.get()
+                    if chunk is None:
+                        break
+                    outF.write(chunk)
+                    self.bytes_written += len(chunk)
+        except Exception as e:
+            self.error = e
+            # unblock `put()`
+            while self._queue.get() is not None:
+                pass
+
+    def put(self, chunk: Optional[bytes]) -> None:
+        """
+        Add a chunk to the queue; None closes the output.
+        Args:
+            chunk: Bytes to write
+        """
+        name = self.path or self.proc.args[0]
+        while True:
+            if self.error is not None:
+                raise IOError(f"Failed to write to {name}: {self.error}")
+            try:
+                self._queue.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                if self.proc.poll() is not None:
+                    self.unblock()
+                    raise IOError(f"Reader of {name} exited with code {self.proc.returncode}")
+
+    def unblock(self) -> None:
+        """
+        Open & close the reading end of the FIFO, so a writer blocked in open() can proceed.
+        """
+        if not self.path:
+            return
+        try:
+            os.close(os.open(self.path, os.O_RDONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+
+# functions
+def fasterq_dump_stdout_cmd(sra_path: str, threads: int, bufsize: str, curcache: str, mem: str, 
+                            temp: str, min_read_len: Optional[int]=None) -> List[str]:
+    """
+    Create a fasterq-dump command that writes all reads of each spot (one record per read) to stdout.
+    The read number is written after the spot name in the header (`@<accession>.<spot> <read_number>`).
+    Args:
+        sra_path: Prefetched SRA file (or accession)
+        threads: Number of threads
+        bufsize: Buffer size
+        curcache: Current cache size
+        mem: Memory
+        temp: Temporary directory
+        min_read_len: Minimum read length; shorter reads are not written
+    Returns:
+        Command
+    """
+    cmd = [
+        "fasterq-dump",
+        "--split-spot",
+        "--stdout",
+        "--include-technical",
+        "--seq-defline", "@$ac.$si $ri",
+        "--qual-defline", "+",
+        "--threads", threads,
+        "--bufsize", bufsize,
+        "--curcache", curcache,
+        "--mem", mem,
+        "--temp", temp,
+    ]
+    if min_read_len is not None:
+        cmd += ["--min-read-len", min_read_len]
+    return [str(x) for x in cmd + [sra_path]]
+
+def read_number(record: bytes) -> bytes:
+    """
+    Get the read number from a record header (`@<spot> <read_number>`).
+    Args:
+        record: Fastq record
+    Returns:
+        Read number
+    """
+    end = record.find(b"\n")
+    return record[record.find(b" ", 0, end)+1:end].strip()
+
+def iter_spots(records: Iterable[bytes]) -> Iterator[Tuple[bytes, Dict[bytes, bytes]]]:
+    """
+    Group consecutive fastq records by spot.
+    Args:
+        records: Fastq records with `@<spot> <read_number>` headers
+    Yields:
+        (spot name, {read number: record})
+    """
+    spot, reads = None, {}
+    for rec in records:
+        end = rec.find(b"\n")
+        sep = rec.find(b" ", 0, end)
+        name = rec[1:sep]
+        if name != spot:
+            if reads:
+                yield spot, reads
+            spot, reads = name, {}
+        reads[rec[sep+1:end].strip()] = rec
+    if reads:
+        yield spot, reads
+
+def assign_spot_reads(spots: List[Dict[bytes, bytes]], min_read_length: int) -> Dict[str, bytes]:
+    """
+    Assign read 1 & read 2 (read numbers) from a sample of spots.
+    Args:
+        spots: Sampled spots
+        min_read_length: Minimum read length
+    Returns:
+        {"R1": <read number>, "R2": <read number>}
+    """
+    lengths = defaultdict(Counter)
+    for reads in spots:
+        for read_num,rec in reads.items():
+            start = rec.find(b"\n") + 1
+            lengths[read_num][rec.find(b"\n", start) - start] += 1
+    read_stats = {k: read_length_stats(v) for k,v in lengths.items()}
+    for k,stats in sorted(read_stats.items()):
+        logging.info(
+            f"Read {k.decode()}: reads={stats.num_reads}, mean={stats.mean:.1f}, min={stats.min}, max={stats.max}, mode={stats.mode}"
+        )
+    return assign_reads(filter_read_lengths(read_stats, min_read_length))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# import
+## batteries
+from __future__ import print_function
+import os
+import sys
+import argparse
+import logging
+import pandas as pd
+## pipeline
+from resource_model import (
+    QUANTILE, MIN_TASKS, RESOURCES, training_data, fit_model, predict, save_model, load_model,
+    load_db_data, sizes_from_df, sample_accessions_from_df
+)
+
+# logging
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
+
+# argparse
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
+                      argparse.RawDescriptionHelpFormatter):
+    pass
+
+desc = 'Fit the resource model & write per-accession resource hints'
+epi = """DESCRIPTION:
+Trace-driven resource prediction (memory, time & disk) for the download & STAR processes.
+
+With --fit, a model is fit per process & resource from historical tasks: the Nextflow traces
+(screcounter_trace), joined with the SRA file sizes (screcounter_sra_stat) via the task tags
+("<sample>:<accession>" or "<sample>"; the size of a sample is the total of its accessions,
+via screcounter_log). Instead of the database, trace files, sra-stat tables & accession tables
+can be provided. Each resource is modeled as (intercept + slope * size_gb) * factor, where the
+factor is the --quantile of the observed/fitted ratios, so that most tasks fit on the first attempt.
+Peak disk usage is not in the trace, so the bytes written (wchar) are used as a conservative proxy.
+
+The model (JSON) is used by the pipeline via --resource_model; processes without a
+fitted model (or too few tasks) use the static resource ladder.
+
+Given sra-stat tables, the predicted resources are written per accession & process
+(and per sample, with --accessions), e.g., to review the model before a run.
+
+Examples:
+# fit from the database
+resource-hints.py --fit --model resource_model.json
+# fit from files
+resource-hints.py --fit --model resource_model.json --trace nf-trace/*.txt --accessions accessions.csv sra-stat.csv
+# hints
+resource-hints.py --model resource_model.json --accessions accessions.csv --outfile hints.csv sra-stat.csv
+"""
+parser = argparse.ArgumentParser(description=desc, epilog=epi,
+                                 formatter_class=CustomFormatter)
+parser.add_argument('sra_stats_csv', type=str, nargs='*',
+                    help='sra-stat table(s) (columns: accession, file_size_gb)')
+parser.add_argument('--model', type=str, default='resource_model.json',
+                    help='Model file (written with --fit)')
+parser.add_argument('--fit', action='store_true', default=False,
+                    help='Fit the model (from the database, unless --trace is provided)')
+parser.add_argument('--trace', type=str, nargs='+', default=None,
+                    help='Nextflow trace file(s) (tsv) used to fit the model, instead of the database')
+parser.add_argument('--accessions', type=str, default=None,
+                    help='Table of sample & accession (csv), to map samples to accessions')
+parser.add_argument('--quantile', type=float, default=QUANTILE,
+                    help='Quantile of the observed/fitted ratios used as the safety factor')
+parser.add_argument('--min-tasks', type=int, default=MIN_TASKS,
+                    help='Min number of successful tasks to fit a model per process & resource')
+parser.add_argument('--outfile', type=str, default='resource_hints.csv',
+                    help='Output file of the resource hints')
+
+# functions
+def read_tables(files: list, sep: str=",") -> pd.DataFrame:
+    """
+    Read & concatenate tables.
+    """
+    if not files:
+        return pd.DataFrame()
+    return pd.concat([pd.read_csv(f, sep=sep) for f in files], ignore_index=True)
+
+def fit(args) -> dict:
+    """
+    Fit the resource model, from trace files or the database.
+    Args:
+        args: Command-line arguments
+    Returns:
+        Model
+    """
+    if args.trace:
+        trace = read_tables(args.trace, sep="\t")
+        trace = trace.rename(columns={"%cpu": "cpu_percent"})
+        sizes_gb = sizes_from_df(read_tables(args.sra_stats_csv))
+        samples = sample_accessions_from_df(read_tables([args.accessions])) if args.accessions else {}
+    else:
+        from db_utils import get_conn
+        with get_conn() as conn:
+            trace,sizes_gb,samples = load_db_data(conn)
+    logging.info(f"No. of completed tasks: {len(trace)}")
+    data = training_data(trace, sizes_gb, samples)
+    logging.info(f"No. of tasks with a known input size: {len(data)}")
+    model = fit_model(data, quantile=args.quantile, min_tasks=args.min_tasks)
+    save_model(model, args.model)
+    return model
+
+def write_hints(model: dict, args) -> None:
+    """
+    Predict the resources of each accession (and sample) for each modeled process.
+    Args:
+        model: Model
+        args: Command-line arguments
+    """
+    sizes_gb = sizes_from_df(read_tables(args.sra_stats_csv))
+    samples = sample_accessions_from_df(read_tables([args.accessions])) if args.accessions else {}
+    # accession & sample inputs
+    inputs = [("", acc, size) for acc,size in sizes_gb.items()]
+    for sample,accessions in samples.items():
+        sizes = [sizes_gb.get(acc) for acc in accessions]
+        if None not in sizes:
+            inputs.append((sample, "", sum(sizes)))
+    # predict
+    rows = []
+    for process in sorted(model.get("processes", {})):
+        for sample,accession,size_gb in inputs:
+            rows.append({
+                "process": process, "sample": sample, "accession": accession,
+                "sra_file_size_gb": size_gb, **predict(model, process, size_gb)
+            })
+    columns = ["process", "sample", "accession", "sra_file_size_gb"] + [k for _,k in RESOURCES]
+    pd.DataFrame(rows, columns=columns).round(3).to_csv(args.outfile, index=False)
+    logging.info(f"Resource hints written to: {args.outfile}")
+
+def main(args):
+    # fit or load the model
+    if args.fit:
+        model = fit(args)
+    else:
+        if not os.path.exists(args.model):
+            logging.error(f"Model not found: {args.model}")
+            sys.exit(1)
+        model = load_model(args.model)
+
+    # write the hints
+    if args.sra_stats_csv:
+        write_hints(model, args)
+
+## script main
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
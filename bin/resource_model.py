@@ -0,0 +1,260 @@
+# import
+## batteries
+import os
+import re
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+## 3rd party
+import numpy as np
+import pandas as pd
+
+# constants
+## resources predicted per process: (trace column, model key)
+## (the peak disk usage of a task is not in the trace, so the bytes written (`wchar`) are used as a conservative proxy)
+RESOURCES = [("peak_rss", "memory_gb"), ("realtime", "time_h"), ("wchar", "disk_gb")]
+## min predicted value per resource
+MIN_VALUES = {"memory_gb": 1.0, "time_h": 0.25, "disk_gb": 10.0}
+## quantile of the observed/fitted ratios used as the safety factor of the predictions
+QUANTILE = float(os.getenv("SCRECOUNTER_RESOURCE_QUANTILE", 0.95))
+## min number of (successful) tasks needed to fit a model
+MIN_TASKS = 20
+MODEL_VERSION = 1
+
+## units of the (human-readable) trace values
+MEMORY_UNITS = {"B": 1e-9, "KB": 1024 / 1e9, "MB": 1024**2 / 1e9, "GB": 1024**3 / 1e9, "TB": 1024**4 / 1e9}
+TIME_UNITS = {"ms": 1 / 3600000, "s": 1 / 3600, "m": 1 / 60, "h": 1.0, "d": 24.0}
+
+# functions
+def parse_memory_gb(value) -> Optional[float]:
+    """
+    Parse a Nextflow trace memory value (e.g., "1.2 GB", "345 MB", or bytes) as GB.
+    Args:
+        value: Trace value
+    Returns:
+        Value in GB; None if missing or not parsable
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value) / 1e9
+    m = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?B)?\s*", str(value))
+    if not m:
+        return None
+    return float(m.group(1)) * MEMORY_UNITS[m.group(2) or "B"]
+
+def parse_time_h(value) -> Optional[float]:
+    """
+    Parse a Nextflow trace duration (e.g., "1h 2m 3s", "45.3s", "500ms", or milliseconds) as hours.
+    Args:
+        value: Trace value
+    Returns:
+        Value in hours; None if missing or not parsable
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value) / 3600000
+    parts = re.findall(r"([\d.]+)\s*(ms|s|m|h|d)", str(value))
+    if not parts:
+        return None
+    return sum(float(x) * TIME_UNITS[unit] for x,unit in parts)
+
+def parse_task_name(name: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    Parse a Nextflow task name, with the tag "<sample>" or "<sample>:<accession>".
+    Args:
+        name: Task name (e.g., "STAR_FULL_WF:FASTERQ_DUMP (SRX123:SRR456)")
+    Returns:
+        (process name without the workflow prefix, sample, accession)
+    """
+    m = re.fullmatch(r"\s*([^\s(]+)\s*(?:\((.*)\))?\s*", str(name))
+    if not m:
+        return str(name), None, None
+    process = m.group(1).split(":")[-1]
+    tag = m.group(2) or ""
+    if not tag or tag.isdigit():
+        # no tag; the task index
+        return process, None, None
+    sample,_,accession = tag.partition(":")
+    return process, sample, accession or None
+
+def training_data(
+    trace: pd.DataFrame, sizes_gb: Dict[str, float], sample_accessions: Dict[str, Iterable[str]]
+    ) -> pd.DataFrame:
+    """
+    Create the training data: one row per successful task, with its input size & resource usage.
+    Tasks tagged with an accession use the SRA file size of the accession; tasks tagged
+    with a sample use the total size of the sample's accessions.
+    Args:
+        trace: Nextflow trace records (columns: name, status, peak_rss, realtime, wchar)
+        sizes_gb: {accession: SRA file size (GB)}
+        sample_accessions: {sample: accessions}
+    Returns:
+        Training data (columns: process, sample, accession, size_gb, + the model keys of `RESOURCES`)
+    """
+    rows = []
+    for rec in trace.to_dict("records"):
+        if rec.get("status") != "COMPLETED":
+            continue
+        process,sample,accession = parse_task_name(rec.get("name", ""))
+        if accession:
+            size_gb = sizes_gb.get(accession)
+        elif sample and sample in sample_accessions:
+            sizes = [sizes_gb.get(acc) for acc in set(sample_accessions[sample])]
+            size_gb = sum(sizes) if sizes and None not in sizes else None
+        else:
+            size_gb = None
+        if size_gb is None:
+            continue
+        row = {"process": process, "sample": sample, "accession": accession, "size_gb": size_gb}
+        row["memory_gb"] = parse_memory_gb(rec.get("peak_rss"))
+        row["time_h"] = parse_time_h(rec.get("realtime"))
+        row["disk_gb"] = parse_memory_gb(rec.get("wchar"))
+        rows.append(row)
+    return pd.DataFrame(rows, columns=["process", "sample", "accession", "size_gb"] + [k for _,k in RESOURCES])
+
+def fit_resource(x: np.ndarray, y: np.ndarray, quantile: float=QUANTILE, min_value: float=0.0) -> dict:
+    """
+    Fit a model of a resource: value = (intercept + slope * size_gb) * factor,
+    with a non-negative slope (least squares), and a safety factor: the `quantile`
+    of the observed/fitted ratios (>= 1), so that ~`quantile` of the tasks fit within the prediction.
+    Args:
+        x: Input sizes (GB)
+        y: Observed resource values
+        quantile: Quantile of the observed/fitted ratios
+        min_value: Min predicted value
+    Returns:
+        Model parameters
+    """
+    slope,intercept = np.polyfit(x, y, 1) if len(np.unique(x)) > 1 else (0.0, float(np.mean(y)))
+    if slope < 0:
+        slope,intercept = 0.0, float(np.mean(y))
+    fitted = np.maximum(intercept + slope * x, min_value)
+    factor = max(1.0, float(np.quantile(y / fitted, quantile)))
+    return {
+        "intercept": float(intercept), "slope": float(slope), "factor": factor,
+        "min": min_value, "n": int(len(x)), "max_size_gb": float(np.max(x))
+    }
+
+def fit_model(data: pd.DataFrame, quantile: float=QUANTILE, min_tasks: int=MIN_TASKS) -> dict:
+    """
+    Fit a model per process & resource (see `fit_resource`).
+    Args:
+        data: Training data (see `training_data`)
+        quantile: Quantile of the observed/fitted ratios
+        min_tasks: Min number of tasks per process & resource
+    Returns:
+        Model: {"version", "fitted_at", "quantile", "processes": {process: {resource: parameters}}}
+    """
+    processes = {}
+    for process,df in data.groupby("process"):
+        for _,key in RESOURCES:
+            df_res = df[["size_gb", key]].dropna()
+            if len(df_res) < min_tasks:
+                logging.info(f"{process}/{key}: too few tasks ({len(df_res)} < {min_tasks}); not fitted")
+                continue
+            params = fit_resource(
+                df_res["size_gb"].to_numpy(float), df_res[key].to_numpy(float),
+                quantile=quantile, min_value=MIN_VALUES[key]
+            )
+            processes.setdefault(process, {})[key] = params
+            logging.info(f"{process}/{key}: {params}")
+    return {
+        "version": MODEL_VERSION,
+        "fitted_at": datetime.now(timezone.utc).isoformat(),
+        "quantile": quantile,
+        "processes": processes
+    }
+
+def predict(model: dict, process: str, size_gb: float) -> Dict[str, Optional[float]]:
+    """
+    Predict the resources of a task.
+    Args:
+        model: Model (see `fit_model`)
+        process: Process name
+        size_gb: Input size (GB)
+    Returns:
+        {resource: predicted value}; None for resources without a model
+    """
+    models = model.get("processes", {}).get(process, {})
+    preds = {}
+    for _,key in RESOURCES:
+        params = models.get(key)
+        if params is None:
+            preds[key] = None
+            continue
+        value = max(params["intercept"] + params["slope"] * size_gb, params["min"])
+        preds[key] = value * params["factor"]
+    return preds
+
+def save_model(model: dict, path: str) -> None:
+    """
+    Write a model as JSON.
+    Args:
+        model: Model
+        path: Output file
+    """
+    outdir = os.path.dirname(path)
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+    with open(path, "w") as outF:
+        json.dump(model, outF, indent=2)
+    logging.info(f"Model written to: {path}")
+
+def load_model(path: str) -> dict:
+    """
+    Read a model (JSON).
+    Args:
+        path: Model file
+    Returns:
+        Model
+    """
+    with open(path) as inF:
+        model = json.load(inF)
+    if model.get("version") != MODEL_VERSION:
+        raise ValueError(f"Unsupported model version: {model.get('version')}")
+    return model
+
+def load_db_data(conn) -> Tuple[pd.DataFrame, Dict[str, float], Dict[str, List[str]]]:
+    """
+    Load the training inputs from the scRecounter database: the Nextflow traces
+    (screcounter_trace), the SRA file sizes (screcounter_sra_stat), and the
+    sample => accessions mapping (screcounter_log).
+    Args:
+        conn: Database connection
+    Returns:
+        (trace records, {accession: size_gb}, {sample: accessions})
+    """
+    trace = pd.read_sql(
+        "SELECT name, status, peak_rss, realtime, wchar FROM screcounter_trace WHERE status = 'COMPLETED'", conn
+    )
+    sizes = pd.read_sql(
+        "SELECT accession, file_size_gb FROM screcounter_sra_stat WHERE file_size_gb IS NOT NULL", conn
+    )
+    samples = pd.read_sql("SELECT DISTINCT sample, accession FROM screcounter_log", conn)
+    return trace, sizes_from_df(sizes), sample_accessions_from_df(samples)
+
+def sizes_from_df(df: pd.DataFrame) -> Dict[str, float]:
+    """
+    Get the SRA file sizes from an sra-stat table.
+    Args:
+        df: sra-stat table (columns: accession, file_size_gb)
+    Returns:
+        {accession: size_gb}
+    """
+    df = df.dropna(subset=["file_size_gb"])
+    return dict(zip(df["accession"], df["file_size_gb"].astype(float)))
+
+def sample_accessions_from_df(df: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    Get the accessions of each sample.
+    Args:
+        df: Table with sample & accession columns
+    Returns:
+        {sample: accessions}
+    """
+    df = df.dropna(subset=["sample", "accession"])
+    df = df[(df["sample"] != "") & (df["accession"] != "")].drop_duplicates(["sample", "accession"])
+    return df.groupby("sample")["accession"].apply(list).to_dict()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# import
+## batteries
+from __future__ import print_function
+import os
+import sys
+import json
+import argparse
+import logging
+from typing import List, Dict, Tuple
+import pandas as pd
+from db_utils import LogSink
+from telemetry import Telemetry
+from star_select import read_seqkit_stats, estimate_num_cells, select_best_params
+
+# logging
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
+
+# argparse
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
+                      argparse.RawDescriptionHelpFormatter):
+    pass
+
+desc = 'Select the best STAR parameters for many samples at once.'
+epi = """DESCRIPTION:
+Batch version of select-star-params.py: the STAR param search tables of all
+samples & accessions are concatenated once, and the best parameters are selected
+with column-wise operations (see star_select.select_best_params), instead of
+one task (and one pandas import) per sample & accession.
+
+The manifest (JSON) lists each sample & accession, with the index of its
+seqkit stats file (--read-stats) and sra-stat file (--sra-stats).
+The STAR param search tables (--star-params) include the sample & accession.
+
+The outputs of each sample & accession are written to <outdir>/<sample>/<accession>/:
+selected_star_params.json ("{}" if no parameters passed) & merged_star_params.csv,
+the same files as written by select-star-params.py.
+
+Example:
+select-star-params-batch.py --manifest manifest.json --star-params star_params*.csv \\
+  --read-stats read_stats*.tsv --sra-stats sra_stats*.csv
+"""
+parser = argparse.ArgumentParser(description=desc, epilog=epi,
+                                 formatter_class=CustomFormatter)
+parser.add_argument('--manifest', type=str, required=True,
+                    help='Samples & accessions (JSON list of {sample, accession, read_stats, sra_stats})')
+parser.add_argument('--star-params', type=str, nargs='+', required=True,
+                    help='STAR parameters CSV files')
+parser.add_argument('--read-stats', type=str, nargs='+', required=True,
+                    help='seqkit stats files')
+parser.add_argument('--sra-stats', type=str, nargs='+', required=True,
+                    help='sra-stat files')
+parser.add_argument('--outdir', type=str, default="results",
+                    help='Output directory')
+parser.add_argument('--reads_with_barcodes_cutoff', type=float, default=0.3,
+                    help='Minimum fraction of reads with valid barcodes')
+parser.add_argument('--no-db', action='store_true', default=False,
+                    help='Do not write the log & timing records to the database (write them to the JSONL spill file)')
+
+# functions
+def load_info(
+    manifest: List[Dict], star_params_csv: List[str], read_stats_tsv: List[str], sra_stats_csv: List[str]
+    ) -> pd.DataFrame:
+    """
+    Load & merge the STAR param search tables, seqkit stats & sra-stat tables of all samples.
+    Args:
+        manifest: Samples & accessions, with the index of their seqkit stats & sra-stat files
+        star_params_csv: STAR parameters CSV files
+        read_stats_tsv: seqkit stats files
+        sra_stats_csv: sra-stat files
+    Returns:
+        pandas dataframe of parameter combinations
+    """
+    # read in param files
+    params = pd.concat([pd.read_csv(x) for x in star_params_csv], axis=0, ignore_index=True)
+    params[["sample", "accession"]] = params[["sample", "accession"]].astype(str)
+
+    # read in seqkit stats files
+    seqkit_stats = pd.concat([
+        read_seqkit_stats(read_stats_tsv[x["read_stats"]], x["sample"], x["accession"]) for x in manifest
+    ], axis=0, ignore_index=True)
+
+    # read in sra stats files (an sra-stat file can include many accessions)
+    sra_stats = pd.concat([pd.read_csv(x) for x in sra_stats_csv], axis=0, ignore_index=True)
+    sra_stats["accession"] = sra_stats["accession"].astype(str)
+    sra_stats = sra_stats.drop_duplicates("accession")
+
+    # merge on sample and accession, the add sra-stats to all records
+    df = pd.merge(params, seqkit_stats, on=["sample", "accession"])
+    return pd.merge(df, sra_stats, on=["accession"])
+
+def write_data(data: pd.DataFrame, data_all: pd.DataFrame, manifest: List[Dict], outdir: str) -> None:
+    """
+    Write the selected parameters (JSON) & the merged data (CSV) of each sample & accession.
+    Args:
+        data: pandas dataframe of best parameters (one row per sample & accession)
+        data_all: pandas dataframe of all parameters
+        manifest: Samples & accessions
+        outdir: Output directory
+    """
+    # set best parameters for data_all
+    target_cols = ["sample", "accession", "barcodes_file", "star_index", "cell_barcode_length", "umi_length", "strand"]
+    df = data[target_cols].copy()
+    df["Best parameters"] = True
+    data_all = data_all.astype({"cell_barcode_length": int, "umi_length": int})
+    data_all = pd.merge(data_all, df, on=target_cols, how="left")
+    data_all["Best parameters"] = data_all["Best parameters"].astype('boolean').fillna(False)
+    data_all = estimate_num_cells(data_all)
+
+    # write per sample & accession
+    selected = {key: i for i,key in enumerate(zip(data["sample"], data["accession"]))}
+    merged = dict(iter(data_all.groupby(["sample", "accession"], sort=False)))
+    for x in manifest:
+        key = (x["sample"], x["accession"])
+        outdir_x = os.path.join(outdir, *key)
+        os.makedirs(outdir_x, exist_ok=True)
+        # write data as JSON
+        outfile_selected = os.path.join(outdir_x, "selected_star_params.json")
+        with open(outfile_selected, "w") as outF:
+            if key in selected:
+                outF.write(data.iloc[selected[key]].to_json(indent=4))
+            else:
+                outF.write("{}")
+        # write merged data as CSV (no "Best parameters" column, if none were selected)
+        outfile_merged = os.path.join(outdir_x, "merged_star_params.csv")
+        df = merged.get(key, data_all.iloc[0:0])
+        if key not in selected:
+            df = df.drop(columns="Best parameters")
+        df.to_csv(outfile_merged, index=False)
+    logging.info(f"Output written to: {outdir}/<sample>/<accession>/ ({len(manifest)} samples & accessions)")
+
+def main(args, log: LogSink, telemetry: Telemetry):
+    process = "Select STAR params"
+
+    # load the manifest
+    with open(args.manifest) as inF:
+        manifest = json.load(inF)
+    for x in manifest:
+        x["sample"],x["accession"] = str(x["sample"]),str(x["accession"])
+    logging.info(f"No. of samples & accessions: {len(manifest)}")
+
+    # load the data
+    with telemetry.span("Load info"):
+        data_all = load_info(manifest, args.star_params, args.read_stats, args.sra_stats)
+    logging.info(f"No. of parameter sets: {data_all.shape[0]}")
+
+    # select the best parameters of all samples & accessions
+    with telemetry.span("Get best params"):
+        data, status = select_best_params(
+            data_all, reads_with_barcodes_cutoff=args.reads_with_barcodes_cutoff
+        )
+
+    # add to log table
+    failed = dict(zip(zip(status["sample"], status["accession"]), status["failed_step"]))
+    for x in manifest:
+        key = (x["sample"], x["accession"])
+        step = failed.get(key, "Load info")
+        if step == "Load info":
+            msg = "No STAR parameters, seqkit stats or sra-stat records"
+        elif step == "Get best params":
+            msg = "Best parameters not found"
+        elif step == "Read length filter":
+            msg = "No valid barcodes found in the STAR summary table after accounting for read lengths"
+        else:
+            log.add(*key, process, "Final", "Success", "Best parameters selected")
+            continue
+        logging.warning(f"{key[0]} / {key[1]}: {msg}")
+        log.add(*key, process, step, "Failure", msg)
+    logging.info(f"Best parameters selected: {data.shape[0]} of {len(manifest)} samples & accessions")
+
+    # write output
+    with telemetry.span("Write output"):
+        write_data(data, data_all, manifest, args.outdir)
+
+## script main
+if __name__ == '__main__':
+    # arg parse
+    args = parser.parse_args()
+
+    # setup
+    os.makedirs(args.outdir, exist_ok=True)
+
+    # run main; log & timing records are upserted to the database in batches
+    with LogSink(use_db=not args.no_db) as log, \
+         Telemetry("Select STAR params", use_db=not args.no_db) as telemetry:
+        main(args, log, telemetry)
@@ -8,7 +8,9 @@ import argparse
 import logging
 from typing import List, Dict, Any, Tuple
 import pandas as pd
-from db_utils import db_connect, db_upsert, add_to_log
+from db_utils import LogSink
+from telemetry import Telemetry
+from star_select import get_best_params, read_seqkit_stats, estimate_num_cells
 
 # logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
@@ -40,35 +42,10 @@ parser.add_argument('--accession', type=str, default="",
                     help='SRA accession')
 parser.add_argument('--reads_with_barcodes_cutoff', type=float, default=0.3,
                     help='Minimum fraction of reads with valid barcodes')
+parser.add_argument('--no-db', action='store_true', default=False,
+                    help='Do not write the log & timing records to the database (write them to the JSONL spill file)')
 
 # functions
-def read_seqkit_stats(stats_file: str, sample: str, accession: str) -> pd.DataFrame:
-    """
-    Read seqkit stats table and return as pandas dataframe.
-    Args:
-        stats_file: Path to seqkit stats file
-        sample: Sample name
-        accession: SRA accession
-    Returns:
-        pandas dataframe of seqkit stats
-    """
-    # check if stats_file is None
-    if stats_file is None:
-        return None
-    # read in as pandas dataframe
-    DF = pd.read_csv(stats_file, sep='\t')
-    DF["accession"] = accession
-    DF["read"] =  "read" + DF["file"].str.extract(r'read_([12]).fastq$') + "_length"
-    DF = DF[["accession", "read", "avg_len"]]
-    # convert avg_len to int
-    DF["avg_len"] = DF["avg_len"].astype(int)
-    # rename "avg_len" to "read_length"
-    DF = DF.rename(columns={"avg_len": "read_length"})
-    # pivot wider
-    DF = DF.pivot(index='accession', columns='read', values='read_length').reset_index()
-    DF["sample"] = sample
-    return DF
-
 def load_info(
     sra_stats_csv: str, star_params_csv: str, read_stats_tsv: str, sample: str, accession: str
     ) -> pd.DataFrame:
@@ -97,72 +74,6 @@ def load_info(
     df = pd.merge(params, seqkit_stats, on=["sample", "accession"])
     return pd.merge(df, sra_stats, on=["accession"]) 
 
-
-def get_strand_label(group: pd.DataFrame) -> str:
-    """
-    Get the strand label based on the number of reads mapped to the gene.
-    Args:
-        group: pandas dataframe group
-    Returns:
-        strand label
-    """
-    target_col = "Reads Mapped to GeneFull: Unique+Multiple GeneFull"
-    # get the target column values for the strand
-    try:
-        fwd = group.loc[group["strand"]=="Forward",target_col].values[0]
-    except IndexError:
-        fwd = 0
-    try:
-        rev = group.loc[group["strand"]=="Reverse",target_col].values[0]
-    except IndexError:
-        rev = 0
-    # return the strand label
-    if fwd >= 2 * rev:
-        return "Forward"
-    elif rev >= 2 * fwd:
-        return "Reverse"
-    else:
-        return "Ambiguous"
-
-def get_best_params(
-    data: pd.DataFrame, 
-    reads_with_barcodes_cutoff: float=0.3
-    ) -> pd.DataFrame:
-    """
-    Filter the data based on various criteria to select the best parameters.
-    Args:
-        data: pandas dataframe of all parameters
-        reads_with_barcodes_cutoff: Minimum fraction of reads with valid barcodes
-    Returns:
-        pandas dataframe of best parameters
-    """
-    # group by
-    group_by = ["sample", "accession", "barcodes_name", "star_index", "cell_barcode_length", "umi_length", "organism"]
-    proper_strand = data.groupby(group_by).apply(get_strand_label, include_groups=False).reset_index(name="proper_strand")
-
-    # join proper_strand to data
-    data = pd.merge(data, proper_strand, on=group_by)
-
-    # filter to proper strand
-    data = data[data["strand"] == data["proper_strand"]].drop(columns="proper_strand")
-    if data.shape[0] == 0:
-        logging.info(f"No parameters passed the proper strand filter")
-
-    # Filter on fraction of reads with valid barcode
-    target_col = "Reads With Valid Barcodes"
-    data = data[data[target_col] >= reads_with_barcodes_cutoff]
-    if data.shape[0] == 0:
-        logging.info(f"No parameters passed the reads_with_barcodes_cutoff filter: {reads_with_barcodes_cutoff}")
-
-    # Filter to the max `Fraction of Unique Reads in Cells` => best parameters
-    target_col = "Fraction of Unique Reads in Cells"
-    data = data[data[target_col] != float("inf")]
-    data = data[data[target_col] == data[target_col].max()]
-    if data.shape[0] == 0:
-        logging.info(f"No parameters passed the `max(Fraction of Unique Reads in Cells)` filter")
-
-    return data
-
 def write_all_data(data_all: pd.DataFrame, outfile_merged: str) -> None:
     """
     Write the merged data as CSV.
@@ -172,11 +83,7 @@ def write_all_data(data_all: pd.DataFrame, outfile_merged: str) -> None:
     """
     #-- table of all parameters --#
     # Estimate the number of cells
-    data_all["saturation"] = data_all["Number of Reads"] / data_all["Sequencing Saturation"]
-    data_all["num_spots"] = data_all["saturation"].where(data_all["spot_count"] > data_all["saturation"], data_all["spot_count"])
-    data_all["num_cells"] = data_all["num_spots"] / data_all["Number of Reads"] * data_all["Estimated Number of Cells"] #* data_all["Reads Mapped to GeneFull: Unique+Multiple GeneFull"]
-    data_all["Total Estimated Number of Cells"] = data_all["num_cells"].round().astype(int)
-    data_all.drop(columns=["saturation", "num_spots", "num_cells"], inplace=True)
+    data_all = estimate_num_cells(data_all)
 
     # Write parameters as CSV
     data_all.to_csv(outfile_merged, index=False)
@@ -211,7 +118,7 @@ def write_data(data: pd.DataFrame, data_all: pd.DataFrame, outfile_selected: str
     # write merged data as CSV
     write_all_data(data_all, outfile_merged)
 
-def main(args, log_df):
+def main(args, log: LogSink, telemetry: Telemetry):
     # set pandas display optionqs
     pd.set_option('display.max_columns', 40)
     pd.set_option('display.width', 300)
@@ -222,26 +129,28 @@ def main(args, log_df):
     outfile_merged = os.path.join(args.outdir, "merged_star_params.csv")
 
     # load the data
-    data_all = load_info(
-        args.sra_stats_csv, args.star_params_csv, args.read_stats_tsv, 
-        args.sample, args.accession
-    )
+    with telemetry.span("Load info"):
+        data_all = load_info(
+            args.sra_stats_csv, args.star_params_csv, args.read_stats_tsv, 
+            args.sample, args.accession
+        )
 
     # Filter data for various criteria
-    data_filt = get_best_params(
-        data_all.copy(),  reads_with_barcodes_cutoff=args.reads_with_barcodes_cutoff
-    )
+    with telemetry.span("Get best params"):
+        data_filt = get_best_params(
+            data_all.copy(),  reads_with_barcodes_cutoff=args.reads_with_barcodes_cutoff
+        )
 
     # check if data is empty
     if data_filt.shape[0] == 0:
         msg = "Best parameters not found"
         logging.warning(msg)
-        add_to_log(log_df, args.sample, args.accession, process, "Get best params", "Failure", msg)
+        log.add(args.sample, args.accession, process, "Get best params", "Failure", msg)
         # write empty json file
         write_data(None, data_all, outfile_selected, outfile_merged)
         return None
     else:
-        add_to_log(log_df, args.sample, args.accession, process, "Get best params", "Success", "Valid barcodes found")
+        log.add(args.sample, args.accession, process, "Get best params", "Success", "Valid barcodes found")
 
     # Convert dtypes
     for x in ["cell_barcode_length", "umi_length", "read1_length", "read2_length"]:
@@ -253,21 +162,22 @@ def main(args, log_df):
     if data_filt.shape[0] == 0:
         msg = "No valid barcodes found in the STAR summary table after accounting for read lengths"
         logging.error(msg)
-        add_to_log(log_df, args.sample, args.accession, process, "Read length filter", "Failure", msg)
+        log.add(args.sample, args.accession, process, "Read length filter", "Failure", msg)
         write_data(None, data_all, outfile_selected, outfile_merged)
         return None
     else:
-        add_to_log(log_df, args.sample, args.accession, process, "Read length filter", "Success", "Read lengths > cell barcode + UMI")
+        log.add(args.sample, args.accession, process, "Read length filter", "Success", "Read lengths > cell barcode + UMI")
     data_filt.drop(columns="CHECK", inplace=True)
 
     # If multiple rows, take the first after sorting by "READS_WITH_VALID_BARCODES"
     data_filt = data_filt.sort_values("Reads With Valid Barcodes", ascending=False).iloc[0]
 
     # Write output
-    write_data(data_filt, data_all, outfile_selected, outfile_merged)
+    with telemetry.span("Write output"):
+        write_data(data_filt, data_all, outfile_selected, outfile_merged)
 
     # Add to log table
-    add_to_log(log_df, args.sample, args.accession, process, "Final", "Success", "Best parameters selected")
+    log.add(args.sample, args.accession, process, "Final", "Success", "Best parameters selected")
 
 ## script main
 if __name__ == '__main__':
@@ -276,18 +186,8 @@ if __name__ == '__main__':
 
     # setup
     os.makedirs(args.outdir, exist_ok=True)
-    log_df = pd.DataFrame(
-        columns=["sample", "accession", "process", "step", "status", "message"]
-    )
-
-    # run main
-    main(args, log_df)
 
-    # write log
-    #log_file = os.path.join(args.outdir, "select-star-params_log.csv")
-    #log_df.to_csv(log_file, index=False)
-    #logging.info(f'Log written to: {log_file}')
-    
-    # upsert log to database
-    with db_connect() as conn:
-        db_upsert(log_df, "screcounter_log", conn)
\ No newline at end of file
+    # run main; log & timing records are upserted to the database in batches
+    with LogSink(use_db=not args.no_db) as log, \
+         Telemetry("Select STAR params", args.sample, args.accession, use_db=not args.no_db) as telemetry:
+        main(args, log, telemetry)
\ No newline at end of file
@@ -6,12 +6,16 @@ import re
 import sys
 import argparse
 import logging
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
 from shutil import which
-from typing import Dict, List
-from subprocess import Popen, PIPE
+from typing import Dict, List, Optional
 import xml.etree.ElementTree as ET
 import pandas as pd
+## pipeline
+from sra_stat_cache import MAX_AGE_DAYS, get_cached_stats, cache_stats
+from backoff import Backoff
+from cmd_runner import run_cmd
+from telemetry import Telemetry
 
 # logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
@@ -23,54 +27,112 @@ class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
 
 desc = 'Run sra-tools sra-stat'
 epi = """DESCRIPTION:
-Run sra-tools sra-stat with handling of errors and formatting of the output
+Run sra-tools sra-stat with handling of errors and formatting of the output.
+Results are cached in the scRecounter database (screcounter_sra_stat table),
+and cached results younger than --max-age days are used instead of calling sra-stat.
+
+Multiple accessions can be provided (as arguments and/or via --accessions-file).
+Uncached accessions are run via a pool of --threads sra-stat subprocesses that
+share one (jittered, exponential) backoff: a failure delays all new sra-stat calls,
+so a throttled NCBI endpoint is not hit by every thread at once.
+One combined csv is written (one row per accession).
+The exit status is non-zero only if no accession succeeded.
+
+Examples:
+sra-stat.py SRR13112659 SRR13112660
+sra-stat.py --threads 8 --accessions-file accessions.txt
+cut -d, -f2 accessions.csv | sra-stat.py --accessions-file -
 """
 parser = argparse.ArgumentParser(description=desc, epilog=epi,
                                  formatter_class=CustomFormatter)
-parser.add_argument('accession', type=str, help='SRA accession')
+parser.add_argument('accession', type=str, nargs='*', help='SRA accession(s)')
+parser.add_argument('--accessions-file', type=str, default=None,
+                    help='File of accessions (one per line); "-" = stdin')
+parser.add_argument('--threads', type=int, default=4,
+                    help='Max number of concurrent sra-stat calls')
 parser.add_argument('--tries', type=int, default=5,
-                    help='Number of tries to download')
+                    help='Number of tries per accession')
 parser.add_argument('--outfile', type=str, default='sra-stat.csv',
                     help='Output file')
+parser.add_argument('--max-age', type=float, default=MAX_AGE_DAYS,
+                    help='Max age (days) of cached sra-stat results; 0 = do not use the cache')
+parser.add_argument('--timeout', type=float, default=300,
+                    help='Timeout (seconds) of each sra-stat call; a timeout counts as a failed try')
+parser.add_argument('--no-db', action='store_true', default=False,
+                    help='Do not use the database: no sra-stat cache; timing records are written to the JSONL spill file')
 
 # functions
-def run_cmd(cmd: str) -> tuple:
+def run_sra_stat(accession: str, tries: int=5, backoff: Optional[Backoff]=None, 
+                 timeout: Optional[float]=None) -> Optional[str]:
     """
-    Run sub-command and return returncode, output, and error.
+    Run sra-stat with error handling.
     Args:
-        cmd: Command to run
+        accession: SRA accession
+        tries: Number of tries
+        backoff: Backoff shared with other threads; if None, a new one is used
+        timeout: Timeout (seconds) of each try
     Returns:
-        tuple: (returncode, output, error)
+        sra-stat xml output; None if all tries failed
     """
-    logging.info(f'Running: {cmd}')
-    p = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True)
-    output, err = p.communicate()
-    return p.returncode, output, err
+    if backoff is None:
+        backoff = Backoff()
+    cmd = ['sra-stat', '--xml', '--quick', accession]
+    for i in range(tries):
+        backoff.wait()
+        logging.info(f'Attempt: {i+1}/{tries}')
+        res = run_cmd(cmd, timeout=timeout)
+        if res.returncode == 0:
+            backoff.success()
+            return res.output
+        else:
+            logging.error(f'sra-stat failed for {accession}')
+        # delay prior to next attempt
+        if i + 1 < tries:
+            logging.info(f'Backing off for {backoff.failure():.1f} seconds...')
+    return None
 
-def run_sra_stat(accession: str, tries: int=5) -> pd.DataFrame:
+def get_sra_stats(accession: str, tries: int=5, backoff: Optional[Backoff]=None, 
+                  timeout: Optional[float]=None) -> Optional[Dict]:
     """
-    Run prefetch with error handling.
+    Run sra-stat and parse the output.
     Args:
         accession: SRA accession
         tries: Number of tries
+        backoff: Backoff shared with other threads
+        timeout: Timeout (seconds) of each try
     Returns:
-        
+        Parsed statistics; None if sra-stat failed
     """
-    cmd = f'sra-stat --xml --quick {accession}'
-    for i in range(tries):
-        logging.info(f'Attempt: {i+1}/{tries}')
-        rc,output,err = run_cmd(cmd)
-        if rc == 0:
-            return output
-        else:
-            logging.error('Download failed')
-            logging.error(err)
-        # sleep prior to next attempt
-        sleep_time = 10 * (i + 1)
-        logging.info(f'Sleeping for {sleep_time} seconds...')
-        sleep(sleep_time)
-    return None
-    
+    data = run_sra_stat(accession, tries, backoff, timeout)
+    if not data:
+        return None
+    try:
+        return parse_sra_stats(data)
+    except (ET.ParseError, TypeError, ValueError) as e:
+        logging.error(f'Failed to parse sra-stat output for {accession}: {e}')
+        return None
+
+def read_accessions(accessions: List[str], accessions_file: Optional[str]=None) -> List[str]:
+    """
+    Combine accessions from the command line and a file (or stdin).
+    Args:
+        accessions: Accessions
+        accessions_file: File of accessions (one per line); "-" = stdin
+    Returns:
+        Unique accessions, in input order
+    """
+    accessions = list(accessions)
+    if accessions_file:
+        inF = sys.stdin if accessions_file == '-' else open(accessions_file)
+        try:
+            accessions += [line.strip() for line in inF]
+        finally:
+            if inF is not sys.stdin:
+                inF.close()
+    # remove blank lines, comments, and headers
+    accessions = [x for x in accessions if x and not x.startswith('#') and x != 'accession']
+    return list(dict.fromkeys(accessions))
+
 def parse_sra_stats(xml_string: str) -> Dict:
     """Parse SRA statistics XML and return key metrics.
     
@@ -78,7 +140,8 @@ def parse_sra_stats(xml_string: str) -> Dict:
         xml_string: XML string containing SRA run statistics
         
     Returns:
-        Dictionary containing parsed statistics
+        Dictionary containing parsed statistics, 
+        including the per-read layout (if present in the XML)
     """
     # Parse XML string
     root = ET.fromstring(xml_string)
@@ -106,31 +169,78 @@ def parse_sra_stats(xml_string: str) -> Dict:
             stats['file_size_gb'] = file_size
     else:
         stats['file_size_gb'] = 10  # default size (Gb), if no found
-    
-    # convert to pandas dataframe
-    return pd.DataFrame(stats, index=[0])
-
-def main(args):
-    # check for prefetch in path
-    for exe in ['sra-stat']:
-        if not which(exe):
-            logging.error(f'{exe} not found in PATH')
-            sys.exit(1)
-
-    # run sra-state
-    data = run_sra_stat(args.accession, args.tries)
-    if not data:
+
+    # Get per-read layout (index, count, average length, stdev)
+    stats['layout'] = [
+        {
+            'index': int(read.get('index', 0)),
+            'count': int(read.get('count', 0)),
+            'average': float(read.get('average', 0)),
+            'stdev': float(read.get('stdev', 0))
+        }
+        for read in root.iter('Read')
+    ]
+    return stats
+
+def main(args, telemetry: Telemetry):
+    accessions = read_accessions(args.accession, args.accessions_file)
+    if not accessions:
+        logging.error('No accessions provided')
+        sys.exit(1)
+    logging.info(f'No. of accessions: {len(accessions)}')
+    max_age = 0 if args.no_db else args.max_age
+
+    # check the cache
+    with telemetry.span("Cache lookup"):
+        stats = get_cached_stats(accessions, max_age_days=max_age)
+    logging.info(f'No. of accessions with cached sra-stat results: {len(stats)}')
+    to_run = [acc for acc in accessions if acc not in stats]
+
+    # run sra-stat on uncached accessions
+    if to_run:
+        ## check for sra-stat in path
+        for exe in ['sra-stat']:
+            if not which(exe):
+                logging.error(f'{exe} not found in PATH')
+                sys.exit(1)
+        ## run sra-stat
+        backoff = Backoff()
+        def run(acc: str) -> Optional[Dict]:
+            with telemetry.span("sra-stat", accession=acc) as span:
+                res = get_sra_stats(acc, args.tries, backoff, args.timeout)
+                span.status = "Success" if res is not None else "Failure"
+            return res
+        with ThreadPoolExecutor(max_workers=max(1, args.threads)) as pool:
+            results = pool.map(run, to_run)
+            new_stats = {acc: res for acc,res in zip(to_run, results) if res is not None}
+        with telemetry.span("Cache update"):
+            cache_stats(list(new_stats.values()), max_age_days=max_age)
+        stats.update(new_stats)
+        ## status
+        failed = [acc for acc in to_run if acc not in new_stats]
+        if failed:
+            logging.error(f'sra-stat failed for {len(failed)} accession(s): {", ".join(failed)}')
+    if not stats:
         logging.error('sra-stat failed')
         sys.exit(1)
 
-    # parse sra-stat output
-    stats = parse_sra_stats(data)
-    
     # write to file
-    stats.to_csv(args.outfile, index=False)
-    logging.info(f'Output written to: {args.outfile}')
+    with telemetry.span("Write output"):
+        write_stats([stats[acc] for acc in accessions if acc in stats], args.outfile)
+
+def write_stats(stats: List[Dict], outfile: str) -> None:
+    """
+    Write sra-stat results to a csv file.
+    Args:
+        stats: Parsed sra-stat results (one per accession)
+        outfile: Output file path
+    """
+    columns = ['accession', 'spot_count', 'base_count', 'file_size_gb']
+    pd.DataFrame([{k: x.get(k) for k in columns} for x in stats], columns=columns).to_csv(outfile, index=False)
+    logging.info(f'Output written to: {outfile}')
 
 ## script main
 if __name__ == '__main__':
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    with Telemetry("sra-stat", use_db=not args.no_db) as telemetry:
+        main(args, telemetry)
\ No newline at end of file
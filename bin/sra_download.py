@@ -0,0 +1,312 @@
+# import
+## batteries
+import os
+import json
+import hashlib
+import logging
+import threading
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+## pipeline
+from backoff import Backoff
+
+# constants
+## SRA data locator (SDL) API; used to get the download URL, size & md5 of a run
+SDL_URL = os.getenv("SCRECOUNTER_SDL_URL", "https://locate.ncbi.nlm.nih.gov/sdl/2/retrieve")
+## use the resumable downloader instead of `prefetch`
+RESUMABLE = os.getenv("SCRECOUNTER_RESUMABLE_DOWNLOAD", "false").lower() in ("1", "true", "yes")
+## max total time (seconds) spent on retries of one download
+MAX_RETRY_TIME = float(os.getenv("SCRECOUNTER_DOWNLOAD_RETRY_TIME", 3600))
+## size (bytes) of the byte ranges that are downloaded, checksummed & resumed
+RANGE_SIZE = 1 << 26
+## size (bytes) of the reads from a response
+READ_SIZE = 1 << 20
+## HTTP timeout (seconds)
+TIMEOUT = 60
+
+# classes
+class DownloadError(Exception):
+    pass
+
+class Manifest:
+    """
+    Record of the completed byte ranges (and their md5 checksums) of a partial download.
+    Saved as json next to the partial file, so an interrupted download can be resumed.
+    A manifest is only reused for the same URL, size & md5.
+    """
+    def __init__(self, path: str, url: str, size: int, md5: Optional[str], range_size: int):
+        self.path = path
+        self.url = url
+        self.size = size
+        self.md5 = md5
+        self.range_size = range_size
+        self.ranges: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, url: str, size: int, md5: Optional[str], range_size: int) -> "Manifest":
+        """
+        Load the manifest of a partial download, or create a new (empty) one.
+        Args:
+            path: Manifest file
+            url: Download URL
+            size: File size (bytes)
+            md5: Expected md5 of the file (if known)
+            range_size: Size (bytes) of the byte ranges
+        Returns:
+            Manifest
+        """
+        manifest = cls(path, url, size, md5, range_size)
+        try:
+            with open(path) as inF:
+                data = json.load(inF)
+        except (OSError, ValueError):
+            return manifest
+        if [data.get(k) for k in ("url", "size", "md5", "range_size")] == [url, size, md5, range_size]:
+            manifest.ranges = {int(k): v for k,v in data["ranges"].items()}
+        return manifest
+
+    @property
+    def num_ranges(self) -> int:
+        return max(1, -(-self.size // self.range_size))
+
+    def bounds(self, i: int) -> Tuple[int, int]:
+        """
+        Get the byte range of the i-th range.
+        Args:
+            i: Range index
+        Returns:
+            (first byte, last byte + 1)
+        """
+        return i * self.range_size, min((i + 1) * self.range_size, self.size)
+
+    def missing(self) -> Set[int]:
+        with self._lock:
+            return set(range(self.num_ranges)) - set(self.ranges)
+
+    def complete(self, i: int, md5: str) -> None:
+        """
+        Record a completed range, and save the manifest.
+        """
+        with self._lock:
+            self.ranges[i] = md5
+            self._save()
+
+    def discard(self, i: Optional[int]=None) -> None:
+        """
+        Discard a completed range (or all ranges), and save the manifest.
+        """
+        with self._lock:
+            if i is None:
+                self.ranges = {}
+            else:
+                self.ranges.pop(i, None)
+            self._save()
+
+    def _save(self) -> None:
+        data = {
+            "url": self.url, "size": self.size, "md5": self.md5,
+            "range_size": self.range_size, "ranges": self.ranges
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as outF:
+            json.dump(data, outF)
+        os.replace(tmp_path, self.path)
+
+class RangeDownloader:
+    """
+    Resumable, parallel download of a file via HTTP range requests.
+    - The file is downloaded in ranges (`RANGE_SIZE`) by `jobs` threads, into `<dest>.part`.
+    - Completed ranges & their md5 checksums are recorded in `<dest>.manifest.json`,
+      so an interrupted download resumes with the missing ranges only.
+    - A truncated response is resumed from its last received byte.
+    - Validation is incremental & overlapped with the download: the completed ranges are
+      re-read in order, checked against the manifest (ranges that fail are downloaded again),
+      and added to the md5 of the whole file, which is compared to the expected md5 at the end.
+    - Failed requests are retried with a (shared, jittered, exponential) backoff, until
+      `max_retry_time` seconds have been spent on retries in total.
+    """
+    def __init__(self, url: str, dest: str, size: int, md5: Optional[str]=None, jobs: int=4,
+                 range_size: int=RANGE_SIZE, max_retry_time: float=MAX_RETRY_TIME):
+        self.url = url
+        self.dest = dest
+        self.part = dest + ".part"
+        self.manifest = Manifest.load(dest + ".manifest.json", url, size, md5, range_size)
+        self.jobs = jobs
+        self.max_retry_time = max_retry_time
+        self.backoff = Backoff(base=1, cap=60)
+        self._retry_time = 0.0
+        self._retry_lock = threading.Lock()
+        self._done = threading.Condition()
+        self._error: Optional[Exception] = None
+
+    def run(self) -> str:
+        """
+        Download (or resume the download of) the file.
+        Returns:
+            Path of the downloaded file
+        Raises:
+            DownloadError: The download failed, or the md5 does not match
+        """
+        size = self.manifest.size
+        missing = self.manifest.missing()
+        if not os.path.exists(self.part):
+            self.manifest.discard()
+            missing = self.manifest.missing()
+        done = self.manifest.num_ranges - len(missing)
+        logging.info(f"Downloading {self.url} ({size / 1e9:.3f} GB); resuming with {done} of {self.manifest.num_ranges} ranges complete")
+        with open(self.part, "ab"):
+            pass
+        os.truncate(self.part, size)
+
+        fd = os.open(self.part, os.O_RDWR)
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                for i in sorted(missing):
+                    pool.submit(self._fetch_range, fd, i)
+                file_md5 = self._validate(fd, pool)
+        finally:
+            os.close(fd)
+        if self._error is not None:
+            raise self._error
+
+        # compare to the expected md5
+        if self.manifest.md5 and file_md5 != self.manifest.md5:
+            self.manifest.discard()
+            raise DownloadError(f"md5 mismatch: {file_md5} != {self.manifest.md5}")
+        os.replace(self.part, self.dest)
+        os.remove(self.manifest.path)
+        logging.info(f"Downloaded {self.dest} (md5: {file_md5})")
+        return self.dest
+
+    def _validate(self, fd: int, pool: ThreadPoolExecutor) -> str:
+        """
+        Validate the completed ranges, in order, while the download proceeds.
+        Ranges that do not match their recorded md5 are downloaded again.
+        Returns:
+            md5 of the whole file
+        """
+        file_md5 = hashlib.md5()
+        for i in range(self.manifest.num_ranges):
+            start,end = self.manifest.bounds(i)
+            while True:
+                with self._done:
+                    self._done.wait_for(lambda: self._error is not None or i in self.manifest.ranges)
+                    if self._error is not None:
+                        return ""
+                data = os.pread(fd, end - start, start)
+                if len(data) == end - start and hashlib.md5(data).hexdigest() == self.manifest.ranges[i]:
+                    break
+                logging.warning(f"Range {i} failed validation; downloading again")
+                self.manifest.discard(i)
+                pool.submit(self._fetch_range, fd, i)
+            file_md5.update(data)
+        return file_md5.hexdigest()
+
+    def _fetch_range(self, fd: int, i: int) -> None:
+        """
+        Download one range, resuming truncated responses, and record it in the manifest.
+        """
+        start,end = self.manifest.bounds(i)
+        range_md5 = hashlib.md5()
+        pos = start
+        while pos < end and self._error is None:
+            self.backoff.wait()
+            attempt_start = monotonic()
+            try:
+                req = Request(self.url, headers={"Range": f"bytes={pos}-{end-1}"})
+                with urlopen(req, timeout=TIMEOUT) as resp:
+                    if resp.status != 206 and pos > 0:
+                        raise DownloadError(f"Range requests not supported (HTTP {resp.status})")
+                    while pos < end:
+                        data = resp.read(min(READ_SIZE, end - pos))
+                        if not data:
+                            break
+                        os.pwrite(fd, data, pos)
+                        range_md5.update(data)
+                        pos += len(data)
+                if pos < end:
+                    raise DownloadError(f"Truncated response at byte {pos} of range {i} ({start}-{end-1})")
+                self.backoff.success()
+            except Exception as e:
+                self._retry(e, monotonic() - attempt_start)
+        if pos >= end:
+            self.manifest.complete(i, range_md5.hexdigest())
+        with self._done:
+            self._done.notify_all()
+
+    def _retry(self, error: Exception, elapsed: float) -> None:
+        """
+        Record a failed request; give up once the total retry time
+        (failed requests + backoff delays) is exceeded.
+        """
+        delay = self.backoff.failure()
+        with self._retry_lock:
+            self._retry_time += elapsed + delay
+            exceeded = self._retry_time > self.max_retry_time
+        if exceeded:
+            with self._done:
+                if self._error is None:
+                    self._error = DownloadError(f"Total retry time exceeded ({self.max_retry_time} sec); last error: {error}")
+                self._done.notify_all()
+        else:
+            logging.warning(f"Download error: {error}; retrying in {delay:.1f} sec")
+
+# functions
+def locate(accession: str, gcp_download: bool=False) -> Tuple[str, int, Optional[str], str]:
+    """
+    Get the download URL, size & md5 of an SRA run via the SRA data locator (SDL).
+    Args:
+        accession: SRA run accession
+        gcp_download: Use the GCP mirror (location gs.us-east1); else NCBI/AWS
+    Returns:
+        (URL, size in bytes, md5 or None, file name)
+    Raises:
+        DownloadError: The accession could not be located
+    """
+    params = {"acc": accession, "filetype": "run", "accept-alternate-locations": "yes"}
+    if gcp_download:
+        params["location"] = "gs.us-east1"
+    try:
+        with urlopen(SDL_URL, data=urlencode(params).encode(), timeout=TIMEOUT) as resp:
+            data = json.load(resp)
+        for result in data.get("result", []):
+            for f in result.get("files", []):
+                locations = [x for x in f.get("locations", []) if x.get("link", "").startswith("http")]
+                if locations and f.get("size"):
+                    name = f.get("name") or accession
+                    return locations[0]["link"], int(f["size"]), f.get("md5"), name
+    except Exception as e:
+        raise DownloadError(f"Failed to locate {accession}: {e}")
+    raise DownloadError(f"No download location found for {accession}")
+
+def download_sra(accession: str, outdir: str, gcp_download: bool=False, max_size_gb: float=1000,
+                 jobs: int=4, max_retry_time: float=MAX_RETRY_TIME) -> Tuple[str, Optional[str]]:
+    """
+    Download an SRA run (resumable), with the same output layout as `prefetch`: <outdir>/<accession>/<file>.
+    Args:
+        accession: SRA run accession
+        outdir: Output directory
+        gcp_download: Use the GCP mirror
+        max_size_gb: Max file size in GB
+        jobs: Number of concurrent range requests
+        max_retry_time: Max total time (seconds) spent on retries
+    Returns:
+        (path of the downloaded file, validated md5 or None if the md5 is not available)
+    Raises:
+        DownloadError: The download failed
+    """
+    url,size,md5,name = locate(accession, gcp_download)
+    if size > max_size_gb * 1e9:
+        raise DownloadError(f"File size too large: {size / 1e9:.1f} GB > {max_size_gb} GB")
+    if not os.path.splitext(name)[1]:
+        name += ".sra"
+    os.makedirs(os.path.join(outdir, accession), exist_ok=True)
+    dest = os.path.join(outdir, accession, name)
+    start = monotonic()
+    RangeDownloader(url, dest, size, md5, jobs=jobs, max_retry_time=max_retry_time).run()
+    logging.info(f"Download time: {monotonic() - start:.1f} sec ({size / 1e6 / max(monotonic() - start, 1e-3):.1f} MB/s)")
+    return dest,md5
@@ -0,0 +1,111 @@
+# import
+## batteries
+import os
+import json
+import logging
+from datetime import datetime, timezone
+from typing import List, Dict, Iterable
+## pipeline
+from db_utils import get_conn, db_upsert_rows
+
+# constants
+TABLE_NAME = "screcounter_sra_stat"
+## cached stats older than this (days) are re-fetched; 0 = cache disabled
+MAX_AGE_DAYS = float(os.getenv("SCRECOUNTER_SRA_STAT_MAX_AGE", 30))
+COLUMNS = ["accession", "spot_count", "base_count", "file_size_gb", "layout", "updated_at"]
+CREATE_STMT = f"""
+CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+    accession VARCHAR(32) PRIMARY KEY,
+    spot_count BIGINT,
+    base_count BIGINT,
+    file_size_gb DOUBLE PRECISION,
+    layout JSONB,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+_TABLE_CREATED = False
+
+# functions
+def cache_enabled(max_age_days: float=MAX_AGE_DAYS) -> bool:
+    """
+    Determine if the sra-stat cache can be used.
+    The cache is stored in the scRecounter database, so GCP_SQL_DB_HOST must be set.
+    Args:
+        max_age_days: Max age of cached records (days); 0 = disabled
+    Returns:
+        True if the cache is enabled
+    """
+    return max_age_days > 0 and bool(os.getenv("GCP_SQL_DB_HOST"))
+
+def create_table(conn) -> None:
+    """
+    Create the sra-stat cache table, if it does not exist (once per process).
+    Args:
+        conn: Database connection
+    """
+    global _TABLE_CREATED
+    if _TABLE_CREATED:
+        return
+    with conn.cursor() as cur:
+        cur.execute(CREATE_STMT)
+    conn.commit()
+    _TABLE_CREATED = True
+
+def get_cached_stats(
+    accessions: Iterable[str],
+    max_age_days: float=MAX_AGE_DAYS,
+    require: Iterable[str]=("spot_count", "base_count", "file_size_gb")
+    ) -> Dict[str, dict]:
+    """
+    Get cached sra-stat results for accessions.
+    Any database error is logged, and treated as a cache miss.
+    Args:
+        accessions: SRA run accessions
+        max_age_days: Max age of cached records (days)
+        require: Columns that must be non-null for a record to be a cache hit
+    Returns:
+        {accession: {column: value}} for all fresh cache hits
+    """
+    accessions = list(set(accessions))
+    if not accessions or not cache_enabled(max_age_days):
+        return {}
+    where = " AND ".join([f"{col} IS NOT NULL" for col in require] + [
+        "accession = ANY(%s)", "updated_at >= now() - make_interval(secs => %s)"
+    ])
+    stmt = f"SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME} WHERE {where}"
+    try:
+        with get_conn() as conn:
+            create_table(conn)
+            with conn.cursor() as cur:
+                cur.execute(stmt, (accessions, max_age_days * 86400))
+                rows = cur.fetchall()
+    except Exception as e:
+        logging.warning(f"sra-stat cache lookup failed: {e}")
+        return {}
+    return {row[0]: dict(zip(COLUMNS, row)) for row in rows}
+
+def cache_stats(records: List[dict], max_age_days: float=MAX_AGE_DAYS) -> None:
+    """
+    Write sra-stat results to the cache.
+    Any database error is logged, and otherwise ignored.
+    Args:
+        records: sra-stat results; each with an "accession" key and any other `COLUMNS`
+        max_age_days: Max age of cached records (days); used to check if the cache is enabled
+    """
+    if not records or not cache_enabled(max_age_days):
+        return
+    now = datetime.now(timezone.utc)
+    columns = [col for col in COLUMNS if col == "updated_at" or col in records[0]]
+    rows = []
+    for rec in records:
+        rec = dict(rec, updated_at=now)
+        if rec.get("layout") is not None:
+            rec["layout"] = json.dumps(rec["layout"])
+        rows.append(tuple(rec.get(col) for col in columns))
+    try:
+        with get_conn() as conn:
+            create_table(conn)
+            db_upsert_rows(rows, columns, TABLE_NAME, conn)
+        logging.info(f"Cached sra-stat results for {len(rows)} accession(s)")
+    except Exception as e:
+        logging.warning(f"sra-stat cache update failed: {e}")
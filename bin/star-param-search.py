@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# import
+## batteries
+from __future__ import print_function
+import os
+import sys
+import json
+import shutil
+import argparse
+import logging
+from typing import List, Optional, Tuple
+import pandas as pd
+## pipeline
+from cmd_runner import run_cmd
+from db_utils import get_conn
+from fastq_utils import head_reads, iter_read_sets
+from star_select import (
+    ETA, MIN_KEEP, format_star_params, successive_halving, get_best_params, score_param_groups,
+    load_prior_params, select_prior_param_sets
+)
+from telemetry import Telemetry
+
+# logging
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
+
+# argparse
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
+                      argparse.RawDescriptionHelpFormatter):
+    pass
+
+desc = 'STAR parameter search via successive halving.'
+epi = """DESCRIPTION:
+Instead of running STAR on all reads for every parameter set (strand x barcodes x STAR index),
+the parameter sets are tested in rounds on progressively larger subsamples (the first N reads)
+of the reads. After each round, the parameter groups (all parameters except the strand) are
+scored (fraction of reads with valid barcodes x fraction mapped to GeneFull, of the proper strand),
+and only the top 1/eta groups (at least --min-keep; both strands) are run in the next round.
+The last round always uses all reads; rounds with >= the number of reads are skipped.
+With --rounds "", all parameter sets are run on all reads.
+
+Prior-informed mode (--prior): the final STAR parameters of the sibling samples (same study)
+are looked up in the scRecounter database (or read from --priors), and only the matching
+parameter sets (both strands) are run first, on the first --prior-reads reads. If the
+prior parameters pass the selection filters (see select-star-params.py; fraction of reads with
+valid barcodes >= --reads-with-barcodes-cutoff), their results are the output; otherwise, the
+search continues with all parameter sets.
+
+The parameter sets (JSON) are a list of objects with: sample, accession, strand, barcodes_name,
+barcodes_file, cell_barcode_length, umi_length, organism & star_index. If --barcodes-files and
+--star-indices are provided (e.g., staged files), "barcodes_idx" & "star_index_idx" (0-based) select
+the files used to run STAR; the barcodes_file & star_index values are written to the output unchanged.
+
+Output: the STAR param search table of the last round (same format as format-star-params.py),
+and the scores of all rounds (--rounds-outfile).
+
+Example:
+star-param-search.py --param-sets param_sets.json --rounds 10000,100000 read_1.fastq read_2.fastq
+"""
+parser = argparse.ArgumentParser(description=desc, epilog=epi,
+                                 formatter_class=CustomFormatter)
+parser.add_argument('fastq_1', type=str,
+                    help='Read 1 fastq file')
+parser.add_argument('fastq_2', type=str,
+                    help='Read 2 fastq file')
+parser.add_argument('--param-sets', type=str, required=True,
+                    help='Parameter sets (JSON)')
+parser.add_argument('--barcodes-files', type=str, nargs='+', default=None,
+                    help='Barcodes files, selected via "barcodes_idx" of each parameter set')
+parser.add_argument('--star-indices', type=str, nargs='+', default=None,
+                    help='STAR indices, selected via "star_index_idx" of each parameter set')
+parser.add_argument('--rounds', type=str, default='10000,100000',
+                    help='Comma-separated number of reads per round; a final round on all reads is always added')
+parser.add_argument('--eta', type=int, default=ETA,
+                    help='Reduction factor of the parameter groups per round')
+parser.add_argument('--min-keep', type=int, default=MIN_KEEP,
+                    help='Min number of parameter groups kept per round')
+parser.add_argument('--prior', action='store_true', default=False,
+                    help='Test the parameters of sibling samples (same study) first')
+parser.add_argument('--priors', type=str, default=None,
+                    help='Prior parameters (csv; columns: barcodes, star_index, cell_barcode_length, umi_length); default: from the database (--prior)')
+parser.add_argument('--prior-reads', type=int, default=100000,
+                    help='Number of reads used to test the prior parameters')
+parser.add_argument('--reads-with-barcodes-cutoff', type=float, default=0.3,
+                    help='Minimum fraction of reads with valid barcodes for the prior parameters to pass')
+parser.add_argument('--threads', type=int, default=4,
+                    help='Number of STAR threads')
+parser.add_argument('--sample', type=str, default="",
+                    help='Sample name')
+parser.add_argument('--accession', type=str, default="",
+                    help='SRA accession')
+parser.add_argument('--work-dir', type=str, default="param_search",
+                    help='Working directory of the STAR runs')
+parser.add_argument('--outfile', type=str, default="star_params.csv",
+                    help='Output STAR param search table of the last round')
+parser.add_argument('--rounds-outfile', type=str, default="param_search_rounds.csv",
+                    help='Output table of the scores of all rounds')
+parser.add_argument('--no-db', action='store_true', default=False,
+                    help='Do not write the timing records to the database (write them to the JSONL spill file)')
+
+# functions
+def parse_rounds(rounds: str, num_reads: int) -> List[Optional[int]]:
+    """
+    Parse the number of reads per round; rounds with >= `num_reads` are dropped,
+    and a final round on all reads (None) is added.
+    Args:
+        rounds: Comma-separated number of reads per round
+        num_reads: Total number of reads
+    Returns:
+        Number of reads per round (None = all reads)
+    """
+    sizes = sorted(set(int(x) for x in rounds.split(",") if x.strip()))
+    return [x for x in sizes if 0 < x < num_reads] + [None]
+
+def star_cmd(fastq_1: str, fastq_2: str, star_index: str, barcodes_file: str, params: dict,
+             threads: int, prefix: str) -> List[str]:
+    """
+    Create the STAR command of a parameter set.
+    Args:
+        fastq_1: Read 1 fastq file
+        fastq_2: Read 2 fastq file
+        star_index: STAR index directory
+        barcodes_file: Barcodes whitelist file
+        params: Parameter set
+        threads: Number of threads
+        prefix: Output file name prefix
+    Returns:
+        STAR command
+    """
+    return [
+        "STAR",
+        "--readFilesIn", fastq_2, fastq_1,
+        "--runThreadN", str(threads),
+        "--genomeDir", star_index,
+        "--soloCBwhitelist", barcodes_file,
+        "--soloCBlen", str(params["cell_barcode_length"]),
+        "--soloUMIlen", str(params["umi_length"]),
+        "--soloStrand", params["strand"],
+        "--soloType", "CB_UMI_Simple",
+        "--clipAdapterType", "CellRanger4",
+        "--outFilterScoreMin", "30",
+        "--soloCBmatchWLtype", "1MM_multi_Nbase_pseudocounts",
+        "--soloCellFilter", "EmptyDrops_CR",
+        "--soloUMIfiltering", "MultiGeneUMI_CR",
+        "--soloUMIdedup", "1MM_CR",
+        "--soloFeatures", "GeneFull",
+        "--soloMultiMappers", "EM",
+        "--outSAMtype", "None",
+        "--soloBarcodeReadLength", "0",
+        "--outFileNamePrefix", prefix
+    ]
+
+def write_subsample(fastq_files: List[str], num_reads: int, outdir: str) -> List[str]:
+    """
+    Write the first `num_reads` reads of synchronized fastq files.
+    Args:
+        fastq_files: Fastq files (R1 & R2)
+        num_reads: Number of reads
+        outdir: Output directory
+    Returns:
+        Output fastq files
+    """
+    reads = head_reads(fastq_files, num_reads)
+    out_files = [os.path.join(outdir, f"read_{i + 1}.fastq") for i in range(len(fastq_files))]
+    for out_file,records in zip(out_files, zip(*reads)):
+        with open(out_file, "wb") as outF:
+            outF.writelines(records)
+    return out_files
+
+def run_round(i: int, num_reads: Optional[int], param_sets: List[dict], args, telemetry: Telemetry) -> pd.DataFrame:
+    """
+    Run STAR for each parameter set on a subsample of the reads.
+    Args:
+        i: Round index; -1 = the prior parameters
+        num_reads: Number of reads; None = all reads
+        param_sets: Parameter sets
+        args: Command-line arguments
+        telemetry: Timing records
+    Returns:
+        STAR param search table of the round; failed STAR runs are omitted
+    """
+    round_name = f"round{i + 1}" if i >= 0 else "prior"
+    round_dir = os.path.join(args.work_dir, round_name)
+    os.makedirs(round_dir, exist_ok=True)
+    with telemetry.span(round_name) as span:
+        # subsample
+        fastq_files = [args.fastq_1, args.fastq_2]
+        if num_reads is not None:
+            fastq_files = write_subsample(fastq_files, num_reads, round_dir)
+        span.input_gb = sum(os.path.getsize(f) for f in fastq_files) / 1e9
+        # run STAR
+        rows = []
+        for j,params in enumerate(param_sets):
+            barcodes_file = params["barcodes_file"]
+            if args.barcodes_files and "barcodes_idx" in params:
+                barcodes_file = args.barcodes_files[int(params["barcodes_idx"])]
+            star_index = params["star_index"]
+            if args.star_indices and "star_index_idx" in params:
+                star_index = args.star_indices[int(params["star_index_idx"])]
+            prefix = os.path.join(round_dir, f"params{j + 1}_")
+            cmd = star_cmd(*fastq_files, star_index, barcodes_file, params, args.threads, prefix)
+            res = run_cmd(cmd, log_stderr=False)
+            summary_csv = prefix + "Solo.out/GeneFull/Summary.csv"
+            if res.returncode != 0 or not os.path.exists(summary_csv):
+                logging.warning(
+                    f"STAR failed (exit={res.returncode}) for {params['barcodes_name']}, "
+                    f"{params['star_index']}, {params['strand']}: {res.err.decode(errors='replace')[-500:]}"
+                )
+                continue
+            rows.append(format_star_params(summary_csv, params))
+        # clean up
+        if num_reads is not None:
+            for f in fastq_files:
+                os.remove(f)
+    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
+
+def test_prior(param_sets: List[dict], num_reads: int, args, telemetry: Telemetry) -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]:
+    """
+    Run the parameter sets matching the prior parameters (of the sibling samples) on a subsample of the reads.
+    Args:
+        param_sets: Parameter sets
+        num_reads: Total number of reads
+        args: Command-line arguments
+        telemetry: Timing records
+    Returns:
+        (STAR param search table, table of the prior round), if the prior parameters pass
+        the selection filters (see `get_best_params`); otherwise (None, None)
+    """
+    # prior parameters
+    if args.priors:
+        priors = pd.read_csv(args.priors)
+    else:
+        try:
+            with get_conn() as conn:
+                priors = load_prior_params(args.sample, conn)
+        except Exception as e:
+            logging.warning(f"Prior parameter lookup failed: {e}")
+            return None, None
+    prior_sets = select_prior_param_sets(param_sets, priors)
+    if not prior_sets:
+        logging.info("No prior parameters; testing all parameter sets")
+        return None, None
+
+    # run & check
+    prior_reads = args.prior_reads if 0 < args.prior_reads < num_reads else None
+    logging.info(f"Testing {len(prior_sets)} prior parameter sets on {prior_reads or 'all'} reads")
+    data = run_round(-1, prior_reads, prior_sets, args, telemetry)
+    best = get_best_params(data.copy(), args.reads_with_barcodes_cutoff) if data.shape[0] > 0 else data
+    if best.shape[0] == 0:
+        logging.info("The prior parameters did not pass the selection filters; testing all parameter sets")
+        return None, None
+    logging.info("The prior parameters passed the selection filters")
+    history = score_param_groups(data)
+    history["kept"] = True
+    history["round"] = "prior"
+    history["num_reads"] = prior_reads if prior_reads is not None else -1
+    return data, history
+
+def main(args, telemetry: Telemetry):
+    # set pandas display options
+    pd.set_option('display.max_columns', 30)
+    pd.set_option('display.width', 300)
+
+    # load the parameter sets
+    with open(args.param_sets) as inF:
+        param_sets = json.load(inF)
+    logging.info(f"No. of parameter sets: {len(param_sets)}")
+    if not param_sets:
+        logging.error("No parameter sets provided")
+        sys.exit(1)
+
+    # rounds
+    with telemetry.span("count reads"):
+        num_reads = sum(1 for _ in iter_read_sets([args.fastq_1, args.fastq_2]))
+    rounds = parse_rounds(args.rounds, num_reads)
+    logging.info(f"No. of reads: {num_reads}; reads per round: {[x or num_reads for x in rounds]}")
+
+    # prior parameters
+    data,history = None,None
+    if args.prior or args.priors:
+        data,history = test_prior(param_sets, num_reads, args, telemetry)
+
+    # successive halving
+    if data is None:
+        data,history = successive_halving(
+            param_sets, rounds,
+            lambda i, n, p: run_round(i, n, p, args, telemetry),
+            eta=args.eta, min_keep=args.min_keep
+        )
+    if data.shape[0] == 0:
+        logging.error("No successful STAR runs")
+        sys.exit(1)
+
+    # write output
+    history["num_reads"] = history["num_reads"].where(history["num_reads"] >= 0, num_reads)
+    for outfile,df in ((args.outfile, data), (args.rounds_outfile, history)):
+        outdir = os.path.dirname(outfile)
+        if outdir:
+            os.makedirs(outdir, exist_ok=True)
+        df.to_csv(outfile, index=False)
+        logging.info(f"Output written to: {outfile}")
+    shutil.rmtree(args.work_dir, ignore_errors=True)
+
+## script main
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with Telemetry("STAR param search", args.sample, args.accession, use_db=not args.no_db) as telemetry:
+        main(args, telemetry)
@@ -8,8 +8,10 @@ import sys
 import argparse
 import logging
 from typing import List, Dict, Any, Tuple
-import pandas as pd
-from db_utils import db_connect, db_upsert
+from db_utils import get_conn, LogSink
+from telemetry import Telemetry
+from table_utils import write_csv
+from star_summary import read_summary, feature_name, summary_table, upsert_summary_table
 
 # logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
@@ -35,83 +37,54 @@ parser.add_argument('--sample', type=str, default="",
                     help='Sample name')
 parser.add_argument('--outfile', type=str, default="Summary.csv",
                     help='Output file')
+parser.add_argument('--no-db', action='store_true', default=False,
+                    help='Do not write to the database (log & timing records are written to the JSONL spill file)')
          
 # functions
-def main(args):
-    # set pandas display optionqs
-    pd.set_option('display.max_columns', 50)
-    pd.set_option('display.max_rows', 100)
-    pd.set_option('display.width', 300)
-
-    # read in all summary csv files and concatenate
-    df = []
-    regex = re.compile(r"_summary.csv$")
-    for infile in args.summary_csv:
-        x = pd.read_csv(infile, header=None)
-        x.columns = ["category", "value"]
-        x["feature"] = regex.sub("", os.path.basename(infile))
-        df.append(x)
-    df = pd.concat(df)
+def main(args, log: LogSink, telemetry: Telemetry):
+    # read in all summary csv files; one set of metrics per feature
+    summaries = {}
+    with telemetry.span("Read summaries"):
+        for infile in args.summary_csv:
+            summaries.setdefault(feature_name(infile), {}).update(read_summary(infile))
 
     # status
-    logging.info(f"Number of rows in the raw table: {df.shape[0]}")
-
-    # format category
-    for x in ["Gene", "GeneFull", "GeneFull_Ex50pAS", "GeneFull_ExonOverIntron", "Velocyto"]:
-        regex = re.compile(f" {x} ")
-        df["category"] = df["category"].apply(lambda x: regex.sub(" feature ", x))
-
-    # pivot table
-    df = df.pivot(index='feature', columns='category', values='value').reset_index()
-    
-    # format columns: no spaces and lowercase
-    df.columns = df.columns.str.replace(r'\W', '_', regex=True).str.lower() 
+    logging.info(f"Number of rows in the raw table: {sum(len(x) for x in summaries.values())}")
 
-    # coerce columns to numeric
-    for col in df.columns.to_list():
-        if col != "feature":
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    # float columns to integer
-    cols_to_convert = ["estimated_number_of_cells", "number_of_reads", "umis_in_cells"]
-    for col in cols_to_convert:
-        if col in df.columns:
-            df[col] = df[col].fillna(0).replace([float('inf'), -float('inf')], 0).astype(int)
+    # wide table: one row per feature, one (numeric) column per metric
+    columns, rows = summary_table(summaries)
 
     # add sample name
-    df["sample"] = args.sample
+    for row in rows:
+        row["sample"] = args.sample
+    columns.append("sample")
 
     # status
-    logging.info(f"Number of rows after formattings: {df.shape[0]}")
+    logging.info(f"Number of rows after formattings: {len(rows)}")
 
     # upsert results to database
-    logging.info("Updating screcounter_star_results...")
-    with db_connect() as conn:
-        db_upsert(df, "screcounter_star_results", conn)
+    if not args.no_db:
+        logging.info("Updating screcounter_star_results...")
+        with telemetry.span("Upsert results"):
+            with get_conn() as conn:
+                upsert_summary_table(rows, conn)
 
     # write output table
     outdir = os.path.dirname(args.outfile)
     if outdir != "":
         os.makedirs(outdir, exist_ok=True)
-    df.to_csv(args.outfile, index=False)
+    with telemetry.span("Write output"):
+        write_csv(args.outfile, rows, columns)
 
-    # update screcounter log
+    # update screcounter log (upserted on exit, via a pooled connection)
     logging.info("Updating screcounter_log...")
-    log_df = pd.DataFrame({
-        "sample": [args.sample],
-        "accession": [""],
-        "process": ["STAR-full"],
-        "step": ["Final"],
-        "status": ["Success"],
-        "message": ["STAR summary table generated"]
-    })
-    with db_connect() as conn:
-        db_upsert(log_df, "screcounter_log", conn)
+    log.add(args.sample, "", "STAR-full", "Final", "Success", "STAR summary table generated")
 
 
 ## script main
 if __name__ == '__main__':
     args = parser.parse_args()
-    main(args)
-
-    
\ No newline at end of file
+    # log & timing records are upserted to the database on exit (or written to the JSONL spill file)
+    with LogSink(use_db=not args.no_db) as log, \
+         Telemetry("STAR-full", args.sample, use_db=not args.no_db) as telemetry:
+        main(args, log, telemetry)
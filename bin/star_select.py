@@ -0,0 +1,391 @@
+# import
+## batteries
+import os
+import math
+import logging
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+## 3rd party
+import numpy as np
+import pandas as pd
+## pipeline
+from table_utils import to_number
+from star_summary import read_summary
+
+# constants
+## parameter columns of the STAR param search tables (see format-star-params.py)
+PARAM_COLUMNS = [
+    "sample", "accession", "strand", "barcodes_name", "barcodes_file",
+    "cell_barcode_length", "umi_length", "organism", "star_index"
+]
+## a parameter group: all parameters, except the strand (both strands are needed to label the proper strand)
+GROUP_COLUMNS = ["sample", "accession", "barcodes_name", "star_index", "cell_barcode_length", "umi_length", "organism"]
+## STAR summary columns used for selection
+VALID_BARCODES_COL = "Reads With Valid Barcodes"
+GENE_FULL_COL = "Reads Mapped to GeneFull: Unique+Multiple GeneFull"
+CELL_READS_COL = "Fraction of Unique Reads in Cells"
+## successive halving defaults
+ETA = 3
+MIN_KEEP = 2
+## columns of srx_metadata/srx_srr that identify the study of a sample (the first present is used)
+STUDY_COLUMNS = ["sra_study", "srp_accession", "study_accession", "bioproject"]
+## max number of prior parameter sets (the most frequent among the sibling samples)
+MAX_PRIORS = 2
+
+# functions
+def read_star_summary(star_summary_csv: str) -> Dict[str, float]:
+    """
+    Read a STARsolo Summary.csv file (rows of "metric,value").
+    Args:
+        star_summary_csv: Path to the STAR summary CSV file
+    Returns:
+        {metric: value}
+    """
+    values = {k: to_number(v) for k,v in read_summary(star_summary_csv).items()}
+    return {k: float("nan") if v is None else v for k,v in values.items()}
+
+def format_star_params(star_summary_csv: str, params: dict) -> pd.DataFrame:
+    """
+    Combine the parameters of a STAR run with its summary metrics.
+    Args:
+        star_summary_csv: Path to the STAR summary CSV file
+        params: STAR parameters (see `PARAM_COLUMNS`)
+    Returns:
+        One-row table of the parameters & summary metrics
+    """
+    row = {col: params.get(col) for col in PARAM_COLUMNS}
+    row.update(read_star_summary(star_summary_csv))
+    return pd.DataFrame([row])
+
+def read_seqkit_stats(stats_file: str, sample: str, accession: str) -> pd.DataFrame:
+    """
+    Read seqkit stats table and return as pandas dataframe.
+    Args:
+        stats_file: Path to seqkit stats file
+        sample: Sample name
+        accession: SRA accession
+    Returns:
+        pandas dataframe of seqkit stats
+    """
+    # check if stats_file is None
+    if stats_file is None:
+        return None
+    # read in as pandas dataframe
+    DF = pd.read_csv(stats_file, sep='\t')
+    DF["accession"] = accession
+    DF["read"] =  "read" + DF["file"].str.extract(r'read_([12]).fastq$') + "_length"
+    DF = DF[["accession", "read", "avg_len"]]
+    # convert avg_len to int
+    DF["avg_len"] = DF["avg_len"].astype(int)
+    # rename "avg_len" to "read_length"
+    DF = DF.rename(columns={"avg_len": "read_length"})
+    # pivot wider
+    DF = DF.pivot(index='accession', columns='read', values='read_length').reset_index()
+    DF["sample"] = sample
+    return DF
+
+def estimate_num_cells(data_all: pd.DataFrame) -> pd.DataFrame:
+    """
+    Estimate the total number of cells of each parameter set, from the subsample
+    (STAR summary) & the number of spots (sra-stat), accounting for sequencing saturation.
+    Args:
+        data_all: pandas dataframe of all parameters, with the sra-stat columns
+    Returns:
+        data_all, with the "Total Estimated Number of Cells" column (nullable integer;
+        NA if not finite, e.g., a missing metric or a sequencing saturation of 0)
+    """
+    data_all["saturation"] = data_all["Number of Reads"] / data_all["Sequencing Saturation"]
+    data_all["num_spots"] = data_all["saturation"].where(data_all["spot_count"] > data_all["saturation"], data_all["spot_count"])
+    data_all["num_cells"] = data_all["num_spots"] / data_all["Number of Reads"] * data_all["Estimated Number of Cells"] #* data_all["Reads Mapped to GeneFull: Unique+Multiple GeneFull"]
+    num_cells = data_all["num_cells"].astype(float)
+    data_all["Total Estimated Number of Cells"] = num_cells.where(np.isfinite(num_cells)).round().astype("Int64")
+    data_all.drop(columns=["saturation", "num_spots", "num_cells"], inplace=True)
+    return data_all
+
+def get_strand_label(group: pd.DataFrame) -> str:
+    """
+    Get the strand label based on the number of reads mapped to the gene.
+    Args:
+        group: pandas dataframe group
+    Returns:
+        strand label
+    """
+    target_col = GENE_FULL_COL
+    # get the target column values for the strand
+    try:
+        fwd = group.loc[group["strand"]=="Forward",target_col].values[0]
+    except IndexError:
+        fwd = 0
+    try:
+        rev = group.loc[group["strand"]=="Reverse",target_col].values[0]
+    except IndexError:
+        rev = 0
+    # return the strand label
+    if fwd >= 2 * rev:
+        return "Forward"
+    elif rev >= 2 * fwd:
+        return "Reverse"
+    else:
+        return "Ambiguous"
+
+def strand_labels(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Label the proper strand of all parameter groups at once (see `get_strand_label`):
+    the GeneFull values of the Forward & Reverse runs are pivoted into columns
+    (0 if a strand was not run), and compared column-wise.
+    Args:
+        data: STAR param search table (one row per parameter set)
+    Returns:
+        Table of the parameter groups (`GROUP_COLUMNS`) with the proper strand
+    """
+    columns = GROUP_COLUMNS + ["proper_strand"]
+    runs = data.dropna(subset=GROUP_COLUMNS).drop_duplicates(GROUP_COLUMNS + ["strand"])
+    if runs.shape[0] == 0:
+        return pd.DataFrame(columns=columns)
+    runs = runs.set_index(GROUP_COLUMNS + ["strand"])
+    values = runs[GENE_FULL_COL].unstack("strand").reindex(columns=["Forward", "Reverse"])
+    ran = pd.Series(True, index=runs.index).unstack("strand", fill_value=False) \
+        .reindex(columns=["Forward", "Reverse"], fill_value=False)
+    fwd = values["Forward"].where(ran["Forward"], 0)
+    rev = values["Reverse"].where(ran["Reverse"], 0)
+    labels = np.select([fwd >= 2 * rev, rev >= 2 * fwd], ["Forward", "Reverse"], default="Ambiguous")
+    return pd.DataFrame({"proper_strand": labels}, index=values.index).reset_index()[columns]
+
+def get_best_params(
+    data: pd.DataFrame,
+    reads_with_barcodes_cutoff: float=0.3
+    ) -> pd.DataFrame:
+    """
+    Filter the data based on various criteria to select the best parameters.
+    Args:
+        data: pandas dataframe of all parameters
+        reads_with_barcodes_cutoff: Minimum fraction of reads with valid barcodes
+    Returns:
+        pandas dataframe of best parameters
+    """
+    # group by
+    proper_strand = strand_labels(data)
+
+    # join proper_strand to data
+    data = pd.merge(data, proper_strand, on=GROUP_COLUMNS)
+
+    # filter to proper strand
+    data = data[data["strand"] == data["proper_strand"]].drop(columns="proper_strand")
+    if data.shape[0] == 0:
+        logging.info(f"No parameters passed the proper strand filter")
+
+    # Filter on fraction of reads with valid barcode
+    target_col = VALID_BARCODES_COL
+    data = data[data[target_col] >= reads_with_barcodes_cutoff]
+    if data.shape[0] == 0:
+        logging.info(f"No parameters passed the reads_with_barcodes_cutoff filter: {reads_with_barcodes_cutoff}")
+
+    # Filter to the max `Fraction of Unique Reads in Cells` => best parameters
+    target_col = CELL_READS_COL
+    data = data[data[target_col] != float("inf")]
+    data = data[data[target_col] == data[target_col].max()]
+    if data.shape[0] == 0:
+        logging.info(f"No parameters passed the `max(Fraction of Unique Reads in Cells)` filter")
+
+    return data
+
+def select_best_params(
+    data: pd.DataFrame,
+    reads_with_barcodes_cutoff: float=0.3
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Select the best parameters of all samples & accessions at once, with the same filters
+    as `get_best_params` plus the read length check, as column-wise operations:
+    proper strand, fraction of reads with valid barcodes, max `Fraction of Unique Reads in Cells`
+    (per sample & accession), read 1 length >= cell barcode + UMI length,
+    then the max `Reads With Valid Barcodes` (per sample & accession).
+    Args:
+        data: STAR param search table of all samples & accessions, with the read lengths
+              (read1_length; see `read_seqkit_stats`)
+        reads_with_barcodes_cutoff: Minimum fraction of reads with valid barcodes
+    Returns:
+        (best parameters: one row per sample & accession that passed,
+         status: one row per sample & accession, with the step that failed ("" = passed))
+    """
+    keys = ["sample", "accession"]
+    status = data[keys].drop_duplicates().reset_index(drop=True)
+    status["failed_step"] = ""
+
+    # proper strand
+    data = pd.merge(data, strand_labels(data), on=GROUP_COLUMNS)
+    data = data[data["strand"] == data["proper_strand"]].drop(columns="proper_strand")
+    # fraction of reads with valid barcode
+    data = data[data[VALID_BARCODES_COL] >= reads_with_barcodes_cutoff]
+    # max `Fraction of Unique Reads in Cells`
+    data = data[data[CELL_READS_COL] != float("inf")]
+    data = data[data[CELL_READS_COL] == data.groupby(keys)[CELL_READS_COL].transform("max")]
+    passed = status.set_index(keys).index.isin(data.set_index(keys).index)
+    status.loc[~passed, "failed_step"] = "Get best params"
+
+    # read 1 length >= cell barcode + UMI length
+    data = data.copy()
+    for x in ["cell_barcode_length", "umi_length", "read1_length", "read2_length"]:
+        data[x] = data[x].astype(int)
+    data = data[data["cell_barcode_length"] + data["umi_length"] <= data["read1_length"]]
+    passed_len = status.set_index(keys).index.isin(data.set_index(keys).index)
+    status.loc[passed & ~passed_len, "failed_step"] = "Read length filter"
+
+    # max `Reads With Valid Barcodes`
+    data = data.sort_values(VALID_BARCODES_COL, ascending=False, kind="stable").drop_duplicates(keys)
+    return data.reset_index(drop=True), status
+
+def score_param_groups(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Score each parameter group (all parameters, except the strand), for pruning.
+    The score is the fraction of reads with valid barcodes times the fraction of reads
+    mapped to GeneFull, of the proper strand (see `get_strand_label`; the best strand, if
+    ambiguous), so that both a wrong barcode whitelist/layout and a wrong STAR index score low.
+    Args:
+        data: STAR param search table (one row per parameter set; see `format_star_params`)
+    Returns:
+        Table of the parameter groups (`GROUP_COLUMNS`) with the proper strand & score, sorted by score
+    """
+    columns = GROUP_COLUMNS + ["proper_strand", "score"]
+    if data.shape[0] == 0:
+        return pd.DataFrame(columns=columns)
+    data = data.copy()
+    data["score"] = (
+        pd.to_numeric(data[VALID_BARCODES_COL], errors="coerce").fillna(0) *
+        pd.to_numeric(data[GENE_FULL_COL], errors="coerce").fillna(0)
+    )
+    labels = strand_labels(data)
+    data = pd.merge(data, labels, on=GROUP_COLUMNS)
+    on_strand = (data["proper_strand"] == "Ambiguous") | (data["strand"] == data["proper_strand"])
+    scores = data["score"].where(on_strand).groupby([data[c] for c in GROUP_COLUMNS]).max().fillna(0.0)
+    labels = pd.merge(labels, scores.reset_index(), on=GROUP_COLUMNS)
+    return labels[columns].sort_values("score", ascending=False, kind="stable")
+
+def num_to_keep(num_groups: int, eta: int=ETA, min_keep: int=MIN_KEEP) -> int:
+    """
+    Number of parameter groups kept after a round of successive halving.
+    Args:
+        num_groups: Number of parameter groups in the round
+        eta: Reduction factor per round
+        min_keep: Min number of groups kept
+    Returns:
+        Number of groups to keep
+    """
+    return min(num_groups, max(min_keep, math.ceil(num_groups / eta)))
+
+def successive_halving(
+    param_sets: List[dict],
+    rounds: Sequence[Optional[int]],
+    run_round: Callable[[int, Optional[int], List[dict]], pd.DataFrame],
+    eta: int=ETA,
+    min_keep: int=MIN_KEEP
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Successive-halving search of the STAR parameters: each round runs STAR for the
+    remaining parameter sets on a (larger) subsample of the reads, scores the parameter groups
+    (see `score_param_groups`), and keeps the top groups (see `num_to_keep`; both strands of each group)
+    for the next round. All remaining parameter sets are returned after the last round,
+    for the selection of the best parameters (see `get_best_params`).
+    Args:
+        param_sets: Parameter sets (dicts with the `PARAM_COLUMNS`)
+        rounds: Number of reads per round; None = all reads (e.g., [10000, 100000, None])
+        run_round: Function(round index, number of reads, parameter sets) => STAR param search
+                   table of the round (see `format_star_params`); failed runs can be omitted
+        eta: Reduction factor per round
+        min_keep: Min number of groups kept per round
+    Returns:
+        (STAR param search table of the last round, table of all rounds with the score & whether the group was kept)
+    """
+    history = []
+    data = pd.DataFrame(columns=PARAM_COLUMNS)
+    for i,num_reads in enumerate(rounds):
+        if not param_sets:
+            break
+        logging.info(f"Round {i + 1}/{len(rounds)}: {len(param_sets)} parameter sets on {num_reads or 'all'} reads")
+        data = run_round(i, num_reads, param_sets)
+        # score
+        scores = score_param_groups(data)
+        last_round = i == len(rounds) - 1
+        keep = scores.shape[0] if last_round else num_to_keep(scores.shape[0], eta, min_keep)
+        scores["kept"] = [j < keep for j in range(scores.shape[0])]
+        scores["round"] = i + 1
+        scores["num_reads"] = num_reads if num_reads is not None else -1
+        history.append(scores)
+        for row in scores.itertuples(index=False):
+            status = "kept" if row.kept else "pruned"
+            logging.info(f"  {row.barcodes_name} / {row.star_index}: score={row.score:.4f} ({status})")
+        if last_round:
+            break
+        # prune
+        kept = scores[scores["kept"]]
+        kept_keys = set(kept[GROUP_COLUMNS].astype(str).itertuples(index=False, name=None))
+        param_sets = [
+            p for p in param_sets
+            if tuple(str(p.get(col)) for col in GROUP_COLUMNS) in kept_keys
+        ]
+    history = pd.concat(history, ignore_index=True) if history else pd.DataFrame()
+    return data, history
+
+def load_prior_params(sample: str, conn, max_priors: int=MAX_PRIORS) -> pd.DataFrame:
+    """
+    Get the final STAR parameters (screcounter_star_params) of the sibling samples of a sample:
+    the other samples of the same study (see `STUDY_COLUMNS`; via srx_metadata, or srx_srr).
+    Args:
+        sample: Sample (SRX accession)
+        conn: Database connection
+        max_priors: Max number of parameter sets
+    Returns:
+        Parameter sets (columns: barcodes, star_index, cell_barcode_length, umi_length, strand, num_samples),
+        sorted by the number of sibling samples with the parameter set
+    """
+    from db_utils import get_table_columns
+    columns = ["barcodes", "star_index", "cell_barcode_length", "umi_length", "strand", "num_samples"]
+    for table in ("srx_metadata", "srx_srr"):
+        study_col = next((x for x in STUDY_COLUMNS if x in get_table_columns(table, conn)), None)
+        if study_col is not None:
+            break
+    else:
+        logging.warning(f"No study column ({', '.join(STUDY_COLUMNS)}) in srx_metadata or srx_srr; no prior parameters")
+        return pd.DataFrame(columns=columns)
+    stmt = f"""
+    WITH study AS (
+        SELECT DISTINCT {study_col} AS study FROM {table}
+        WHERE srx_accession = %(sample)s AND {study_col} IS NOT NULL AND {study_col} NOT IN ('', 'NaN', 'None')
+    ),
+    siblings AS (
+        SELECT DISTINCT t.srx_accession FROM {table} t
+        INNER JOIN study ON t.{study_col} = study.study
+        WHERE t.srx_accession != %(sample)s
+    )
+    SELECT p.barcodes, p.star_index, p.cell_barcode_length, p.umi_length, p.strand,
+           COUNT(DISTINCT p.sample) AS num_samples
+    FROM screcounter_star_params p
+    INNER JOIN siblings ON p.sample = siblings.srx_accession
+    GROUP BY p.barcodes, p.star_index, p.cell_barcode_length, p.umi_length, p.strand
+    ORDER BY num_samples DESC
+    LIMIT %(max_priors)s
+    """
+    df = pd.read_sql(stmt, conn, params={"sample": sample, "max_priors": max_priors})
+    logging.info(f"Prior parameter sets of the siblings of {sample} (study: {table}.{study_col}): {len(df)}")
+    return df[columns]
+
+def select_prior_param_sets(param_sets: List[dict], priors: pd.DataFrame) -> List[dict]:
+    """
+    Select the parameter sets matching prior parameters (see `load_prior_params`).
+    Parameter sets are matched on the barcodes file & STAR index names (the database stores base names),
+    and the cell barcode & UMI lengths; both strands are selected (both are needed to label the proper strand).
+    Args:
+        param_sets: Parameter sets (dicts with the `PARAM_COLUMNS`)
+        priors: Prior parameters (columns: barcodes, star_index, cell_barcode_length, umi_length)
+    Returns:
+        Matching parameter sets
+    """
+    prior_keys = {
+        (str(x.barcodes), str(x.star_index).rstrip("/"), int(x.cell_barcode_length), int(x.umi_length))
+        for x in priors.itertuples(index=False)
+    }
+    return [
+        p for p in param_sets
+        if (
+            os.path.basename(str(p["barcodes_file"])), os.path.basename(str(p["star_index"]).rstrip("/")),
+            int(p["cell_barcode_length"]), int(p["umi_length"])
+        ) in prior_keys
+    ]
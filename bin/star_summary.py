@@ -0,0 +1,111 @@
+# import
+## batteries
+import os
+import re
+import csv
+from io import StringIO
+from typing import Dict, List, Optional, Tuple
+## pipeline
+from table_utils import to_number, to_int
+
+# constants
+## STARsolo features (one Summary.csv per feature)
+FEATURES = ["Gene", "GeneFull", "GeneFull_Ex50pAS", "GeneFull_ExonOverIntron", "Velocyto"]
+## feature names within the metric names (e.g., "Reads Mapped to GeneFull: Unique GeneFull"); longest first
+FEATURE_REGEX = re.compile(r" (?:" + "|".join(sorted(FEATURES, key=len, reverse=True)) + r") ")
+## output file names of STAR_FULL (e.g., GeneFull_summary.csv)
+SUMMARY_FILE_REGEX = re.compile(r"_summary.csv$")
+NON_WORD_REGEX = re.compile(r"\W")
+## numeric schema: integer columns; all other metric columns are floats
+INT_COLUMNS = {"estimated_number_of_cells", "number_of_reads", "umis_in_cells"}
+
+# functions
+def parse_summary(text: str) -> Dict[str, str]:
+    """
+    Parse the text of a STARsolo Summary.csv file (headerless rows of "metric,value").
+    Args:
+        text: File contents
+    Returns:
+        {metric: value}, in file order; values are kept as strings
+    """
+    return {row[0]: row[1] for row in csv.reader(StringIO(text)) if len(row) >= 2}
+
+def read_summary(infile: str) -> Dict[str, str]:
+    """
+    Read a STARsolo Summary.csv file.
+    Args:
+        infile: Path to the Summary.csv file
+    Returns:
+        {metric: value}, in file order; values are kept as strings
+    """
+    with open(infile, newline="") as inF:
+        return parse_summary(inF.read())
+
+def feature_name(infile: str) -> str:
+    """
+    Feature of a STAR_FULL summary file (e.g., "GeneFull" for ".../GeneFull_summary.csv").
+    Args:
+        infile: Path to the summary file
+    Returns:
+        Feature name
+    """
+    return SUMMARY_FILE_REGEX.sub("", os.path.basename(infile))
+
+def column_name(metric: str) -> str:
+    """
+    Database column of a metric: the feature name is replaced by "feature",
+    then non-word characters by "_", in lowercase
+    (e.g., "Reads Mapped to GeneFull: Unique GeneFull" => "reads_mapped_to_feature__unique_feature").
+    Args:
+        metric: Metric name
+    Returns:
+        Column name
+    """
+    return NON_WORD_REGEX.sub("_", FEATURE_REGEX.sub(" feature ", metric)).lower()
+
+def coerce_value(column: str, value) -> Optional[float]:
+    """
+    Coerce a metric value to the numeric schema: integer columns (`INT_COLUMNS`; 0 if not numeric or
+    not finite), otherwise floats (None if not numeric).
+    Args:
+        column: Column name
+        value: Value
+    Returns:
+        Integer, float or None
+    """
+    return to_int(value) if column in INT_COLUMNS else to_number(value)
+
+def summary_table(summaries: Dict[str, Dict[str, str]]) -> Tuple[List[str], List[dict]]:
+    """
+    Build the wide summary table (one row per feature; one column per metric) directly from
+    the parsed summary files, with the numeric schema applied.
+    Args:
+        summaries: {feature: {metric: value}} (see `read_summary`)
+    Returns:
+        (column names: "feature" & the metric columns (sorted by metric name), records)
+    """
+    # metric => column, per feature
+    renamed = {
+        feature: {FEATURE_REGEX.sub(" feature ", metric): value for metric,value in metrics.items()}
+        for feature,metrics in summaries.items()
+    }
+    metrics = sorted({metric for values in renamed.values() for metric in values})
+    columns = [column_name(metric) for metric in metrics]
+    records = []
+    for feature in sorted(renamed):
+        record = {"feature": feature}
+        values = renamed[feature]
+        for metric,column in zip(metrics, columns):
+            record[column] = coerce_value(column, values.get(metric))
+        records.append(record)
+    return ["feature"] + columns, records
+
+def upsert_summary_table(records: List[dict], conn) -> None:
+    """
+    Upsert the summary table to screcounter_star_results.
+    Args:
+        records: Records (see `summary_table`), with the sample
+        conn: psycopg2 connection object
+    """
+    from db_utils import db_upsert_records
+    db_upsert_records(records, "screcounter_star_results", conn)
@@ -4,11 +4,13 @@ from __future__ import print_function
 import os
 import re
 import sys
-import gzip
 import argparse
 import logging
-from time import sleep
-from subprocess import Popen, PIPE
+from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+## pipeline
+from fastq_utils import SAMPLE_MODES, subsample_reads
+from telemetry import Telemetry, file_size_gb
 
 
 # logging
@@ -21,56 +23,107 @@ class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
 
 desc = 'Subsample reads'
 epi = """DESCRIPTION:
-Subsample reads from a fastq file.
-Just taking the first N reads from the head of the file.
-gzip input fastq files are supported.
+Subsample reads from 1 or more fastq files, and write them to one output file.
+--num-seqs is divided evenly among the input files.
+
+Subsampling modes:
+- head: the first N reads of each file
+- reservoir: a uniform random sample of N reads (seeded); the entire file is streamed
+- stride: N reads spread evenly across each file (seeded), via seeking; only the
+  selected reads are read. Only for uncompressed files (compressed files use "reservoir").
+
+Paired reads: provide the R2 files via --fastq-r2 (same order as the R1 files);
+the same reads are selected from R1 & R2, and R2 is written to --out-file-r2.
+
+gzip- and zstd-compressed input fastq files are supported (detected from the file contents).
+Files are processed in parallel (--threads).
+
+Examples:
+subsample.py --mode reservoir --num-seqs 100000 R1.fastq.gz
+subsample.py --mode stride --fastq-r2 R2.fastq --out-file-r2 sub_R2.fastq R1.fastq
 """
 parser = argparse.ArgumentParser(description=desc, epilog=epi,
                                  formatter_class=CustomFormatter)
 parser.add_argument('fastq_file', type=str, nargs='+',
                     help='file(s) to subsample')
+parser.add_argument('--fastq-r2', type=str, nargs='+', default=None,
+                    help='Read 2 file(s) to subsample, paired with the fastq_file(s)')
 parser.add_argument('--num-seqs', type=int, default=100000,
                     help='Number of sequences to subsample')
+parser.add_argument('--mode', type=str, default='head', choices=SAMPLE_MODES,
+                    help='Subsampling mode')
+parser.add_argument('--seed', type=int, default=0,
+                    help='Random seed (reservoir & stride modes)')
+parser.add_argument('--threads', type=int, default=4,
+                    help='Number of files to process in parallel')
 parser.add_argument('--out-file', type=str, default='subsampled.fastq',
-                    help='Output file') 
+                    help='Output file')
+parser.add_argument('--out-file-r2', type=str, default='subsampled_R2.fastq',
+                    help='Read 2 output file (if --fastq-r2)')
+parser.add_argument('--sample', type=str, default='',
+                    help='Sample name (for the timing records)')
+parser.add_argument('--accession', type=str, default='',
+                    help='SRA accession (for the timing records)')
+parser.add_argument('--no-db', action='store_true', default=False,
+                    help='Do not write to the database (timing records are written to the JSONL spill file)')
 
 # functions
-def subsample(infile: str, num_seqs: int, outF, is_gzip: bool=False) -> None:
-    # use gzip if file is gzipped
-    if is_gzip:
-        _open = gzip.open
+def subsample(fastq_files: Tuple[str, ...], num_seqs: int, mode: str, seed: int) -> List[Tuple[bytes, ...]]:
+    """
+    Subsample reads from one (set of paired) fastq file(s).
+    Args:
+        fastq_files: Fastq file(s); e.g., (R1,) or (R1, R2)
+        num_seqs: Number of sequences to subsample
+        mode: Subsampling mode
+        seed: Random seed
+    Returns:
+        Tuples of records (one per file)
+    """
+    reads = subsample_reads(fastq_files, num_seqs, mode=mode, seed=seed)
+    logging.info(f'Subsampled {len(reads)} reads from: {", ".join(fastq_files)}')
+    return reads
+
+def main(args, telemetry: Telemetry):
+    # input file sets
+    if args.fastq_r2 is not None:
+        if len(args.fastq_r2) != len(args.fastq_file):
+            logging.error('The number of --fastq-r2 files must match the number of fastq files')
+            sys.exit(1)
+        file_sets = list(zip(args.fastq_file, args.fastq_r2))
+        out_files = [args.out_file, args.out_file_r2]
     else:
-        _open = open
-    # subsample
-    with _open(infile, 'r') as inF:
-        for ii,line in enumerate(inF, 1):
-            # decode if gzip
-            if is_gzip:
-                line = line.decode('utf-8')
-            # write
-            outF.write(line)
-            if ii / 4 >= num_seqs:
-                return None
+        file_sets = [(f,) for f in args.fastq_file]
+        out_files = [args.out_file]
 
-def main(args):
     # divide num_seqs by number of files
-    num_files = len(args.fastq_file)
+    num_files = len(file_sets)
     num_seqs = int(args.num_seqs / num_files)
-    
-    # loop through each file
-    with open(args.out_file, 'w') as outF:
-        for i, infile in enumerate(args.fastq_file, 1):
-            logging.info(f'Processing file {i}/{num_files}: {infile}')
-            # subsample
-            try:
-                subsample(infile, num_seqs, outF)
-            except UnicodeDecodeError:
-                subsample(infile, num_seqs, outF, is_gzip=True)
+
+    # subsample each file (set) in parallel; a different seed per file
+    logging.info(f'Subsampling {num_seqs} reads from each of {num_files} file(s); mode: {args.mode}')
+    input_gb = sum(file_size_gb(f) or 0 for x in file_sets for f in x)
+    with telemetry.span('Subsample', input_gb=input_gb), \
+         ThreadPoolExecutor(max_workers=max(1, args.threads)) as pool:
+        results = pool.map(
+            lambda x: subsample(x[1], num_seqs, args.mode, args.seed + x[0]), enumerate(file_sets)
+        )
+        # write, in input order
+        out_handles = [open(f, 'wb') for f in out_files]
+        try:
+            for reads in results:
+                for outF,records in zip(out_handles, zip(*reads)):
+                    outF.writelines(records)
+        finally:
+            for outF in out_handles:
+                outF.close()
 
     # status
-    logging.info(f'Output written to: {args.out_file}')
+    for out_file in out_files:
+        logging.info(f'Output written to: {out_file}')
 
 ## script main
 if __name__ == '__main__':
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    # timing records are upserted to the database on exit (or written to the JSONL spill file)
+    with Telemetry('subsample', args.sample, args.accession, use_db=not args.no_db) as telemetry:
+        main(args, telemetry)
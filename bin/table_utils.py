@@ -0,0 +1,72 @@
+# import
+## batteries
+import csv
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# functions
+def read_csv(infile: str) -> Tuple[List[str], List[Dict[str, str]]]:
+    """
+    Read a CSV file (with a header) via the csv module; values are kept as strings.
+    Args:
+        infile: Path to the CSV file
+    Returns:
+        (column names, records)
+    """
+    with open(infile, newline="") as inF:
+        reader = csv.DictReader(inF)
+        records = list(reader)
+        return list(reader.fieldnames or []), records
+
+def write_csv(outfile: str, records: Sequence[dict], columns: Sequence[str]) -> None:
+    """
+    Write records as CSV; missing values (and None) are written as empty fields.
+    Args:
+        outfile: Path to the output CSV file
+        records: Records
+        columns: Column names (order of the output)
+    """
+    with open(outfile, "w", newline="") as outF:
+        writer = csv.DictWriter(outF, fieldnames=list(columns), restval="", extrasaction="ignore", lineterminator="\n")
+        writer.writeheader()
+        for record in records:
+            writer.writerow({k: "" if v is None else v for k,v in record.items()})
+
+def union_columns(tables: Sequence[Sequence[str]]) -> List[str]:
+    """
+    Union of the column names of multiple tables, in order of first appearance (as `pd.concat`).
+    Args:
+        tables: Column names of each table
+    Returns:
+        Column names
+    """
+    columns = []
+    for table in tables:
+        columns += [col for col in table if col not in columns]
+    return columns
+
+def to_number(value) -> Optional[float]:
+    """
+    Convert a value to a float; None if not numeric (as `pd.to_numeric(errors="coerce")`).
+    Args:
+        value: Value
+    Returns:
+        Float or None
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+def to_int(value, default: int=0) -> int:
+    """
+    Convert a value to an integer; `default` if not numeric or not finite.
+    Args:
+        value: Value
+        default: Value for non-numeric and non-finite values
+    Returns:
+        Integer
+    """
+    value = to_number(value)
+    return default if value is None or math.isinf(value) else int(value)
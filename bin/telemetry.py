@@ -0,0 +1,222 @@
+# import
+## batteries
+import os
+import uuid
+import socket
+import logging
+import resource
+from time import monotonic
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+## pipeline
+from db_utils import LogSink, get_conn
+
+# constants
+TABLE_NAME = "screcounter_timing"
+COLUMNS = [
+    "span_id", "sample", "accession", "process", "step", "status", "host", "started_at",
+    "wall_sec", "cpu_sec", "child_cpu_sec", "max_rss_mb", "child_max_rss_mb",
+    "read_mb", "write_mb", "input_gb"
+]
+CREATE_STMT = f"""
+CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+    span_id VARCHAR(32) PRIMARY KEY,
+    sample VARCHAR(32),
+    accession VARCHAR(32),
+    process VARCHAR(64),
+    step VARCHAR(64),
+    status VARCHAR(16),
+    host VARCHAR(128),
+    started_at TIMESTAMPTZ,
+    wall_sec DOUBLE PRECISION,
+    cpu_sec DOUBLE PRECISION,
+    child_cpu_sec DOUBLE PRECISION,
+    max_rss_mb DOUBLE PRECISION,
+    child_max_rss_mb DOUBLE PRECISION,
+    read_mb DOUBLE PRECISION,
+    write_mb DOUBLE PRECISION,
+    input_gb DOUBLE PRECISION
+)
+"""
+_TABLE_CREATED = False
+
+# classes
+class Span:
+    """
+    Timing & resource usage of one stage of a process.
+    `status` and `input_gb` (e.g., the SRA file size; used for cost per GB) can be set
+    within the span; the status is "Error" if the span exits with an exception.
+    """
+    def __init__(self, sample: str, accession: str, process: str, step: str, input_gb: Optional[float]=None):
+        self.sample = sample
+        self.accession = accession
+        self.process = process
+        self.step = step
+        self.status = "Success"
+        self.input_gb = input_gb
+        self.started_at = datetime.now(timezone.utc)
+        self.wall_sec = 0.0
+        self._start = monotonic()
+        self._usage = resource_usage()
+
+    def finish(self) -> Dict[str, float]:
+        """
+        Set the wall time, and return the resource usage during the span.
+        """
+        self.wall_sec = monotonic() - self._start
+        usage = resource_usage()
+        delta = {k: usage[k] - self._usage[k] for k in ("cpu_sec", "child_cpu_sec", "read_mb", "write_mb")}
+        delta["max_rss_mb"] = usage["max_rss_mb"]
+        delta["child_max_rss_mb"] = usage["child_max_rss_mb"]
+        return delta
+
+class Telemetry(LogSink):
+    """
+    Buffered writer of timing spans for the screcounter_timing table.
+    Each span records the wall time, CPU time (of the process & its reaped child processes),
+    bytes read & written (incl. child processes), and peak RSS of one stage.
+    Resource usage is process-wide, so concurrent spans (threads) include each other's usage,
+    and peak RSS values are high-water marks of the process (& its children), not of the span.
+    Spans are upserted in batches (see `LogSink`); if `use_db=False` (e.g., `--no-db`),
+    or the database cannot be reached, spans are appended to the JSONL spill file.
+    Usage:
+        with Telemetry("fq-dump", sample, accession) as telemetry:
+            with telemetry.span("prefetch") as span:
+                ...
+                span.input_gb = sra_size_gb
+    """
+    columns = COLUMNS
+
+    def __init__(
+        self, process: str, sample: str="", accession: str="", use_db: bool=True,
+        spill_file: Optional[str]=None, batch_size: int=50, enabled: bool=True
+        ) -> None:
+        """
+        Args:
+            process: Process name
+            sample: Sample name (default for spans)
+            accession: SRA accession (default for spans)
+            use_db: Upsert to the database; if False, all spans are written to the spill file
+            spill_file: JSONL file for spans that could not be upserted
+            batch_size: Number of spans to buffer before upserting
+            enabled: If False, spans are timed & logged, but not recorded
+        """
+        super().__init__(
+            table_name=TABLE_NAME, batch_size=batch_size, use_db=use_db, spill_file=spill_file
+        )
+        self.process = process
+        self.sample = sample
+        self.accession = accession
+        self.enabled = enabled
+        self.host = socket.gethostname()
+
+    @contextmanager
+    def span(self, step: str, accession: Optional[str]=None, input_gb: Optional[float]=None) -> Iterator[Span]:
+        """
+        Time a stage, and record its resource usage.
+        Args:
+            step: Step name
+            accession: SRA accession; default: that of the Telemetry object
+            input_gb: Size of the input (GB)
+        Yields:
+            Span
+        """
+        span = Span(
+            self.sample, self.accession if accession is None else accession,
+            self.process, step, input_gb
+        )
+        try:
+            yield span
+        except BaseException:
+            span.status = "Error"
+            raise
+        finally:
+            self.add_span(span)
+
+    def add_span(self, span: Span) -> None:
+        """
+        Finish a span, log it, and add it to the buffer.
+        Args:
+            span: Span
+        """
+        usage = span.finish()
+        logging.info(
+            f"Timing: {span.process}/{span.step} ({span.accession or span.sample}): "
+            f"wall={span.wall_sec:.2f}s, cpu={usage['cpu_sec']:.2f}s, child_cpu={usage['child_cpu_sec']:.2f}s, "
+            f"read={usage['read_mb']:.1f}MB, write={usage['write_mb']:.1f}MB"
+        )
+        if not self.enabled:
+            return
+        record = dict(
+            usage, span_id=uuid.uuid4().hex, sample=span.sample, accession=span.accession,
+            process=span.process, step=span.step, status=span.status, host=self.host,
+            started_at=span.started_at.isoformat(), wall_sec=span.wall_sec, input_gb=span.input_gb
+        )
+        self.add_record(tuple(record[col] for col in self.columns))
+
+    def flush(self) -> None:
+        """
+        Write all pending spans to the database (or the spill file).
+        The table is created (once per process), if it does not exist.
+        """
+        global _TABLE_CREATED
+        if self.use_db and self._pending and not _TABLE_CREATED:
+            try:
+                with get_conn() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(CREATE_STMT)
+                    conn.commit()
+                _TABLE_CREATED = True
+            except Exception as e:
+                logging.warning(f"Could not create {self.table_name}: {str(e)}")
+        super().flush()
+
+# functions
+def _proc_io() -> Dict[str, int]:
+    """
+    Get the I/O counters of the process (incl. reaped child processes) from /proc (Linux).
+    Returns:
+        {counter: bytes}; empty if not available
+    """
+    try:
+        with open("/proc/self/io") as inF:
+            return {k: int(v) for k,v in (line.split(":") for line in inF if ":" in line)}
+    except (OSError, ValueError):
+        return {}
+
+def resource_usage() -> Dict[str, float]:
+    """
+    Get the cumulative resource usage of the process and its reaped child processes.
+    Bytes read & written are `rchar`/`wchar` (all reads & writes, incl. pipes & sockets).
+    Returns:
+        {cpu_sec, child_cpu_sec, max_rss_mb, child_max_rss_mb, read_mb, write_mb}
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    io = _proc_io()
+    return {
+        "cpu_sec": usage.ru_utime + usage.ru_stime,
+        "child_cpu_sec": child_usage.ru_utime + child_usage.ru_stime,
+        "max_rss_mb": usage.ru_maxrss / 1024,
+        "child_max_rss_mb": child_usage.ru_maxrss / 1024,
+        "read_mb": io.get("rchar", 0) / 1e6,
+        "write_mb": io.get("wchar", 0) / 1e6,
+    }
+
+def file_size_gb(path: Optional[str]) -> Optional[float]:
+    """
+    Get the size (GB) of a file, or the total size of the files in a directory.
+    Args:
+        path: File or directory
+    Returns:
+        Size (GB); None if the path does not exist
+    """
+    if not path or not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 1e9
+    size = 0
+    for root,_,files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return size / 1e9
@@ -7,8 +7,8 @@ import re
 import sys
 import argparse
 import logging
-import pandas as pd
-from db_utils import db_connect, db_upsert
+from db_utils import get_conn, db_upsert_records, LogSink
+from table_utils import write_csv
 
 # logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
@@ -40,44 +40,33 @@ parser.add_argument('--outfile', type=str, default="star_params.csv",
                     help='Output file path')
 
 # functions
-def main(args):
-    # set pandas display optionqs
-    pd.set_option('display.max_columns', 30)
-    pd.set_option('display.width', 300)
-
-    # create dataframe
-    df = pd.DataFrame({
-        'sample': [args.sample],
-        'barcodes': [os.path.basename(args.barcodes)],
-        'star_index': [os.path.basename(args.star_index.rstrip("/"))],
-        'cell_barcode_length': [args.cell_barcode_length],
-        'umi_length': [args.umi_length],
-        'strand': [args.strand]
-    })
+def main(args, log: LogSink):
+    # create record
+    record = {
+        'sample': args.sample,
+        'barcodes': os.path.basename(args.barcodes),
+        'star_index': os.path.basename(args.star_index.rstrip("/")),
+        'cell_barcode_length': args.cell_barcode_length,
+        'umi_length': args.umi_length,
+        'strand': args.strand
+    }
 
     # write to file
     if os.path.exists(args.outfile):
         os.remove(args.outfile)
-    df.to_csv(args.outfile, index=False)
+    write_csv(args.outfile, [record], list(record.keys()))
 
     # upload to the scRecounter database
-    with db_connect() as conn:
-        db_upsert(df, "screcounter_star_params", conn)
+    with get_conn() as conn:
+        db_upsert_records([record], "screcounter_star_params", conn)
 
     # update screcounter log
-    log_df = pd.DataFrame({
-        "sample": [args.sample],
-        "accession": [""],
-        "process": ["STAR save params"],
-        "step": ["Final"],
-        "status": ["Success"],
-        "message": ["STAR final parameters saved to database"],
-    })
-    with db_connect() as conn:
-        db_upsert(log_df, "screcounter_log", conn)
-   
+    log.add(args.sample, "", "STAR save params", "Final", "Success", "STAR final parameters saved to database")
+
 
 ## script main
 if __name__ == '__main__':
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    # log records are upserted to the database on exit (or written to the JSONL spill file)
+    with LogSink() as log:
+        main(args, log)
@@ -4,7 +4,7 @@ import argparse
 from typing import Tuple, List, Dict
 import pandas as pd
 from google.cloud import storage
-from db_utils import db_connect, db_upsert
+from db_utils import get_conn, db_upsert
 
 # argparse
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
@@ -193,7 +193,7 @@ def upload_trace(output_dir: str) -> None:
         if r"%cpu" in trace_df.columns:
             trace_df.rename(columns={r"%cpu": "cpu_percent"}, inplace=True)
         # upsert
-        with db_connect() as conn:
+        with get_conn() as conn:
             db_upsert(trace_df, "screcounter_trace", conn)
         # status update
         print(f"Uploaded trace file to screcounter db: {trace_file}")
@@ -0,0 +1,29 @@
+import groovy.json.JsonSlurper
+import nextflow.Nextflow
+
+/*
+ * Trace-driven resource predictions; the model (JSON) is fit by bin/resource-hints.py.
+ * Each model file is read once per run.
+ */
+class ResourceModel {
+    private static final Map models = [:]
+
+    static Map load(String path) {
+        synchronized (models) {
+            if (!models.containsKey(path)) {
+                models[path] = path ? new JsonSlurper().parseText(Nextflow.file(path).text) : [:]
+            }
+            return models[path]
+        }
+    }
+
+    // predicted value (GB or hours) of a resource for the input size; null if not modeled
+    static Double predict(String path, String process, String resource, double sizeGb) {
+        def params = load(path)?.processes?.get(process.tokenize(':')[-1])?.get(resource)
+        if (!params) {
+            return null
+        }
+        def value = Math.max(params.intercept + params.slope * sizeGb, params.min as double)
+        return value * params.factor
+    }
+}
@@ -1,4 +1,5 @@
 import groovy.json.JsonSlurper
+import groovy.json.JsonOutput
 
 def expandStarParams(ch_fastq, ch_star_params_json) {
     def processedSamples = [] 
@@ -30,11 +31,12 @@ def expandStarParams(ch_fastq, ch_star_params_json) {
 
 def makeParamSets(ch_subsample, ch_barcodes, ch_star_indices) {
     // pairwise combine the subsample, barcodes and star indices channels
+    // the file stamps (once per barcodes file & STAR index) are part of the param cache key
     ch_params = ch_subsample
         .combine(Channel.of("Forward", "Reverse"))
-        .combine(ch_barcodes)
-        .combine(ch_star_indices)
-        .map { sample, accession, metadata, r1, r2, strand, barcodes_name, cb_len, umi_len, barcodes_file, organism, star_index ->
+        .combine(ch_barcodes.map { name, cb_len, umi_len, barcodes_file -> [name, cb_len, umi_len, barcodes_file, fileStamp(barcodes_file)] })
+        .combine(ch_star_indices.map { organism, star_index -> [organism, star_index, fileStamp(star_index)] })
+        .map { sample, accession, metadata, r1, r2, strand, barcodes_name, cb_len, umi_len, barcodes_file, barcodes_stamp, organism, star_index, star_index_stamp ->
             if (metadata["organism"] != "" & metadata["organism"] != organism) {
                 return null
             }
@@ -46,8 +48,10 @@ def makeParamSets(ch_subsample, ch_barcodes, ch_star_indices) {
                 cell_barcode_length: cb_len,
                 umi_length: umi_len,
                 barcodes_file: barcodes_file,
+                barcodes_stamp: barcodes_stamp,
                 organism: organism,
-                star_index: star_index
+                star_index: star_index,
+                star_index_stamp: star_index_stamp
             ]
             return [sample, accession, metadata, r1, r2, barcodes_file, star_index, params] 
         }
@@ -60,6 +64,152 @@ def makeParamSets(ch_subsample, ch_barcodes, ch_star_indices) {
     return ch_params
 }
 
+def filterParamSets(ch_params, ch_screen) {
+    // only keep the parameter sets with a plausible barcodes whitelist (see BARCODE_SCREEN);
+    // fail open: if the screen failed (errorStrategy "ignore") or passed no whitelist, all parameter sets are kept
+    ch_screened = ch_screen.map { sample, accession, barcodes_csv ->
+        [sample, accession, barcodes_csv.splitCsv(header: true).collect { it.name }]
+    }
+    ch_names = ch_params
+        .map { sample, accession, metadata, r1, r2, barcodes_file, star_index, params -> [sample, accession] }
+        .unique()
+        .join(ch_screened, by: [0,1], remainder: true)
+        .map { sample, accession, names ->
+            if (!names) {
+                println "WARNING: No barcode pre-screen results for Sample: ${sample}, Accession: ${accession}; testing all parameter sets"
+            }
+            return [sample, accession, names ?: null]
+        }
+    ch_filt = ch_params
+        .combine(ch_names, by: [0,1])
+        .filter { sample, accession, metadata, r1, r2, barcodes_file, star_index, params, names ->
+            names == null || params.barcodes_name in names
+        }
+        .map { sample, accession, metadata, r1, r2, barcodes_file, star_index, params, names ->
+            [sample, accession, metadata, r1, r2, barcodes_file, star_index, params]
+        }
+
+    // status on number of parameter combinations
+    ch_filt
+        .count().view{ count -> "Param sets to test across all SRX, after the barcode pre-screen: ${count}" }
+    return ch_filt
+}
+
+def collectParamSets(ch_params) {
+    // group the parameter sets of each sample & accession as JSON (for STAR_PARAM_CACHE)
+    ch_grouped = ch_params
+        .map { sample, accession, metadata, r1, r2, barcodes_file, star_index, params ->
+            [sample, accession, r1, r2, params]
+        }
+        .groupTuple(by: [0,1])
+        .map { sample, accession, r1, r2, param_sets ->
+            [sample, accession, r1[0], r2[0], JsonOutput.toJson(param_sets)]
+        }
+    return ch_grouped
+}
+
+def fileStamp(path) {
+    // number of files, total size & latest modification time (ms) of a file, or of the files in a directory
+    // (e.g., a STAR index); "" if not found. Same format as file_stamp() in bin/param_cache.py
+    try {
+        def f = file(path)
+        if (!f.exists()) {
+            return ""
+        }
+        def files = f.isDirectory() ? f.listFiles().findAll { !it.isDirectory() } : [f]
+        return "${files.size()}:${files.sum(0L) { it.size() }}:${files.collect { it.lastModified() }.max() ?: 0}"
+    } catch (Exception e) {
+        println "WARNING: Could not stat ${path}: ${e.message}"
+        return ""
+    }
+}
+
+def paramCacheKey(params) {
+    // the parameters that determine a STAR param search result (see bin/param_cache.py)
+    return ["strand", "barcodes_file", "barcodes_stamp", "cell_barcode_length", "umi_length", "star_index", "star_index_stamp"]
+        .collect { params[it].toString() }.join("|")
+}
+
+def filterCachedParamSets(ch_params, ch_uncached) {
+    // only keep the parameter sets without a cached STAR param search result (see STAR_PARAM_CACHE);
+    // the read fingerprint is added to the parameters, so that the new results are cached.
+    // Fail open: if the lookup failed (errorStrategy "ignore"), all parameter sets are kept (not cached)
+    ch_lookup = ch_uncached.map { sample, accession, json_file ->
+        def param_sets = new JsonSlurper().parseText(json_file.text)
+        [sample, accession, param_sets.collectEntries { [(paramCacheKey(it)): it.read_fingerprint] }]
+    }
+    ch_fingerprints = ch_params
+        .map { sample, accession, metadata, r1, r2, barcodes_file, star_index, params -> [sample, accession] }
+        .unique()
+        .join(ch_lookup, by: [0,1], remainder: true)
+        .map { sample, accession, fingerprints ->
+            if (fingerprints == null) {
+                println "WARNING: No param cache lookup for Sample: ${sample}, Accession: ${accession}; testing all parameter sets"
+            }
+            return [sample, accession, fingerprints]
+        }
+    ch_filt = ch_params
+        .combine(ch_fingerprints, by: [0,1])
+        .filter { sample, accession, metadata, r1, r2, barcodes_file, star_index, params, fingerprints ->
+            fingerprints == null || fingerprints.containsKey(paramCacheKey(params))
+        }
+        .map { sample, accession, metadata, r1, r2, barcodes_file, star_index, params, fingerprints ->
+            if (fingerprints == null) {
+                return [sample, accession, metadata, r1, r2, barcodes_file, star_index, params]
+            }
+            [sample, accession, metadata, r1, r2, barcodes_file, star_index,
+             params + [read_fingerprint: fingerprints[paramCacheKey(params)]]]
+        }
+
+    // status on number of parameter combinations
+    ch_filt
+        .count().view{ count -> "Param sets to test across all SRX, after the param cache lookup: ${count}" }
+    return ch_filt
+}
+
+def groupParamSets(ch_params) {
+    // group the parameter sets of each sample & accession (for STAR_PARAM_SEARCH_SAMPLE);
+    // the unique barcodes files & STAR indices are staged once, and referenced by index in the JSON parameter sets
+    ch_grouped = ch_params
+        .map { sample, accession, metadata, r1, r2, barcodes_file, star_index, params ->
+            [sample, accession, r1, r2, params]
+        }
+        .groupTuple(by: [0,1])
+        .map { sample, accession, r1, r2, param_sets ->
+            def barcodes_files = param_sets.collect { it.barcodes_file }.unique()
+            def star_indices = param_sets.collect { it.star_index }.unique()
+            def params_idx = param_sets.collect { params ->
+                params + [
+                    barcodes_idx: barcodes_files.indexOf(params.barcodes_file),
+                    star_index_idx: star_indices.indexOf(params.star_index)
+                ]
+            }
+            return [sample, accession, r1[0], r2[0],
+                    barcodes_files.collect { file(it) }, star_indices.collect { file(it) },
+                    JsonOutput.toJson(params_idx)]
+        }
+    return ch_grouped
+}
+
+def batchSelectInputs(ch_params_all) {
+    // collect the inputs of all samples & accessions (for STAR_SELECT_PARAMS_BATCH);
+    // the seqkit stats & (unique) sra-stat files are referenced by index in the JSON manifest
+    ch_batch = ch_params_all
+        .map { sample, accession, star_params, read_stats, sra_stats ->
+            [sample, accession, star_params instanceof List ? star_params : [star_params], read_stats, sra_stats]
+        }
+        .toList()
+        .filter { it.size() > 0 }
+        .map { rows ->
+            def sra_stats = rows.collect { it[4] }.unique()
+            def manifest = rows.withIndex().collect { row, i ->
+                [sample: row[0], accession: row[1], read_stats: i, sra_stats: sra_stats.indexOf(row[4])]
+            }
+            return [rows.collectMany { it[2] }, rows.collect { it[3] }, sra_stats, JsonOutput.toJson(manifest)]
+        }
+    return ch_batch
+}
+
 def validateRequiredColumns(row, required) {
     // check if all required columns are present in the input CSV file
     def missing = required.findAll { !row.containsKey(it) }
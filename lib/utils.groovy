@@ -50,15 +50,36 @@ def readAccessions(accessions_input){
     return ch_acc
 }
 
-def addStats(ch_accessions, ch_sra_stat){
+def batchAccessions(ch_accessions, batch_size){
+    // group unique accessions into batches (for SRA_STAT_BATCH)
+    return ch_accessions
+        .map{ sample, acc, metadata -> acc }
+        .unique()
+        .collate(batch_size)
+}
+
+def readSraStats(ch_sra_stat){
+    // read the combined sra-stat tables (one row per accession)
+    return ch_sra_stat
+        .flatMap{ csv -> 
+            csv.splitCsv(header: true, sep: ",").collect{ row -> [row.accession, row.file_size_gb.toDouble(), csv] }
+        } // acc, size, csv
+}
+
+def addStats(ch_accessions, ch_stats){
     // add file size information to the accessions
-    ch_stats = ch_sra_stat
-        .map{ sample,acc,csv -> csv }
-        .splitCsv(header: true, sep: ",")
-        .map{ row -> [row.accession, row.file_size_gb.toDouble()] }
-        .join(ch_sra_stat.map{ sample,acc,csv -> [acc, sample] }, by: [0])
-        .map{ acc, size, sample -> [sample, acc, size] }
-    return ch_accessions.join(ch_stats, by: [0,1]) // sample, acc, metadata, size
+    return ch_accessions
+        .map{ sample, acc, metadata -> [acc, sample, metadata] }
+        .combine(ch_stats, by: 0)
+        .map{ acc, sample, metadata, size, csv -> [sample, acc, metadata, size] }
+}
+
+def sraStatFiles(ch_accessions, ch_stats){
+    // get the sra-stat table for each accession
+    return ch_accessions
+        .map{ sample, acc, metadata -> [acc, sample] }
+        .combine(ch_stats, by: 0)
+        .map{ acc, sample, size, csv -> [sample, acc, csv] }
 }
 
 def joinReads(ch_read1, ch_read2){
@@ -81,7 +102,8 @@ def joinReads(ch_read1, ch_read2){
 }
 
 def saveAsLog(filename, sample=null, accession=null) {
-    if (filename.endsWith(".log")) {
+    // process logs & LogSink spill files (<process>_log_spill.jsonl; log records not written to the database)
+    if (filename.endsWith(".log") || filename.endsWith("_log_spill.jsonl")) {
         def basename = filename.tokenize("/")[-1]
         def path = "logs"
         if (sample){
@@ -129,4 +151,34 @@ def subsampleByGroup(ch_accessions, max_per_group, seed) {
             }
             flattened
         }
-}
\ No newline at end of file
+}
+
+def hintMemory(task, size_gb, fallback) {
+    // predicted memory (see ResourceModel), scaled by resource_retry_factor per retry; else the fallback
+    def gb = ResourceModel.predict(params.resource_model, task.process, "memory_gb", size_gb as double)
+    if (gb == null) {
+        return fallback
+    }
+    gb = gb * Math.pow(params.resource_retry_factor as double, task.attempt - 1)
+    return "${Math.ceil(gb) as long} GB" as nextflow.util.MemoryUnit
+}
+
+def hintTime(task, size_gb, fallback) {
+    // predicted time (see ResourceModel), scaled by resource_retry_factor per retry; else the fallback
+    def hours = ResourceModel.predict(params.resource_model, task.process, "time_h", size_gb as double)
+    if (hours == null) {
+        return fallback
+    }
+    hours = hours * Math.pow(params.resource_retry_factor as double, task.attempt - 1)
+    return "${Math.ceil(hours * 60) as long}m" as nextflow.util.Duration
+}
+
+def hintLocalSsd(task, size_gb, fallback) {
+    // predicted disk (see ResourceModel), as local SSD (multiples of 375 GB); else the fallback
+    def gb = ResourceModel.predict(params.resource_model, task.process, "disk_gb", size_gb as double)
+    if (gb == null) {
+        return fallback
+    }
+    gb = gb * Math.pow(params.resource_retry_factor as double, task.attempt - 1)
+    return [request: (375 * Math.max(1, Math.ceil(gb / 375) as long)).GB, type: 'local-ssd']
+}
@@ -1,21 +1,29 @@
-process SRA_STAT {
+process SRA_STAT_BATCH {
     label "download_env"
     errorStrategy { task.attempt <= maxRetries ? 'retry' : 'ignore' }
+    cpus 2
     disk 10.GB
 
     input:
-    tuple val(sample), val(accession), val(metadata)
+    val(accessions)
 
     output:
-    tuple val(sample), val(accession), path("sra-stat.csv")
+    path("sra-stat.csv")
 
     script:
     """
-    sra-stat.py ${accession}
+    export GCP_SQL_DB_HOST="${params.db_host}"
+    export GCP_SQL_DB_NAME="${params.db_name}"
+    export GCP_SQL_DB_USERNAME="${params.db_username}"
+
+    sra-stat.py \\
+      --max-age ${params.sra_stat_max_age} \\
+      --threads ${params.sra_stat_threads} \\
+      ${accessions.join(' ')}
     """
 
     stub:
     """
     touch sra-stat.csv
     """
-}
\ No newline at end of file
+}
@@ -2,9 +2,9 @@
 include { DB_ACC_WF } from './workflows/db_acc.nf'
 include { STAR_PARAMS_WF } from './workflows/star_params.nf'
 include { STAR_FULL_WF } from './workflows/star_full.nf'
-include { SRA_STAT } from './lib/utils.nf'
+include { SRA_STAT_BATCH } from './lib/utils.nf'
 // util functions
-include { readAccessions; addStats; } from './lib/utils.groovy'
+include { readAccessions; batchAccessions; readSraStats; addStats; sraStatFiles; } from './lib/utils.groovy'
 
 // Main workflow
 workflow { 
@@ -21,9 +21,12 @@ workflow {
     // read accessions file
     ch_accessions = readAccessions(ch_accessions)
 
-    // run sra-stat on accessions
-    ch_sra_stat = SRA_STAT(ch_accessions)
-    ch_accessions = addStats(ch_accessions, ch_sra_stat)
+    // run sra-stat on batches of accessions
+    ch_stats = readSraStats(
+        SRA_STAT_BATCH(batchAccessions(ch_accessions, params.sra_stat_batch))
+    )
+    ch_sra_stat = sraStatFiles(ch_accessions, ch_stats)
+    ch_accessions = addStats(ch_accessions, ch_stats)
 
     // filter out any accessions with max SRA file size greater than the user-specified size
     ch_accessions = ch_accessions.filter { it[3] <= params.max_sra_size }
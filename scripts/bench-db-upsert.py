@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from db_utils import get_conn, db_upsert, invalidate_schema_cache
+
+
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter): pass
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command-line arguments.
+    Returns:
+        argparse.Namespace containing arguments.
+    """
+    desc = 'Benchmark db_upsert: execute_values vs COPY (db_bulk_upsert).'
+    epi = """DESCRIPTION:
+    Upserts synthetic STAR-results-like tables into a scratch table and reports rows/sec
+    for each upsert path. Each table is upserted twice (insert, then update).
+    Intended for a local PostgreSQL stand-in, for example:
+
+    docker run -d --rm -p 5432:5432 -e POSTGRES_PASSWORD=bench postgres:16
+    GCP_SQL_DB_HOST=localhost GCP_SQL_DB_NAME=postgres GCP_SQL_DB_USERNAME=postgres \\
+      GCP_SQL_DB_PASSWORD=bench GCP_SQL_DB_SSLMODE=disable \\
+      PYTHONPATH=bin bench-db-upsert.py --rows 1000 100000
+    """
+    parser = argparse.ArgumentParser(description=desc, epilog=epi, formatter_class=CustomFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Table sizes (rows) to benchmark.')
+    parser.add_argument('--table', type=str, default='bench_db_upsert',
+                        help='Scratch table name; created and dropped by the benchmark.')
+    return parser.parse_args()
+
+def make_table(num_rows: int, seed: int=0) -> pd.DataFrame:
+    """
+    Create a synthetic table of STAR summary values.
+    Args:
+        num_rows: Number of rows
+        seed: Random seed
+    Returns:
+        DataFrame with a (sample, feature) unique key
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "sample": [f"SRX{i // 5:08d}" for i in range(num_rows)],
+        "feature": [f"feature_{i % 5}" for i in range(num_rows)],
+        "number_of_reads": rng.integers(0, 2**30, num_rows),
+        "estimated_number_of_cells": rng.integers(0, 100000, num_rows),
+        "reads_with_valid_barcodes": rng.random(num_rows),
+        "sequencing_saturation": rng.random(num_rows),
+    })
+
+def main(args: argparse.Namespace) -> None:
+    create_stmt = f"""
+    CREATE TABLE {args.table} (
+        id SERIAL PRIMARY KEY,
+        sample TEXT NOT NULL,
+        feature TEXT NOT NULL,
+        number_of_reads BIGINT,
+        estimated_number_of_cells BIGINT,
+        reads_with_valid_barcodes DOUBLE PRECISION,
+        sequencing_saturation DOUBLE PRECISION,
+        UNIQUE (sample, feature)
+    )
+    """
+    print("rows\tmethod\tseconds\trows_per_sec", file=sys.stdout)
+    with get_conn() as conn:
+        for num_rows in args.rows:
+            df = make_table(num_rows)
+            for method,bulk in [("execute_values", False), ("copy", True)]:
+                with conn.cursor() as cur:
+                    cur.execute(f"DROP TABLE IF EXISTS {args.table}")
+                    cur.execute(create_stmt)
+                conn.commit()
+                invalidate_schema_cache(args.table)
+                start = time.perf_counter()
+                db_upsert(df, args.table, conn, bulk=bulk)
+                db_upsert(df, args.table, conn, bulk=bulk)
+                elapsed = time.perf_counter() - start
+                print(f"{num_rows}\t{method}\t{elapsed:.3f}\t{2 * num_rows / elapsed:.0f}", file=sys.stdout)
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {args.table}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
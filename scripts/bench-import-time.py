@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+from time import perf_counter
+from typing import List, Set, Tuple
+
+
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter): pass
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command-line arguments.
+    Returns:
+        argparse.Namespace containing arguments.
+    """
+    desc = 'Import-time benchmark & regression budget for the small bin scripts.'
+    epi = """DESCRIPTION:
+    Runs each script with `python -X importtime <script> --help`, which imports
+    everything the script imports at startup, and reports the median import time
+    (excluding the interpreter startup, i.e., `python -X importtime -c pass`)
+    and wall time over --repeat runs.
+
+    The benchmark fails (exit code 1) if a script exceeds --budget-ms of import time,
+    or imports any of the --forbid modules at startup (these must be imported lazily,
+    only where needed).
+
+    Example:
+    bench-import-time.py
+    bench-import-time.py --scripts csv-merge.py star-summary.py --budget-ms 50 --repeat 10
+    """
+    parser = argparse.ArgumentParser(description=desc, epilog=epi, formatter_class=CustomFormatter)
+    parser.add_argument('--scripts', type=str, nargs='+',
+                        default=['format-star-params.py', 'upload-final-star-params.py', 'csv-merge.py', 'star-summary.py'],
+                        help='Scripts (in --bin-dir) to benchmark.')
+    parser.add_argument('--bin-dir', type=str,
+                        default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin'),
+                        help='Directory of the pipeline scripts.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timed runs per script.')
+    parser.add_argument('--budget-ms', type=float, default=100,
+                        help='Max median import time (ms) per script.')
+    parser.add_argument('--forbid', type=str, nargs='+',
+                        default=['pandas', 'numpy', 'psycopg2', 'google.cloud'],
+                        help='Modules (incl. submodules) that must not be imported at startup.')
+    return parser.parse_args()
+
+def time_ms() -> float:
+    """
+    Monotonic time in ms.
+    """
+    return perf_counter() * 1000
+
+def run_importtime(cmd: List[str]) -> Tuple[float, float, Set[str]]:
+    """
+    Run a command with `-X importtime`.
+    Args:
+        cmd: Arguments after `python -X importtime`
+    Returns:
+        (import time [ms] of the top-level imports, wall time [ms], imported module names)
+    """
+    start = time_ms()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + cmd,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    wall = time_ms() - start
+    total_us,modules = 0,set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _,cumulative,name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        # top-level imports only (nested imports are included in the cumulative time)
+        if not name.startswith('  '):
+            total_us += int(cumulative)
+    return total_us / 1000, wall, modules
+
+def is_forbidden(module: str, forbid: List[str]) -> bool:
+    """
+    Whether a module is (a submodule of) a forbidden module.
+    """
+    return any(module == x or module.startswith(x + '.') for x in forbid)
+
+def main(args: argparse.Namespace) -> int:
+    # interpreter startup baseline
+    baseline = statistics.median(run_importtime(['-c', 'pass'])[0] for _ in range(args.repeat))
+    print(f"Interpreter startup imports: {baseline:.1f} ms")
+
+    # benchmark scripts
+    failed = []
+    print(f"{'script':<32} {'import_ms':>10} {'wall_ms':>10} {'budget_ms':>10}  status")
+    for script in args.scripts:
+        path = os.path.join(args.bin_dir, script)
+        runs = [run_importtime([path, '--help']) for _ in range(args.repeat)]
+        import_ms = statistics.median(x[0] for x in runs) - baseline
+        wall_ms = statistics.median(x[1] for x in runs)
+        forbidden = sorted({m for x in runs for m in x[2] if is_forbidden(m, args.forbid)})
+        status = []
+        if import_ms > args.budget_ms:
+            status.append('over budget')
+        if forbidden:
+            status.append('imports ' + ', '.join(forbidden[:5]))
+        if status:
+            failed.append(script)
+        print(f"{script:<32} {import_ms:>10.1f} {wall_ms:>10.1f} {args.budget_ms:>10.0f}  {'; '.join(status) or 'ok'}")
+
+    if failed:
+        print(f"FAILED: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
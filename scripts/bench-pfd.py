@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+
+
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter): pass
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command-line arguments.
+    Returns:
+        argparse.Namespace containing arguments.
+    """
+    desc = 'Benchmark parallel-fastq-dump.py chunk scheduling with fake sra-tools.'
+    epi = """DESCRIPTION:
+    Runs parallel-fastq-dump.py against fake-sra-tools.py (fastq-dump/sra-stat stand-ins
+    with variable latency) for each --chunks-per-thread value, and reports wall time
+    and the md5 of each output file. `--chunks-per-thread 1` is one block per thread
+    (the previous static split). The md5 values should be identical across runs.
+    Set FAKE_SRA_* env variables to change the fake data (see fake-sra-tools.py -h).
+
+    Example:
+    bench-pfd.py --threads 4 --chunks-per-thread 1 4 16
+    """
+    parser = argparse.ArgumentParser(description=desc, epilog=epi, formatter_class=CustomFormatter)
+    parser.add_argument('--threads', type=int, default=4,
+                        help='Number of threads for parallel-fastq-dump.')
+    parser.add_argument('--chunks-per-thread', type=int, nargs='+', default=[1, 4, 16],
+                        help='Chunks-per-thread values to benchmark.')
+    parser.add_argument('--min-chunk-spots', type=int, default=1000,
+                        help='Minimum number of spots per chunk.')
+    parser.add_argument('--accession', type=str, default='SRR0000001',
+                        help='Fake accession.')
+    return parser.parse_args()
+
+def md5sum(path: str) -> str:
+    """
+    Get the md5 checksum of a file.
+    Args:
+        path: File path
+    Returns:
+        md5 hex digest
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as inF:
+        for block in iter(lambda: inF.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+def main(args: argparse.Namespace) -> None:
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    pfd = os.path.join(os.path.dirname(script_dir), "bin", "parallel-fastq-dump.py")
+    with tempfile.TemporaryDirectory(prefix="bench-pfd_") as tmp_dir:
+        # fake sra-tools on the PATH
+        bin_dir = os.path.join(tmp_dir, "bin")
+        os.makedirs(bin_dir)
+        for prog in ["fastq-dump", "sra-stat"]:
+            os.symlink(os.path.join(script_dir, "fake-sra-tools.py"), os.path.join(bin_dir, prog))
+        env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ["PATH"])
+
+        print("chunks_per_thread\tseconds\tfile\tmd5", file=sys.stdout)
+        for chunks_per_thread in args.chunks_per_thread:
+            outdir = os.path.join(tmp_dir, f"out_{chunks_per_thread}")
+            cmd = [
+                sys.executable, pfd, "--sra-id", args.accession, "--threads", str(args.threads),
+                "--outdir", outdir, "--tmpdir", tmp_dir,
+                "--chunks-per-thread", str(chunks_per_thread),
+                "--min-chunk-spots", str(args.min_chunk_spots), "--split-files"
+            ]
+            start = time.perf_counter()
+            subprocess.run(cmd, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - start
+            for fo in sorted(os.listdir(outdir)):
+                md5 = md5sum(os.path.join(outdir, fo))
+                print(f"{chunks_per_thread}\t{elapsed:.2f}\t{fo}\t{md5}", file=sys.stdout)
+            shutil.rmtree(outdir)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import sys
+import timeit
+import argparse
+import numpy as np
+import pandas as pd
+from db_utils import sanitize_int_columns
+
+
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter): pass
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command-line arguments.
+    Returns:
+        argparse.Namespace containing arguments.
+    """
+    desc = 'Micro-benchmark for db_utils.sanitize_int_columns.'
+    epi = """DESCRIPTION:
+    Compares the per-column float round-trip sanitizer (previous implementation)
+    with the current vectorized sanitizer on synthetic screcounter_star_results-like tables.
+
+    Example:
+    PYTHONPATH=bin bench-sanitize-int.py --rows 5 1000 100000
+    """
+    parser = argparse.ArgumentParser(description=desc, epilog=epi, formatter_class=CustomFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[5, 1000, 100000],
+                        help='Table sizes (rows) to benchmark.')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Number of timed repeats per table size.')
+    return parser.parse_args()
+
+# STAR summary columns, as written by star-summary.py
+INT_COLS = [
+    "estimated_number_of_cells", "number_of_reads", "umis_in_cells",
+    "mean_gene_per_cell", "median_gene_per_cell", "total_feature_detected",
+    "mean_umi_per_cell", "median_umi_per_cell",
+]
+FLOAT_COLS = [
+    "fraction_of_unique_reads_in_cells", "reads_mapped_to_genome__unique",
+    "reads_mapped_to_genome__unique_multiple", "reads_mapped_to_feature__unique_feature",
+    "reads_mapped_to_feature__unique_multiple_feature", "reads_with_valid_barcodes",
+    "sequencing_saturation", "q30_bases_in_cb_umi", "q30_bases_in_rna_read",
+]
+
+def make_table(num_rows: int, seed: int=0) -> pd.DataFrame:
+    """
+    Create a synthetic screcounter_star_results table, with ~1% out-of-range integers.
+    Args:
+        num_rows: Number of rows
+        seed: Random seed
+    Returns:
+        DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "sample": [f"SRX{i // 5:08d}" for i in range(num_rows)],
+        "feature": [f"feature_{i % 5}" for i in range(num_rows)],
+    })
+    for col in INT_COLS:
+        values = rng.integers(0, 2**29, num_rows)
+        values[rng.random(num_rows) < 0.01] = 2**40
+        df[col] = values
+    for col in FLOAT_COLS:
+        df[col] = rng.random(num_rows)
+    return df
+
+def sanitize_int_columns_float(df, min_int=-2**30, max_int=2**30 - 1) -> pd.DataFrame:
+    """
+    Previous implementation: per-column float cast and two masked assignments.
+    """
+    int_cols = df.select_dtypes(include=["int", "int32", "int64"]).columns
+    for col in int_cols:
+        df[col] = df[col].astype(float)
+        df.loc[df[col] < min_int, col] = np.nan
+        df.loc[df[col] > max_int, col] = np.nan
+    return df
+
+def main(args: argparse.Namespace) -> None:
+    print("rows\tmethod\tmsec_per_call", file=sys.stdout)
+    for num_rows in args.rows:
+        df = make_table(num_rows)
+        # previous implementation operated on a full copy
+        methods = {
+            "float_roundtrip": lambda: sanitize_int_columns_float(df.copy()),
+            "vectorized": lambda: sanitize_int_columns(df.reindex(columns=df.columns)),
+        }
+        for method,func in methods.items():
+            elapsed = min(timeit.repeat(func, number=1, repeat=args.repeat))
+            print(f"{num_rows}\t{method}\t{elapsed * 1000:.3f}", file=sys.stdout)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
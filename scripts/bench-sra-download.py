@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import signal
+import socket
+import json
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from urllib.request import urlopen
+
+
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter): pass
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command-line arguments.
+    Returns:
+        argparse.Namespace containing arguments.
+    """
+    desc = 'Test/benchmark the resumable SRA downloader against fake-sra-http.py.'
+    epi = """DESCRIPTION:
+    Starts fake-sra-http.py (which injects truncated responses & HTTP errors), then:
+    1) starts a download (sra_download.download_sra) & kills it after --kill-after seconds,
+    2) resumes the download, and checks that the file md5 matches the served file.
+    Reports the wall time of each step, and the number of ranges reused on resume.
+
+    Example:
+    bench-sra-download.py --size-mb 512 --truncate-prob 0.3 --kill-after 2
+    """
+    parser = argparse.ArgumentParser(description=desc, epilog=epi, formatter_class=CustomFormatter)
+    parser.add_argument('--size-mb', type=float, default=256,
+                        help='Size (MB) of the fake SRA file.')
+    parser.add_argument('--truncate-prob', type=float, default=0.2,
+                        help='Probability that a response body is truncated.')
+    parser.add_argument('--error-prob', type=float, default=0.05,
+                        help='Probability that a request fails with HTTP 503.')
+    parser.add_argument('--kill-after', type=float, default=1.0,
+                        help='Seconds after which the first download is killed; 0 = not killed.')
+    parser.add_argument('--jobs', type=int, default=4,
+                        help='Number of concurrent range requests.')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='Port of the fake server.')
+    parser.add_argument('--accession', type=str, default='SRR0000001',
+                        help='Fake accession.')
+    return parser.parse_args()
+
+def md5sum(path: str) -> str:
+    """
+    Get the md5 checksum of a file.
+    Args:
+        path: File path
+    Returns:
+        md5 hex digest
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as inF:
+        for block in iter(lambda: inF.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+def main(args: argparse.Namespace) -> None:
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    bin_dir = os.path.join(os.path.dirname(script_dir), "bin")
+    server = subprocess.Popen([
+        sys.executable, os.path.join(script_dir, "fake-sra-http.py"), "--port", str(args.port),
+        "--size-mb", str(args.size_mb), "--truncate-prob", str(args.truncate_prob),
+        "--error-prob", str(args.error_prob)
+    ], stderr=subprocess.DEVNULL)
+    # wait for the server
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", args.port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    env = dict(
+        os.environ, PYTHONPATH=bin_dir,
+        SCRECOUNTER_SDL_URL=f"http://127.0.0.1:{args.port}/sdl/2/retrieve"
+    )
+    code = (
+        "import sys, logging; from sra_download import download_sra; "
+        "logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s'); "
+        f"print(download_sra('{args.accession}', sys.argv[1], jobs={args.jobs})[0])"
+    )
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench-sra-download_") as tmp_dir:
+            print("step\tseconds\tresult", file=sys.stdout)
+            # 1) interrupted download
+            if args.kill_after > 0:
+                start = time.perf_counter()
+                proc = subprocess.Popen([sys.executable, "-c", code, tmp_dir], env=env, stderr=subprocess.DEVNULL)
+                try:
+                    proc.wait(timeout=args.kill_after)
+                except subprocess.TimeoutExpired:
+                    proc.send_signal(signal.SIGKILL)
+                    proc.wait()
+                print(f"interrupted\t{time.perf_counter() - start:.2f}\texit={proc.returncode}", file=sys.stdout)
+            # 2) resumed download
+            start = time.perf_counter()
+            out = subprocess.run(
+                [sys.executable, "-c", code, tmp_dir], env=env, check=True,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            elapsed = time.perf_counter() - start
+            resumed = [x for x in out.stderr.decode().split("\n") if "resuming with" in x]
+            print(f"resumed\t{elapsed:.2f}\t{resumed[0].split('; ')[-1] if resumed else ''}", file=sys.stdout)
+            # 3) md5 check
+            dest = out.stdout.decode().strip()
+            with urlopen(env["SCRECOUNTER_SDL_URL"], data=f"acc={args.accession}".encode()) as resp:
+                expected = json.load(resp)["result"][0]["files"][0]["md5"]
+            observed = md5sum(dest)
+            status = "OK" if observed == expected else f"MISMATCH ({observed} != {expected})"
+            print(f"md5\t-\t{status}", file=sys.stdout)
+            if observed != expected:
+                sys.exit(1)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -6,7 +6,9 @@ from typing import Tuple, List, Dict
 from datetime import datetime
 import pandas as pd
 from google.cloud import storage
-from db_utils import db_connect, db_update
+from db_utils import get_conn, db_update
+from star_summary import parse_summary
+from table_utils import to_number
 
 
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
@@ -110,16 +112,16 @@ def find_summary_files(
 def read_and_merge_summary_files(
     bucket: storage.bucket.Bucket,
     file_paths: List[str]
-) -> List[pd.DataFrame]:
+) -> List[Dict]:
     """
-    Read multiple Summary.csv files into dataframes and merge them.
+    Read multiple Summary.csv files (see star_summary.parse_summary) into records.
 
     Args:
         bucket: The GCS bucket object.
         file_paths: A list of blob paths for Summary.csv files.
 
     Returns:
-        A merged pandas DataFrame of all summary data.
+        A list of records (reads with valid barcodes, feature & sample) of all summary data.
     """
     rename_idx = {
         "Gene": "gene",
@@ -129,25 +131,24 @@ def read_and_merge_summary_files(
         "Velocyto": "velocyto" 
     }
 
-    dfs = []
+    records = []
     for path in file_paths:
         # read CSV file from GCS
         blob = bucket.blob(path)
-        data_str = blob.download_as_text()
-        df = pd.read_csv(pd.io.common.StringIO(data_str))
+        metrics = parse_summary(blob.download_as_text())
         # format
-        df.columns = ["Category", "Value"]
-        df = df[df["Category"] == "Reads With Valid Barcodes"]
-        df = df.set_index("Category").transpose()
+        if "Reads With Valid Barcodes" not in metrics:
+            continue
         ## add file path info
         p = os.path.dirname(path)
-        df["feature"] = rename_idx[os.path.basename(p)]
-        df["sample"] = os.path.basename(os.path.dirname(p))
-        # add to list 
-        dfs.append(df)
+        records.append({
+            "reads_with_valid_barcodes": to_number(metrics["Reads With Valid Barcodes"]),
+            "feature": rename_idx[os.path.basename(p)],
+            "sample": os.path.basename(os.path.dirname(p))
+        })
 
-    print("No. of tables: ", len(dfs), file=sys.stderr)
-    return dfs
+    print("No. of tables: ", len(records), file=sys.stderr)
+    return records
 
 def main(args: argparse.Namespace) -> None:
     """
@@ -183,21 +184,18 @@ def main(args: argparse.Namespace) -> None:
         summary_paths = find_summary_files(bucket, directory)
         if summary_paths:
             merged_df += read_and_merge_summary_files(bucket, summary_paths)
-    # concat all dataframes
-    merged_df = pd.concat(merged_df, ignore_index=True).rename(
-            columns={"Reads With Valid Barcodes": "reads_with_valid_barcodes"}
-    )
 
     # check if any valid data was found
-    if merged_df is None:
+    if not merged_df:
         print("No valid data found.", file=sys.stderr)
         return None
     else:
+        merged_df = pd.DataFrame(merged_df)
         print(f"No. of records found: {merged_df.shape[0]}", file=sys.stderr)
 
     # Upsert data into database
     print("Updating data...", file=sys.stderr)
-    with db_connect() as conn:
+    with get_conn() as conn:
         db_update(merged_df,  "screcounter_star_results", conn)
 
 
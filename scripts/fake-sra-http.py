@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import random
+import hashlib
+import argparse
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter): pass
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command-line arguments.
+    Returns:
+        argparse.Namespace containing arguments.
+    """
+    desc = 'Local HTTP stand-in for SRA downloads, with injected failures.'
+    epi = """DESCRIPTION:
+    Serves synthetic "SRA files" (deterministic random bytes per accession) with
+    HTTP range requests, plus an SRA data locator (SDL) endpoint, so that
+    sra_download.py (and prefetch.py with SCRECOUNTER_RESUMABLE_DOWNLOAD=true)
+    can be tested without network access:
+
+      fake-sra-http.py --port 8765 &
+      SCRECOUNTER_SDL_URL=http://127.0.0.1:8765/sdl/2/retrieve prefetch.py ...
+
+    Endpoints:
+      POST /sdl/2/retrieve   (form: acc=<accession>) => json with the file URL, size & md5
+      GET  /sra/<accession>  => file (Range requests supported)
+
+    Failures are injected per GET request: a truncated body (the connection is
+    closed part-way through the requested range), or an HTTP 503 error.
+
+    Example:
+    fake-sra-http.py --size-mb 256 --truncate-prob 0.3 --error-prob 0.1
+    """
+    parser = argparse.ArgumentParser(description=desc, epilog=epi, formatter_class=CustomFormatter)
+    parser.add_argument('--port', type=int, default=8765,
+                        help='Port to listen on (127.0.0.1).')
+    parser.add_argument('--size-mb', type=float, default=256,
+                        help='Size (MB) of each file.')
+    parser.add_argument('--truncate-prob', type=float, default=0.2,
+                        help='Probability that a response body is truncated.')
+    parser.add_argument('--error-prob', type=float, default=0.05,
+                        help='Probability that a request fails with HTTP 503.')
+    parser.add_argument('--bad-md5', action='store_true', default=False,
+                        help='Report a wrong md5 via the SDL endpoint.')
+    return parser.parse_args()
+
+def make_data(accession: str, size: int) -> bytes:
+    """
+    Create the deterministic content of a fake SRA file.
+    Args:
+        accession: SRA accession
+        size: Size (bytes)
+    Returns:
+        File content
+    """
+    block = 1 << 20
+    return b"".join(
+        random.Random(f"{accession}:{i}").randbytes(min(block, size - i)) for i in range(0, size, block)
+    )
+
+class Handler(BaseHTTPRequestHandler):
+    files = {}
+    md5s = {}
+    args = None
+
+    def log_message(self, fmt: str, *args) -> None:
+        print(f"fake-sra-http: {fmt % args}", file=sys.stderr)
+
+    def get_file(self, accession: str) -> bytes:
+        if accession not in self.files:
+            self.files[accession] = make_data(accession, int(self.args.size_mb * 1e6))
+            self.md5s[accession] = hashlib.md5(self.files[accession]).hexdigest()
+        return self.files[accession]
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        accession = form.get("acc", [""])[0]
+        data = self.get_file(accession)
+        md5 = "0" * 32 if self.args.bad_md5 else self.md5s[accession]
+        link = f"http://{self.headers['Host']}/sra/{accession}"
+        body = json.dumps({"version": "2", "result": [{
+            "bundle": accession, "status": 200, "msg": "ok",
+            "files": [{"object": f"srapub|{accession}", "type": "sra", "name": accession,
+                       "size": len(data), "md5": md5,
+                       "locations": [{"service": "fake", "region": "local", "link": link}]}]
+        }]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if not self.path.startswith("/sra/"):
+            self.send_error(404)
+            return
+        data = self.get_file(self.path.split("/")[-1])
+        if random.random() < self.args.error_prob:
+            self.send_error(503)
+            return
+        start, end = 0, len(data) - 1
+        rng = self.headers.get("Range")
+        if rng:
+            first, last = rng.split("=")[1].split("-")
+            start, end = int(first), min(int(last or end), end)
+        self.send_response(206 if rng else 200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if rng:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.end_headers()
+        # truncate the body part-way through
+        if random.random() < self.args.truncate_prob:
+            end = start + random.randrange(0, end - start + 1) - 1
+            self.close_connection = True
+        self.wfile.write(data[start:end + 1])
+
+
+def main(args: argparse.Namespace) -> None:
+    Handler.args = args
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(f"fake-sra-http: listening on http://127.0.0.1:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
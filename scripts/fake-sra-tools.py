@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+
+
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter): pass
+
+desc = 'Fake sra-tools (fastq-dump, sra-stat) for benchmarking.'
+epi = """DESCRIPTION:
+Stands in for `fastq-dump`, `fasterq-dump` (--split-spot --stdout only) and `sra-stat`,
+based on the name it is called by, so that parallel-fastq-dump.py, fq-stream.py
+and sra-stat.py can be benchmarked without network access.
+Symlink it into a directory on the PATH:
+
+  mkdir -p /tmp/fake-bin
+  ln -sf $PWD/scripts/fake-sra-tools.py /tmp/fake-bin/fastq-dump
+  ln -sf $PWD/scripts/fake-sra-tools.py /tmp/fake-bin/sra-stat
+  PATH=/tmp/fake-bin:$PATH parallel-fastq-dump.py -s SRR0000001 -t 4 --split-files
+
+fastq-dump writes synthetic reads (deterministic per spot ID, so the output
+does not depend on how the spot range is split), after a random latency
+that is proportional to the number of spots. Behavior is set via env variables:
+
+  FAKE_SRA_SPOTS         Number of spots reported by sra-stat
+  FAKE_SRA_READ_LENGTHS  Comma-separated read lengths per spot (one file per read)
+  FAKE_SRA_SEC_PER_MSPOT Mean latency per 1M spots (seconds)
+  FAKE_SRA_SLOW_PROB     Probability that a call is slow (stall)
+  FAKE_SRA_SLOW_FACTOR   Latency multiplier of slow calls
+  FAKE_SRA_FAIL_PROB     Probability that a call exits non-zero
+"""
+
+SPOTS = int(os.getenv("FAKE_SRA_SPOTS", 1000000))
+READ_LENGTHS = [int(x) for x in os.getenv("FAKE_SRA_READ_LENGTHS", "28,90").split(",")]
+SEC_PER_MSPOT = float(os.getenv("FAKE_SRA_SEC_PER_MSPOT", 4.0))
+SLOW_PROB = float(os.getenv("FAKE_SRA_SLOW_PROB", 0.1))
+SLOW_FACTOR = float(os.getenv("FAKE_SRA_SLOW_FACTOR", 5.0))
+FAIL_PROB = float(os.getenv("FAKE_SRA_FAIL_PROB", 0.0))
+
+def sra_stat(argv: list) -> None:
+    """
+    Write `sra-stat --meta --quick` or `sra-stat --xml --quick` style output.
+    Args:
+        argv: Command-line arguments
+    """
+    accession = [x for x in argv if not x.startswith("-")][-1]
+    time.sleep(random.uniform(0, 2 * SEC_PER_MSPOT / 1e3))
+    if random.random() < FAIL_PROB:
+        print(f"sra-stat (fake) failed: {accession}", file=sys.stderr)
+        sys.exit(3)
+    bases = SPOTS * sum(READ_LENGTHS)
+    if "--xml" in argv:
+        reads = "".join(
+            f'<Read index="{i}" count="{SPOTS}" average="{x:.2f}" stdev="0.00"/>' for i,x in enumerate(READ_LENGTHS)
+        )
+        print(f'<Run accession="{accession}" spot_count="{SPOTS}" base_count="{bases}">'
+              f'<Member member_name="default" spot_count="{SPOTS}" base_count="{bases}"/>'
+              f'<Size value="{bases // 4}" units="bytes"/>'
+              f'<Statistics nreads="{len(READ_LENGTHS)}" nspots="{SPOTS}">{reads}</Statistics></Run>')
+    else:
+        print(f"{accession}|default|{SPOTS}:{bases}|:|:|:")
+
+def fastq_dump(argv: list) -> None:
+    """
+    Write synthetic reads for a range of spots, `fastq-dump -N -X -O --split-files` style.
+    Args:
+        argv: Command-line arguments
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-N", "--minSpotId", type=int, default=1)
+    parser.add_argument("-X", "--maxSpotId", type=int, default=SPOTS)
+    parser.add_argument("-O", "--outdir", type=str, default=".")
+    parser.add_argument("-V", "--version", action="store_true", default=False)
+    args, extra = parser.parse_known_args(argv)
+    if args.version:
+        print("fastq-dump : 0.0.0 (fake)")
+        return
+    accession = [x for x in extra if not x.startswith("-")][-1]
+    spots = range(args.minSpotId, min(args.maxSpotId, SPOTS) + 1)
+
+    # latency
+    latency = SEC_PER_MSPOT * len(spots) / 1e6 * random.uniform(0.5, 1.5)
+    if random.random() < SLOW_PROB:
+        latency *= SLOW_FACTOR
+    time.sleep(latency)
+    if random.random() < FAIL_PROB:
+        print(f"fastq-dump (fake) failed: {accession}", file=sys.stderr)
+        sys.exit(3)
+
+    # reads
+    os.makedirs(args.outdir, exist_ok=True)
+    for i,read_len in enumerate(READ_LENGTHS, 1):
+        outfile = os.path.join(args.outdir, f"{accession}_{i}.fastq")
+        with open(outfile, "w") as outF:
+            for spot in spots:
+                seq = make_seq(spot, i, read_len)
+                outF.write(f"@{accession}.{spot} {spot} length={read_len}\n{seq}\n+{accession}.{spot} {spot} length={read_len}\n{'F' * read_len}\n")
+    print(f"Read {len(spots)} spots for {accession}", file=sys.stderr)
+    print(f"Written {len(spots)} spots for {accession}", file=sys.stderr)
+
+def fasterq_dump(argv: list) -> None:
+    """
+    Write synthetic reads for all spots to stdout, `fasterq-dump --split-spot --stdout` style.
+    Args:
+        argv: Command-line arguments
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--seq-defline", type=str, default="@$ac.$si $sn length=$rl")
+    parser.add_argument("--qual-defline", type=str, default="+$ac.$si $sn length=$rl")
+    args, extra = parser.parse_known_args(argv)
+    accession = os.path.basename([x for x in extra if not x.startswith("-")][-1])
+    time.sleep(SEC_PER_MSPOT * SPOTS / 1e6 * random.uniform(0.5, 1.5))
+
+    def defline(fmt: str, spot: int, read: int, read_len: int) -> str:
+        for k,v in [("$ac", accession), ("$si", spot), ("$sn", spot), ("$ri", read), ("$rl", read_len)]:
+            fmt = fmt.replace(k, str(v))
+        return fmt
+
+    out = sys.stdout
+    for spot in range(1, SPOTS + 1):
+        for i,read_len in enumerate(READ_LENGTHS, 1):
+            seq = make_seq(spot, i, read_len)
+            out.write(f"{defline(args.seq_defline, spot, i, read_len)}\n{seq}\n{defline(args.qual_defline, spot, i, read_len)}\n{'F' * read_len}\n")
+    if random.random() < FAIL_PROB:
+        print(f"fasterq-dump (fake) failed: {accession}", file=sys.stderr)
+        sys.exit(3)
+
+def make_seq(spot: int, read: int, read_len: int) -> str:
+    """
+    Create a deterministic, pseudo-random sequence for a read.
+    Args:
+        spot: Spot ID
+        read: Read number within the spot
+        read_len: Read length
+    Returns:
+        Sequence
+    """
+    digest = hashlib.blake2b(f"{spot}:{read}".encode(), digest_size=32).digest()
+    seq = "".join("ACGT"[b & 3] + "ACGT"[(b >> 2) & 3] + "ACGT"[(b >> 4) & 3] + "ACGT"[b >> 6] for b in digest)
+    return (seq * (read_len // len(seq) + 1))[:read_len]
+
+def main() -> None:
+    prog = os.path.basename(sys.argv[0])
+    if prog.startswith("sra-stat"):
+        sra_stat(sys.argv[1:])
+    elif prog.startswith("fastq-dump"):
+        fastq_dump(sys.argv[1:])
+    elif prog.startswith("fasterq-dump"):
+        fasterq_dump(sys.argv[1:])
+    else:
+        argparse.ArgumentParser(description=desc, epilog=epi, formatter_class=CustomFormatter).print_help()
+
+
+if __name__ == "__main__":
+    main()
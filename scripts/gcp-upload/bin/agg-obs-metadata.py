@@ -11,7 +11,7 @@ from typing import List, Set, Tuple, Optional
 import pandas as pd
 from pypika import Query, Table, Criterion
 ## package
-from db_utils import db_connect
+from db_utils import get_conn
 
 # format logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
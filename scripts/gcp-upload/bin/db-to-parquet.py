@@ -11,7 +11,7 @@ from typing import List, Set, Tuple, Optional
 import pandas as pd
 from pypika import Query, Table, Criterion
 ## package
-from db_utils import db_connect
+from db_utils import get_conn
 
 # format logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
@@ -55,7 +55,7 @@ def load_scbasecamp_metadata(feature_type: str) -> pd.DataFrame:
         .select("*")
         .where(srx_metadata.feature_type == feature_type)
     )
-    with db_connect() as conn:
+    with get_conn() as conn:
         metadata = pd.read_sql(str(stmt), conn)
     return metadata.drop(columns=['created_at', 'updated_at'])
     
@@ -1,16 +1,23 @@
 # import
 ## batteries
+from __future__ import annotations
 import os
+import re
+import sys
+import time
+import atexit
 import logging
 import warnings
-from typing import List
-## 3rd party
-import numpy as np
-import psycopg2
-import pandas as pd
-from psycopg2.extras import execute_values
-from psycopg2.extensions import connection
+import json
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, List, Dict, Tuple, Iterator, Optional
 from tempfile import NamedTemporaryFile
+## 3rd party: imported where needed, since pandas, numpy & psycopg2
+## dominate the startup time of the small pipeline scripts
+if TYPE_CHECKING:
+    import pandas as pd
+    from psycopg2.extensions import connection
 
 # Suppress notifications
 warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy connectable")
@@ -19,31 +26,220 @@ logging.getLogger("google.auth.transport.requests").setLevel(logging.CRITICAL)
 logging.getLogger("urllib3").setLevel(logging.CRITICAL)
 logging.getLogger("google.auth").setLevel(logging.CRITICAL)
 
+# process-wide caches
+## time (seconds) before cached secrets & certs are re-fetched from Secret Manager
+SECRET_TTL = int(os.getenv("SCRECOUNTER_SECRET_TTL", 3600))
+## max number of pooled connections per process
+POOL_MAX_CONN = int(os.getenv("SCRECOUNTER_DB_POOL_SIZE", 4))
+_SECRET_CACHE: Dict[str, Tuple[float, str]] = {}
+_CERT_CACHE: Dict[str, Tuple[float, str]] = {}
+_CERT_FILES: List[str] = []
+_POOL: Optional[ConnectionPool] = None
+_POOL_PID: Optional[int] = None
+_POOL_CREATED: float = 0.0
+_RETIRED_POOLS: List[ConnectionPool] = []
+_LOCK = threading.RLock()
+_ADAPTED: List[str] = []
+## optional JSON file for persisting table schemas across (short-lived) processes
+SCHEMA_CACHE_FILE = os.getenv("SCRECOUNTER_SCHEMA_CACHE", "")
+_SCHEMA_CACHE: Dict[str, Dict[str, dict]] = {}
+_SCHEMA_CACHE_LOADED = False
+## DataFrames with at least this many rows are upserted via COPY (see `db_bulk_upsert`)
+BULK_UPSERT_MIN_ROWS = int(os.getenv("SCRECOUNTER_BULK_UPSERT_MIN_ROWS", 5000))
+## bytes per read of the COPY input (`copy_expert` reads 8 KB at a time by default)
+COPY_READ_SIZE = 1 << 20
+
 # functions
-def db_connect() -> connection:
+def register_adapters() -> None:
     """
-    Connect to the sql database using SSL certificates.
+    Adapt numpy/pandas scalars (e.g., from integer & nullable integer columns) for psycopg2.
+    Only the libraries already imported are adapted, since their scalars cannot occur otherwise.
+    """
+    from psycopg2.extensions import register_adapter, AsIs
+    with _LOCK:
+        if "numpy" in sys.modules and "numpy" not in _ADAPTED:
+            import numpy as np
+            for int_type in (np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64):
+                register_adapter(int_type, AsIs)
+            register_adapter(np.bool_, lambda x: AsIs(bool(x)))
+            _ADAPTED.append("numpy")
+        if "pandas" in sys.modules and "pandas" not in _ADAPTED:
+            import pandas as pd
+            register_adapter(type(pd.NA), lambda x: AsIs("NULL"))
+            _ADAPTED.append("pandas")
+
+def db_params() -> dict:
+    """
+    Get the connection parameters for the sql database.
+    SSL certificates and the password are cached per process (see `SECRET_TTL`).
+    Set GCP_SQL_DB_SSLMODE=disable (and GCP_SQL_DB_PASSWORD) to connect 
+    to a local PostgreSQL instance without fetching any secrets.
+    Returns:
+        Keyword arguments for `psycopg2.connect`
     """
-    # get certs
-    certs = get_db_certs()
-    # connect
-    db_params = {
+    params = {
         'host': os.environ["GCP_SQL_DB_HOST"],
         'database': os.environ["GCP_SQL_DB_NAME"],
         'user': os.environ["GCP_SQL_DB_USERNAME"],
-        'password': os.getenv("GCP_SQL_DB_PASSWORD", get_secret("GCP_SQL_DB_PASSWORD")),
-        'sslmode': 'verify-ca',
-        'sslrootcert': certs["server-ca.pem"],
-        'sslcert': certs["client-cert.pem"],
-        'sslkey': certs["client-key.pem"],
-        'port': '5432',
+        'password': os.getenv("GCP_SQL_DB_PASSWORD") or get_secret("GCP_SQL_DB_PASSWORD"),
+        'sslmode': os.getenv("GCP_SQL_DB_SSLMODE", "verify-ca"),
+        'port': os.getenv("GCP_SQL_DB_PORT", "5432"),
         'connect_timeout': 30
     }
-    conn = psycopg2.connect(**db_params)
-    # delete certs
-    for cert in certs.values():
-        os.remove(cert)
-    return conn
+    if params['sslmode'] != 'disable':
+        certs = get_db_certs()
+        params['sslrootcert'] = certs["server-ca.pem"]
+        params['sslcert'] = certs["client-cert.pem"]
+        params['sslkey'] = certs["client-key.pem"]
+    return params
+
+def db_connect() -> connection:
+    """
+    Connect to the sql database using SSL certificates.
+    The connection is not pooled; use `get_conn()` to reuse connections within a process.
+    """
+    import psycopg2
+    register_adapters()
+    return psycopg2.connect(**db_params())
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections (wraps psycopg2's `ThreadedConnectionPool`).
+    Connections are opened lazily, and up to `maxconn` idle connections are kept for reuse
+    (psycopg2 closes returned connections beyond `minconn`). Borrowers block while all
+    connections are in use, instead of getting a `PoolError`.
+    A retired pool (see `retire()`) is closed once all borrowed connections have been returned.
+    """
+    def __init__(self, maxconn: int, **params) -> None:
+        from psycopg2.pool import ThreadedConnectionPool
+        self._pool = ThreadedConnectionPool(0, maxconn, **params)
+        # minconn=0 on init (no connections opened up front); then keep up to maxconn on putconn
+        self._pool.minconn = maxconn
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self.borrowed = 0
+        self.retired = False
+
+    @property
+    def closed(self) -> bool:
+        return self._pool.closed
+
+    def getconn(self) -> connection:
+        """
+        Borrow a connection; blocks while all connections are in use.
+        Returns:
+            psycopg2 connection object
+        """
+        self._slots.acquire()
+        with self._lock:
+            self.borrowed += 1
+        try:
+            conn = self._pool.getconn()
+            if conn.closed:
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+        except Exception:
+            with self._lock:
+                self.borrowed -= 1
+            self._slots.release()
+            raise
+        return conn
+
+    def putconn(self, conn: connection, close: bool=False) -> None:
+        """
+        Return a borrowed connection.
+        Args:
+            conn: psycopg2 connection object
+            close: Close the connection, instead of keeping it for reuse
+        """
+        try:
+            if self._pool.closed:
+                conn.close()
+            else:
+                self._pool.putconn(conn, close=close)
+        finally:
+            with self._lock:
+                self.borrowed -= 1
+                idle = self.retired and self.borrowed == 0
+            self._slots.release()
+        if idle:
+            self.closeall()
+
+    def retire(self) -> None:
+        """
+        Close the pool now, or once all borrowed connections have been returned.
+        """
+        with self._lock:
+            self.retired = True
+            idle = self.borrowed == 0
+        if idle:
+            self.closeall()
+
+    def closeall(self) -> None:
+        """
+        Close all connections of the pool.
+        """
+        if not self._pool.closed:
+            self._pool.closeall()
+
+def get_pool() -> ConnectionPool:
+    """
+    Get (or create) the process-wide connection pool.
+    The pool is re-created after a fork, since connections cannot be shared across processes,
+    and after `SECRET_TTL` seconds, so that new connections use refreshed credentials.
+    Returns:
+        The connection pool
+    """
+    global _POOL, _POOL_PID, _POOL_CREATED
+    with _LOCK:
+        if _POOL is not None and _POOL_PID == os.getpid() and time.monotonic() - _POOL_CREATED >= SECRET_TTL:
+            # closed once the connections still checked out are returned
+            _POOL.retire()
+            _RETIRED_POOLS[:] = [pool for pool in _RETIRED_POOLS if not pool.closed] + [_POOL]
+            _POOL = None
+        if _POOL is None or _POOL.closed or _POOL_PID != os.getpid():
+            _POOL = ConnectionPool(POOL_MAX_CONN, **db_params())
+            _POOL_PID = os.getpid()
+            _POOL_CREATED = time.monotonic()
+        return _POOL
+
+def close_pool() -> None:
+    """
+    Close all connections in the process-wide connection pool.
+    """
+    global _POOL
+    with _LOCK:
+        if _POOL_PID == os.getpid():
+            for pool in _RETIRED_POOLS + [_POOL]:
+                if pool is not None:
+                    pool.closeall()
+        _RETIRED_POOLS.clear()
+        _POOL = None
+
+@contextmanager
+def get_conn() -> Iterator[connection]:
+    """
+    Borrow a connection from the process-wide pool; blocks while all pooled connections are in use.
+    The transaction is committed on success and rolled back on error;
+    the connection is then returned to the pool (or discarded, if broken).
+    Yields:
+        psycopg2 connection object
+    """
+    pool = get_pool()
+    register_adapters()
+    if pool.closed:
+        # retired (and closed) by another thread since `get_pool()`
+        pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
 
 def add_to_log(
         df, sample: str, accession: str, process: str, step: str, status: str, msg: str
@@ -51,7 +247,7 @@ def add_to_log(
     """
     Add log entry to dataframe.
     Args:
-        log_df: Log dataframe
+        log_df: Log dataframe (or LogSink)
         sample: Sample name
         accession: SRA accession
         process: Process name
@@ -61,31 +257,179 @@ def add_to_log(
     Returns:
         pd.DataFrame: Updated log dataframe
     """
+    if isinstance(df, LogSink):
+        df.add(sample, accession, process, step, status, msg)
+        return df
     if len(msg) > 200:
         msg = str(msg[:(200-3)]) + '...'
     df.loc[len(df)] = [sample, accession, process, step, status, msg]
 
+class LogSink:
+    """
+    Buffered writer of log records for the screcounter_log table.
+    Records are held as tuples and upserted in batches of `batch_size` (and on `flush()`/exit),
+    so the log is written even if the process fails later on.
+    Records can be added from multiple threads.
+    If the database cannot be reached (or `use_db=False`), records are appended to
+    a JSONL spill file, which can be loaded later via `db_load_spill()`.
+    Usage:
+        with LogSink() as log:
+            log.add(sample, accession, process, step, status, msg)
+    """
+    columns = ["sample", "accession", "process", "step", "status", "message"]
+
+    def __init__(
+        self, table_name: str="screcounter_log", batch_size: int=50, 
+        use_db: bool=True, spill_file: Optional[str]=None, max_msg_len: int=200
+        ) -> None:
+        """
+        Args:
+            table_name: Target table
+            batch_size: Number of records to buffer before upserting
+            use_db: Upsert to the database; if False, all records are written to the spill file
+            spill_file: JSONL file for records that could not be upserted
+            max_msg_len: Messages longer than this are truncated
+        """
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.use_db = use_db
+        self.spill_file = spill_file or os.getenv("SCRECOUNTER_LOG_SPILL", "screcounter_log_spill.jsonl")
+        self.max_msg_len = max_msg_len
+        self.records: List[tuple] = []     # all records added
+        self._pending: List[tuple] = []    # records not yet written
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "LogSink":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def add(self, sample: str, accession: str, process: str, step: str, status: str, msg: str) -> None:
+        """
+        Add a log record; upserts the buffer if `batch_size` is reached.
+        Args:
+            sample: Sample name
+            accession: SRA accession
+            process: Process name
+            step: Step name
+            status: Status
+            msg: Message
+        """
+        msg = str(msg)
+        if len(msg) > self.max_msg_len:
+            msg = msg[:(self.max_msg_len-3)] + '...'
+        self.add_record((sample, accession, process, step, status, msg))
+
+    def add_record(self, record: tuple) -> None:
+        """
+        Add a record (values ordered as `columns`); upserts the buffer if `batch_size` is reached.
+        Args:
+            record: Record
+        """
+        with self._lock:
+            self.records.append(record)
+            self._pending.append(record)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write all pending records to the database (or the spill file).
+        """
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        if self.use_db:
+            try:
+                with get_conn() as conn:
+                    db_upsert_rows(rows, self.columns, self.table_name, conn)
+                return
+            except Exception as e:
+                logging.warning(f"Could not write log to {self.table_name}: {str(e)}")
+        self.spill(rows)
+
+    def spill(self, rows: List[tuple]) -> None:
+        """
+        Append records to the JSONL spill file.
+        Args:
+            rows: Records to write
+        """
+        with open(self.spill_file, "a") as outF:
+            for row in rows:
+                record = {"table": self.table_name, **dict(zip(self.columns, row))}
+                outF.write(json.dumps(record) + "\n")
+        logging.info(f"Log records written to: {self.spill_file}")
+
+    def to_df(self) -> pd.DataFrame:
+        """
+        Return all records as a dataframe.
+        """
+        import pandas as pd
+        return pd.DataFrame(self.records, columns=self.columns)
+
+def db_load_spill(spill_file: str, conn: connection) -> int:
+    """
+    Upsert records from a JSONL spill file (see `LogSink`) to the database.
+    Args:
+        spill_file: JSONL file; each record must contain a "table" key
+        conn: psycopg2 connection object
+    Returns:
+        Number of records loaded
+    """
+    tables = {}
+    with open(spill_file) as inF:
+        for line in inF:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            tables.setdefault(record.pop("table"), []).append(record)
+    num_records = 0
+    for table_name, records in tables.items():
+        columns = list(records[0].keys())
+        rows = [tuple(record.get(col) for col in columns) for record in records]
+        db_upsert_rows(rows, columns, table_name, conn)
+        num_records += len(rows)
+    return num_records
+
 def sanitize_int_columns(df, min_int=-2**30, max_int=2**30 - 1) -> pd.DataFrame:
     """
-    Sanitize integer columns in a DataFrame by casting them to float and replacing out-of-range values with NaN.
+    Sanitize integer columns in a DataFrame by replacing out-of-range values with NA.
+    A single range mask is computed across all integer columns; only columns with
+    out-of-range values are replaced, as nullable Int64 columns (no float conversion).
+    The DataFrame is modified in place.
     Args:
         df: pandas DataFrame
         min_int: Minimum integer value
         max_int: Maximum integer value
+    Returns:
+        The sanitized DataFrame
     """
-    int_cols = df.select_dtypes(include=["int", "int32", "int64"]).columns
-    
-    # Cast these columns to float so they can hold NaN values
-    for col in int_cols:
-        df[col] = df[col].astype(float)
-        
-        # Replace out-of-range values with NaN
-        df.loc[df[col] < min_int, col] = np.nan
-        df.loc[df[col] > max_int, col] = np.nan
+    import numpy as np
+    import pandas as pd
+    int_cols = [col for col,dtype in df.dtypes.items() if pd.api.types.is_integer_dtype(dtype)]
+    if not int_cols:
+        return df
+
+    # range mask across all integer columns
+    values = df[int_cols].to_numpy(dtype=np.int64, na_value=0)
+    mask = (values < min_int) | (values > max_int)
+    if not mask.any():
+        return df
+
+    # replace out-of-range values with NA
+    for i in np.flatnonzero(mask.any(axis=0)):
+        col = int_cols[i]
+        df[col] = pd.arrays.IntegerArray(values[:,i], mask[:,i] | df[col].isna().to_numpy())
 
     return df
 
-def db_upsert(df: pd.DataFrame, table_name: str, conn: connection) -> None:
+def db_upsert(df: pd.DataFrame, table_name: str, conn: connection, bulk: Optional[bool]=None) -> None:
     """
     Upload a pandas DataFrame to PostgreSQL, performing an upsert operation.
     If records exist (based on unique constraints), update them; otherwise insert new records.
@@ -93,7 +437,11 @@ def db_upsert(df: pd.DataFrame, table_name: str, conn: connection) -> None:
         df: pandas DataFrame to upload
         table_name: name of the target table
         conn: psycopg2 connection object
+        bulk: Use `db_bulk_upsert` (COPY); if None, used if the DataFrame has >= BULK_UPSERT_MIN_ROWS rows
     """   
+    import pandas as pd
+    from psycopg2.extras import execute_values
+    register_adapters()
     # if df is empty, return
     if df.empty:
         return
@@ -104,32 +452,230 @@ def db_upsert(df: pd.DataFrame, table_name: str, conn: connection) -> None:
         except Exception as e:
             raise Exception(f"Error converting input to DataFrame: {str(e)}")
 
+    # large tables: COPY via a temp table
+    if bulk or (bulk is None and df.shape[0] >= BULK_UPSERT_MIN_ROWS):
+        db_bulk_upsert(df, table_name, conn)
+        return
+
+    # format the DataFrame for the target table
+    df, columns, unique_columns = prepare_upsert_df(df, table_name, conn)
+
+    # Convert DataFrame to list of tuples
+    values = [tuple(x) for x in df.to_numpy()]
+
+    # Create the INSERT statement with ON CONFLICT clause
+    insert_stmt = upsert_stmt(table_name, columns, unique_columns)
+
+    # Execute the query
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, insert_stmt, values)
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise Exception(f"Error uploading data to {table_name}: {str(e)}")
+
+def db_bulk_upsert(df: pd.DataFrame, table_name: str, conn: connection, chunk_rows: int=50000) -> None:
+    """
+    Upload a (large) pandas DataFrame to PostgreSQL, performing an upsert operation.
+    The DataFrame is streamed as CSV via `COPY FROM STDIN` into a temporary table,
+    and then upserted via `INSERT ... SELECT ... ON CONFLICT`, all in one transaction.
+    Args:
+        df: pandas DataFrame to upload
+        table_name: name of the target table
+        conn: psycopg2 connection object
+        chunk_rows: Number of rows serialized to CSV at a time
+    """
+    if df.empty:
+        return
+
+    # format the DataFrame for the target table
+    df, columns, unique_columns = prepare_upsert_df(df, table_name, conn)
+    col_str = ', '.join(columns)
+    # COPY does not cast "1.0" to integer (unlike INSERT): integer columns read as float (NaN) => Int64
+    df = cast_int_columns(df, get_int_columns(table_name, conn))
+    # temp tables cannot be schema-qualified
+    tmp_name = re.sub(r"\W", "_", table_name.split(".")[-1])
+    tmp_table = f"tmp_{tmp_name}_{os.getpid()}"
+
+    # temp table with the same column types, but no constraints or defaults
+    create_stmt = f"CREATE TEMP TABLE {tmp_table} ON COMMIT DROP AS SELECT {col_str} FROM {table_name} WITH NO DATA"
+    copy_stmt = f"COPY {tmp_table} ({col_str}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    insert_stmt = upsert_stmt(table_name, columns, unique_columns, source=f"SELECT {col_str} FROM {tmp_table}")
+
+    # Execute the queries
+    try:
+        with conn.cursor() as cur:
+            cur.execute(create_stmt)
+            cur.copy_expert(copy_stmt, CSVChunkReader(df, chunk_rows), size=COPY_READ_SIZE)
+            cur.execute(insert_stmt)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise Exception(f"Error uploading data to {table_name}: {str(e)}")
+
+def cast_int_columns(df: pd.DataFrame, int_columns: List[str]) -> pd.DataFrame:
+    """
+    Cast float columns of integer table columns to nullable Int64 (rounded; non-finite values => NA),
+    so that they are serialized as integers (e.g., "1" instead of "1.0").
+    Args:
+        df: pandas DataFrame
+        int_columns: Integer columns of the target table
+    Returns:
+        DataFrame (copy, if any column was cast)
+    """
+    import numpy as np
+    import pandas as pd
+    cols = [col for col in int_columns if col in df.columns and pd.api.types.is_float_dtype(df[col])]
+    if not cols:
+        return df
+    df = df.copy()
+    for col in cols:
+        df[col] = df[col].where(np.isfinite(df[col])).round().astype("Int64")
+    return df
+
+class CSVChunkReader:
+    """
+    File-like reader that serializes a DataFrame to CSV lazily, `chunk_rows` rows at a time.
+    Used as the input for `cursor.copy_expert`.
+    """
+    def __init__(self, df: pd.DataFrame, chunk_rows: int=50000) -> None:
+        from io import StringIO
+        self._chunks = (
+            StringIO(df.iloc[i:i + chunk_rows].to_csv(index=False, header=False, na_rep='\\N'))
+            for i in range(0, df.shape[0], chunk_rows)
+        )
+        self._chunk = StringIO()
+
+    def read(self, size: int=-1) -> str:
+        # each chunk is read via its own StringIO (no re-slicing of the remaining chunk per read)
+        if size == 0:
+            return ""
+        parts = []
+        while True:
+            data = self._chunk.read(size)
+            if data:
+                parts.append(data)
+                if size >= 0:
+                    size -= len(data)
+                    if size == 0:
+                        break
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._chunk = chunk
+        return "".join(parts)
+
+    def readline(self, size: int=-1) -> str:
+        return self.read(size)
+
+def prepare_upsert_df(df: pd.DataFrame, table_name: str, conn: connection) -> Tuple[pd.DataFrame, List[str], List[str]]:
+    """
+    Format a DataFrame for upserting into a table.
+    Args:
+        df: pandas DataFrame to upload
+        table_name: name of the target table
+        conn: psycopg2 connection object
+    Returns:
+        (DataFrame, column names, unique constraint column names)
+    """
     # filter to overlapping target columns
-    df = df[list(set(get_table_columns(table_name, conn)).intersection(df.columns))]
+    df = df.reindex(columns=list(set(get_table_columns(table_name, conn)).intersection(df.columns)))
 
     # Sanitize integer columns
-    df = sanitize_int_columns(df.copy())
+    df = sanitize_int_columns(df)
 
-    # Get DataFrame columns
-    columns = list(df.columns)
-    
     # Create ON CONFLICT clause based on unique constraints
     unique_columns = get_unique_columns(table_name, conn)
 
     # Exclude 'id' column from the upsert
-    if "id" in columns:
+    if "id" in df.columns:
         df = df.drop(columns=["id"])
-        columns.remove("id")
 
     # Drop duplicate records based on unique columns
-    df.drop_duplicates(subset=unique_columns, keep='first').copy()
+    subset = [col for col in unique_columns if col in df.columns]
+    if subset:
+        df = df.drop_duplicates(subset=subset, keep='first')
 
-    # Convert DataFrame to list of tuples
-    values = [tuple(x) for x in df.to_numpy()]
+    return df, list(df.columns), unique_columns
 
-    # Create the INSERT statement with ON CONFLICT clause
+def db_upsert_rows(rows: List[tuple], columns: List[str], table_name: str, conn: connection) -> None:
+    """
+    Upsert a list of tuples to PostgreSQL without building a DataFrame.
+    Rows with duplicate unique-constraint values are collapsed (the first row is kept, as `drop_duplicates`).
+    Args:
+        rows: Records, with values ordered as `columns`
+        columns: Column names
+        table_name: name of the target table
+        conn: psycopg2 connection object
+    """
+    if not rows:
+        return
+    from psycopg2.extras import execute_values
+    register_adapters()
+    unique_columns = get_unique_columns(table_name, conn)
+
+    # Drop duplicate records based on unique columns
+    key_idx = [columns.index(col) for col in unique_columns if col in columns]
+    if key_idx:
+        unique_rows = {}
+        for row in rows:
+            unique_rows.setdefault(tuple(row[i] for i in key_idx), row)
+        rows = list(unique_rows.values())
+
+    # Execute the query
+    insert_stmt = upsert_stmt(table_name, columns, unique_columns)
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, insert_stmt, rows)
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise Exception(f"Error uploading data to {table_name}: {str(e)}")
+
+def db_upsert_records(
+    records: List[dict], table_name: str, conn: connection, min_int: int=-2**30, max_int: int=2**30 - 1
+    ) -> None:
+    """
+    Upsert a few records (dicts) to PostgreSQL without pandas; the counterpart of `db_upsert`
+    for small scripts: keys not in the table and "id" are dropped, and out-of-range
+    integers are set to NULL (see `sanitize_int_columns`).
+    Args:
+        records: Records; missing keys are NULL
+        table_name: name of the target table
+        conn: psycopg2 connection object
+        min_int: Minimum integer value
+        max_int: Maximum integer value
+    """
+    if not records:
+        return
+    table_columns = set(get_table_columns(table_name, conn))
+    columns = []
+    for record in records:
+        columns += [col for col in record if col in table_columns and col != "id" and col not in columns]
+    rows = []
+    for record in records:
+        row = [record.get(col) for col in columns]
+        row = [
+            None if isinstance(x, int) and not isinstance(x, bool) and not min_int <= x <= max_int else x
+            for x in row
+        ]
+        rows.append(tuple(row))
+    db_upsert_rows(rows, columns, table_name, conn)
+
+def upsert_stmt(table_name: str, columns: List[str], unique_columns: List[str], source: str="VALUES %s") -> str:
+    """
+    Create an INSERT statement with an ON CONFLICT clause.
+    Args:
+        table_name: name of the target table
+        columns: Columns to insert
+        unique_columns: Columns of the unique constraint
+        source: Source of the records; the default is for use with `execute_values`
+    Returns:
+        SQL statement
+    """
     insert_stmt = f"INSERT INTO {table_name} ({', '.join(columns)})"
-    insert_stmt += f"\nVALUES %s"
+    insert_stmt += f"\n{source}"
 
     # Add DO UPDATE SET clause for non-unique columns
     do_update_set = [col for col in columns if col not in unique_columns]
@@ -140,15 +686,7 @@ def db_upsert(df: pd.DataFrame, table_name: str, conn: connection) -> None:
     else:
         # if no non-unique columns, add DO NOTHING clause
         insert_stmt += f"\nON CONFLICT ({', '.join(unique_columns)}) DO NOTHING"
-
-    # Execute the query
-    try:
-        with conn.cursor() as cur:
-            execute_values(cur, insert_stmt, values)
-            conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise Exception(f"Error uploading data to {table_name}: {str(e)}")
+    return insert_stmt
 
 def db_update(df: pd.DataFrame, table_name: str, conn: connection) -> None:
     """
@@ -158,16 +696,19 @@ def db_update(df: pd.DataFrame, table_name: str, conn: connection) -> None:
         table_name: name of the target table
         conn: psycopg2 connection object
     """
+    import pandas as pd
+    from psycopg2.extras import execute_values
+    register_adapters()
     if df.empty:
         return
     if not isinstance(df, pd.DataFrame):
         df = pd.DataFrame(df)
 
     # Filter columns to only those that exist in the table
-    df = df[list(set(get_table_columns(table_name, conn)).intersection(df.columns))]
+    df = df.reindex(columns=list(set(get_table_columns(table_name, conn)).intersection(df.columns)))
 
     # Sanitize integers, drop duplicates, etc.
-    df = sanitize_int_columns(df.copy())
+    df = sanitize_int_columns(df)
     unique_columns = get_unique_columns(table_name, conn)
     
     # Remove "id" 
@@ -213,6 +754,128 @@ def db_update(df: pd.DataFrame, table_name: str, conn: connection) -> None:
 def get_table_columns(table: str, conn: connection) -> List[str]:
     """
     Get column names for a table from the database schema.
+    Cached per table; see `get_table_schema`.
+    Args:
+        table: Name of the table
+        conn: Database connection 
+    Returns:
+        List of column names
+    """
+    return get_table_schema(table, conn)["columns"]
+
+def get_unique_columns(table: str, conn: connection) -> List[str]:
+    """
+    Get all unique constraint columns for a table from the database schema.
+    Prioritizes composite unique constraints over primary keys.
+    Cached per table; see `get_table_schema`.
+    Args:
+        table: Name of the table
+        conn: Database connection 
+    Returns:
+        List of column names that form the most appropriate unique constraint
+    """
+    unique_columns = get_table_schema(table, conn)["unique_columns"]
+    if not unique_columns:
+        raise ValueError(f"No unique constraints found in table {table}")
+    return unique_columns
+
+def get_int_columns(table: str, conn: connection) -> List[str]:
+    """
+    Get the integer column names for a table from the database schema.
+    Cached per table; see `get_table_schema`.
+    Args:
+        table: Name of the table
+        conn: Database connection 
+    Returns:
+        List of column names
+    """
+    return get_table_schema(table, conn)["int_columns"]
+
+def get_table_schema(table: str, conn: connection) -> dict:
+    """
+    Get the column names and unique constraint columns for a table.
+    The schema is cached in memory, keyed by database and table name, and
+    persisted to `SCHEMA_CACHE_FILE` (if set) so that other processes can skip the catalog queries.
+    Args:
+        table: Name of the table
+        conn: Database connection 
+    Returns:
+        {"columns": [...], "unique_columns": [...], "int_columns": [...]}
+    """
+    db_name = conn.info.dbname
+    with _LOCK:
+        load_schema_cache()
+        schema = _SCHEMA_CACHE.get(db_name, {}).get(table)
+        # schemas cached before "int_columns" was added are re-queried
+        if schema is not None and "int_columns" in schema:
+            return schema
+    # query the catalog
+    schema = {
+        "columns": fetch_table_columns(table, conn),
+        "unique_columns": fetch_unique_columns(table, conn),
+        "int_columns": fetch_int_columns(table, conn)
+    }
+    # do not cache missing tables
+    if not schema["columns"]:
+        return schema
+    with _LOCK:
+        _SCHEMA_CACHE.setdefault(db_name, {})[table] = schema
+        save_schema_cache()
+    return schema
+
+def invalidate_schema_cache(table: Optional[str]=None) -> None:
+    """
+    Remove table schemas from the in-memory and on-disk schema cache.
+    Call after altering a table during a run.
+    Args:
+        table: Name of the table; if None, all tables are removed
+    """
+    with _LOCK:
+        load_schema_cache()
+        for tables in _SCHEMA_CACHE.values():
+            if table is None:
+                tables.clear()
+            else:
+                tables.pop(table, None)
+        save_schema_cache()
+
+def load_schema_cache() -> None:
+    """
+    Load the on-disk schema cache (once per process).
+    An unreadable cache file is ignored.
+    """
+    global _SCHEMA_CACHE_LOADED
+    if _SCHEMA_CACHE_LOADED:
+        return
+    _SCHEMA_CACHE_LOADED = True
+    if not SCHEMA_CACHE_FILE or not os.path.exists(SCHEMA_CACHE_FILE):
+        return
+    try:
+        with open(SCHEMA_CACHE_FILE) as inF:
+            for db_name, tables in json.load(inF).items():
+                _SCHEMA_CACHE.setdefault(db_name, {}).update(tables)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read schema cache {SCHEMA_CACHE_FILE}: {str(e)}")
+
+def save_schema_cache() -> None:
+    """
+    Write the schema cache to `SCHEMA_CACHE_FILE` (if set).
+    The file is replaced atomically, so concurrent readers never see a partial file.
+    """
+    if not SCHEMA_CACHE_FILE:
+        return
+    try:
+        outdir = os.path.dirname(os.path.abspath(SCHEMA_CACHE_FILE))
+        os.makedirs(outdir, exist_ok=True)
+        with NamedTemporaryFile("w", dir=outdir, suffix=".tmp", delete=False) as outF:
+            json.dump(_SCHEMA_CACHE, outF, indent=2)
+        os.replace(outF.name, SCHEMA_CACHE_FILE)
+    except OSError as e:
+        logging.warning(f"Could not write schema cache {SCHEMA_CACHE_FILE}: {str(e)}")
+
+def fetch_table_columns(table: str, conn: connection) -> List[str]:
+    """
+    Query the column names for a table from the database schema (no caching).
     Args:
         table: Name of the table
         conn: Database connection 
@@ -230,15 +893,35 @@ def get_table_columns(table: str, conn: connection) -> List[str]:
         columns = cur.fetchall()
     return [col[0] for col in columns]
 
-def get_unique_columns(table: str, conn: connection) -> List[str]:
+def fetch_int_columns(table: str, conn: connection) -> List[str]:
     """
-    Get all unique constraint columns for a table from the database schema.
+    Query the integer (smallint, integer & bigint) column names for a table (no caching).
+    Args:
+        table: Name of the table
+        conn: Database connection 
+    Returns:
+        List of column names
+    """
+    query = """
+    SELECT column_name
+    FROM information_schema.columns
+    WHERE table_name = %s AND data_type IN ('smallint', 'integer', 'bigint');
+    """
+    with conn.cursor() as cur:
+        cur.execute(query, (table,))
+        columns = cur.fetchall()
+    return [col[0] for col in columns]
+
+def fetch_unique_columns(table: str, conn: connection) -> List[str]:
+    """
+    Query the unique constraint columns for a table from the database schema (no caching).
     Prioritizes composite unique constraints over primary keys.
     Args:
         table: Name of the table
         conn: Database connection 
     Returns:
-        List of column names that form the most appropriate unique constraint
+        List of column names that form the most appropriate unique constraint;
+        empty if the table has no unique constraints
     """
     query = """
     SELECT c.contype, ARRAY_AGG(a.attname ORDER BY array_position(c.conkey, a.attnum)) as columns
@@ -256,7 +939,7 @@ def get_unique_columns(table: str, conn: connection) -> List[str]:
         constraints = cur.fetchall()
         
     if not constraints:
-        raise ValueError(f"No unique constraints found in table {table}")
+        return []
     
     # Prefer composite unique constraints over single-column primary keys
     for constraint_type, columns in constraints:
@@ -266,9 +949,27 @@ def get_unique_columns(table: str, conn: connection) -> List[str]:
     # Fall back to primary key if no other suitable constraint found
     return constraints[0][1]
 
-def get_secret(secret_id: str) -> str:
+def get_secret(secret_id: str, ttl: int=SECRET_TTL) -> str:
     """
-    Fetch secret from GCP Secret Manager.
+    Fetch secret from GCP Secret Manager; cached per process for `ttl` seconds.
+    Rquired environment variables: GCP_PROJECT_ID, GOOGLE_APPLICATION_CREDENTIALS
+    Args:
+        secret_id: The secret id
+        ttl: Time (seconds) to cache the secret value
+    Returns:
+        The secret value
+    """
+    with _LOCK:
+        cached = _SECRET_CACHE.get(secret_id)
+        if cached is not None and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+        value = fetch_secret(secret_id)
+        _SECRET_CACHE[secret_id] = (time.monotonic(), value)
+        return value
+
+def fetch_secret(secret_id: str) -> str:
+    """
+    Fetch secret from GCP Secret Manager (no caching).
     Rquired environment variables: GCP_PROJECT_ID, GOOGLE_APPLICATION_CREDENTIALS
     Args:
         secret_id: The secret id
@@ -291,11 +992,14 @@ def get_secret(secret_id: str) -> str:
     response = client.access_secret_version(request={"name": name})
     return response.payload.data.decode('UTF-8')
 
-def get_db_certs(certs=["server-ca.pem", "client-cert.pem", "client-key.pem"]) -> dict:
+def get_db_certs(certs=["server-ca.pem", "client-cert.pem", "client-key.pem"], ttl: int=SECRET_TTL) -> dict:
     """
     Download certificates from GCP Secret Manager and save them to temporary files.
+    The files are reused for `ttl` seconds and removed at process exit
+    (expired files are kept until exit, since pooled connections may still reference them).
     Args:
         certs: A list of certificate ids
+        ttl: Time (seconds) to reuse the certificate files
     Returns:
         A dictionary containing the paths to the temporary files
     """
@@ -305,34 +1009,59 @@ def get_db_certs(certs=["server-ca.pem", "client-cert.pem", "client-key.pem"]) -
         "client-key.pem": "SRAgent_db_client_key"
     }
     cert_files = {}
-    for cert in certs:
-        cert_files[cert] = download_secret(idx[cert])
+    with _LOCK:
+        for cert in certs:
+            cached = _CERT_CACHE.get(cert)
+            if cached is not None and time.monotonic() - cached[0] < ttl and os.path.exists(cached[1]):
+                cert_files[cert] = cached[1]
+                continue
+            cert_files[cert] = download_secret(idx[cert], ttl=ttl)
+            _CERT_CACHE[cert] = (time.monotonic(), cert_files[cert])
+            _CERT_FILES.append(cert_files[cert])
     return cert_files
 
-def download_secret(secret_id: str) -> str:
+def remove_db_certs() -> None:
+    """
+    Delete all cached certificate files.
+    """
+    with _LOCK:
+        for cert_file in _CERT_FILES:
+            if os.path.exists(cert_file):
+                os.remove(cert_file)
+        _CERT_FILES.clear()
+        _CERT_CACHE.clear()
+
+def download_secret(secret_id: str, ttl: int=SECRET_TTL) -> str:
     """
     Download a secret from GCP Secret Manager and save it to a temporary file.
     Args:
         secret_id: The secret id
+        ttl: Time (seconds) to cache the secret value
     Returns:
         The path to the temporary file containing the secret
     """
-    secret_value = get_secret(secret_id)
+    secret_value = get_secret(secret_id, ttl=ttl)
     temp_file = NamedTemporaryFile(delete=False, mode='w', encoding='utf-8')
     with temp_file as f:
         f.write(secret_value)
         f.flush()
+    os.chmod(temp_file.name, 0o600)
     return temp_file.name
 
+# clean up at process exit
+atexit.register(remove_db_certs)
+atexit.register(close_pool)
+
 def get_srx_metadata_limit5(conn):
     query = """
     SELECT * FROM srx_metadata LIMIT 5;
     """
+    import pandas as pd
     return pd.read_sql(query, conn)
 
 # main
 if __name__ == "__main__":
     from dotenv import load_dotenv
     load_dotenv()
-    with db_connect() as conn:
+    with get_conn() as conn:
         print(get_srx_metadata_limit5(conn))
\ No newline at end of file
@@ -16,7 +16,7 @@ import anndata
 from scipy import sparse
 from pypika import Query, Table
 ## package
-from db_utils import db_connect, db_upsert
+from db_utils import get_conn, db_upsert
 
 # format logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
@@ -154,7 +154,7 @@ def load_matrix_as_anndata(
         .where(srx_metadata.srx_accession == srx_id) 
     )
     metadata = None
-    with db_connect() as conn:
+    with get_conn() as conn:
         metadata = pd.read_sql(str(stmt), conn)
 
     ## if metadata is not found, return None
@@ -243,7 +243,7 @@ def load_matrix_as_anndata(
     # upsert metadata to postgresql database
     if update_database:
         logging.info(f"Upserting metadata for SRX accession {srx_id}...")
-        with db_connect() as conn:
+        with get_conn() as conn:
             db_upsert(metadata, "scbasecamp_metadata", conn)
     else:
         logging.info(f"Skipping upserting metadata for SRX accession {srx_id}")
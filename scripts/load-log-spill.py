@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+from db_utils import get_conn, db_load_spill
+
+
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter): pass
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command-line arguments.
+    Returns:
+        argparse.Namespace containing arguments.
+    """
+    desc = 'Load log spill files into the scRecounter database.'
+    epi = """DESCRIPTION:
+    Spill files (JSONL) are written by the pipeline scripts when
+    log records cannot be upserted to the scRecounter database.
+    Each record is upserted into the table named in its "table" field.
+    The pipeline publishes the spill files to
+    <output_dir>/logs/<sample>/[<accession>/]<process>_log_spill.jsonl.
+
+    Examples:
+    load-log-spill.py $(find results/logs -name "*_log_spill.jsonl")
+    """
+    parser = argparse.ArgumentParser(description=desc, epilog=epi, formatter_class=CustomFormatter)
+    parser.add_argument('spill_file', type=str, nargs='+',
+                        help='>=1 JSONL spill file to load.')
+    parser.add_argument('--remove', action='store_true', default=False,
+                        help='Delete each spill file after it is loaded.')
+    return parser.parse_args()
+
+def main(args: argparse.Namespace) -> None:
+    print(f"GCP_SQL_DB_NAME: {os.getenv('GCP_SQL_DB_NAME')}", file=sys.stderr)
+    with get_conn() as conn:
+        for spill_file in args.spill_file:
+            num_records = db_load_spill(spill_file, conn)
+            print(f"Loaded {num_records} records from {spill_file}", file=sys.stderr)
+            if args.remove:
+                os.remove(spill_file)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    args = parse_args()
+    main(args)
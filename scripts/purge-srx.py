@@ -6,7 +6,7 @@ from typing import Tuple, List, Dict
 import pandas as pd
 from google.cloud import storage
 from psycopg2.extensions import connection
-from db_utils import db_connect, db_update
+from db_utils import get_conn, db_update
 
 
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter): pass
@@ -117,7 +117,7 @@ def delete_srx(srx_accessions: List[str], conn: connection, dry_run: bool=False)
         return None
     print("Purging SRX accessions from scRecounter DB tables...", file=sys.stderr)
     target_tables = ["screcounter_log", "screcounter_star_params", "screcounter_star_results"]
-    with db_connect() as conn:
+    with get_conn() as conn:
         for srx in srx_accessions:
             if not dry_run:
                 for tbl_name in target_tables:
@@ -173,7 +173,7 @@ def main(args: argparse.Namespace) -> None:
     delete_srx_star_dirs(srx_dirs, bucket, dry_run=args.dry_run)
 
     # Selete SRX accessions from scRecounter tables
-    with db_connect() as conn:
+    with get_conn() as conn:
         delete_srx(args.srx_accession, conn, dry_run=args.dry_run)
 
 
@@ -17,7 +17,7 @@ import tiledbsoma.io
 import scanpy as sc
 from pypika import Query, Table
 ## package
-from db_utils import db_connect
+from db_utils import get_conn
 
 # format logging
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
@@ -89,7 +89,7 @@ def load_matrix_as_anndata(
         .where(srx_metadata.srx_accession == srx_id)
     )
     metadata = None
-    with db_connect() as conn:
+    with get_conn() as conn:
         metadata = pd.read_sql(str(stmt), conn)
 
     ## if metadata is not found, return None
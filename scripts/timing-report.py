@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import argparse
+import pandas as pd
+
+
+class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter): pass
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command-line arguments.
+    Returns:
+        argparse.Namespace containing arguments.
+    """
+    desc = 'Summarize the per-stage timing records (screcounter_timing).'
+    epi = """DESCRIPTION:
+    Timing spans are written by the pipeline scripts (see bin/telemetry.py) to the
+    screcounter_timing table, or to JSONL spill files (e.g., with --no-db).
+    Spans are grouped by process & step, and summed: wall time, CPU time (incl. child processes),
+    bytes read/written & input size. Cost per GB of input (e.g., SRA file size) is
+    reported as wall & CPU seconds per GB, for the spans with a known input size.
+    Stages are sorted by total wall time.
+
+    Examples:
+    # JSONL spill files
+    timing-report.py $(find results/logs -name "*_log_spill.jsonl")
+    # database
+    timing-report.py --db --since 2025-01-01
+    """
+    parser = argparse.ArgumentParser(description=desc, epilog=epi, formatter_class=CustomFormatter)
+    parser.add_argument('spill_file', type=str, nargs='*',
+                        help='JSONL spill file(s); records of other tables are ignored.')
+    parser.add_argument('--db', action='store_true', default=False,
+                        help='Read the records from the scRecounter database.')
+    parser.add_argument('--since', type=str, default=None,
+                        help='Only include spans started at/after this date/time (--db).')
+    parser.add_argument('--by-sample', action='store_true', default=False,
+                        help='Also group by sample.')
+    parser.add_argument('--outfile', type=str, default=None,
+                        help='Write the summary as CSV.')
+    return parser.parse_args()
+
+def read_spill_files(spill_files: list) -> pd.DataFrame:
+    """
+    Read the timing records from JSONL spill files.
+    Args:
+        spill_files: JSONL files
+    Returns:
+        Timing records
+    """
+    records = []
+    for spill_file in spill_files:
+        with open(spill_file) as inF:
+            for line in inF:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.pop("table", None) == "screcounter_timing":
+                    records.append(record)
+    return pd.DataFrame(records)
+
+def read_db(since: str=None) -> pd.DataFrame:
+    """
+    Read the timing records from the database.
+    Args:
+        since: Only include spans started at/after this date/time
+    Returns:
+        Timing records
+    """
+    from db_utils import get_conn
+    stmt = "SELECT * FROM screcounter_timing"
+    params = None
+    if since:
+        stmt += " WHERE started_at >= %s"
+        params = (since,)
+    with get_conn() as conn:
+        return pd.read_sql(stmt, conn, params=params)
+
+def summarize(df: pd.DataFrame, by_sample: bool=False) -> pd.DataFrame:
+    """
+    Sum the timing records per process & step.
+    Args:
+        df: Timing records
+        by_sample: Also group by sample
+    Returns:
+        Summary, sorted by total wall time
+    """
+    df = df.copy()
+    df["total_cpu_sec"] = df["cpu_sec"] + df["child_cpu_sec"]
+    df["failed"] = df["status"] != "Success"
+    has_size = df["input_gb"].notna() & (df["input_gb"] > 0)
+    df["sized_wall_sec"] = df["wall_sec"].where(has_size, 0)
+    df["sized_cpu_sec"] = df["total_cpu_sec"].where(has_size, 0)
+    group_by = (["sample"] if by_sample else []) + ["process", "step"]
+    summary = df.groupby(group_by).agg(
+        spans=("span_id", "count"),
+        failed=("failed", "sum"),
+        wall_sec=("wall_sec", "sum"),
+        cpu_sec=("total_cpu_sec", "sum"),
+        max_rss_mb=("max_rss_mb", "max"),
+        read_gb=("read_mb", lambda x: x.sum() / 1e3),
+        write_gb=("write_mb", lambda x: x.sum() / 1e3),
+        input_gb=("input_gb", "sum"),
+        sized_wall_sec=("sized_wall_sec", "sum"),
+        sized_cpu_sec=("sized_cpu_sec", "sum"),
+    ).reset_index()
+    summary["wall_sec_per_gb"] = summary["sized_wall_sec"] / summary["input_gb"].where(summary["input_gb"] > 0)
+    summary["cpu_sec_per_gb"] = summary["sized_cpu_sec"] / summary["input_gb"].where(summary["input_gb"] > 0)
+    summary["wall_frac"] = summary["wall_sec"] / summary["wall_sec"].sum()
+    summary = summary.drop(columns=["sized_wall_sec", "sized_cpu_sec"])
+    return summary.sort_values("wall_sec", ascending=False)
+
+def main(args: argparse.Namespace) -> None:
+    # read the records
+    frames = []
+    if args.spill_file:
+        frames.append(read_spill_files(args.spill_file))
+    if args.db:
+        frames.append(read_db(args.since))
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if df.empty:
+        print("No timing records found", file=sys.stderr)
+        sys.exit(1)
+    print(f"Timing records: {len(df)}", file=sys.stderr)
+
+    # summarize
+    summary = summarize(df, args.by_sample)
+    pd.set_option("display.width", 250)
+    pd.set_option("display.max_columns", 20)
+    print(summary.round(3).to_string(index=False))
+    if args.outfile:
+        summary.to_csv(args.outfile, index=False)
+        print(f"Summary written to: {args.outfile}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    args = parse_args()
+    main(args)
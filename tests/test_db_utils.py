@@ -0,0 +1,99 @@
+# import
+## batteries
+import os
+import sys
+import time
+import threading
+## 3rd party
+import psycopg2
+import psycopg2.extensions
+import pytest
+## pipeline
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin"))
+import db_utils
+
+# classes
+class FakeInfo:
+    transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+class FakeConnection:
+    """
+    Stand-in for a psycopg2 connection (no database needed).
+    """
+    def __init__(self, stats: dict) -> None:
+        self.stats = stats
+        self.closed = 0
+        self.info = FakeInfo()
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if not self.closed:
+            self.stats["closes"] += 1
+        self.closed = 1
+
+# functions
+@pytest.fixture
+def stats(monkeypatch):
+    """
+    Stub `psycopg2.connect`; count the opened & closed connections.
+    """
+    stats = {"connects": 0, "closes": 0}
+    lock = threading.Lock()
+    def connect(*args, **kwargs):
+        with lock:
+            stats["connects"] += 1
+        return FakeConnection(stats)
+    monkeypatch.setattr(psycopg2, "connect", connect)
+    monkeypatch.setattr(db_utils, "db_params", lambda: {})
+    db_utils.close_pool()
+    yield stats
+    db_utils.close_pool()
+
+# tests
+def test_get_conn_reuses_connection(stats):
+    for _ in range(5):
+        with db_utils.get_conn() as conn:
+            assert not conn.closed
+    assert stats == {"connects": 1, "closes": 0}
+
+def test_get_conn_blocks_when_exhausted(stats, monkeypatch):
+    monkeypatch.setattr(db_utils, "POOL_MAX_CONN", 2)
+    errors = []
+    active = []
+    max_active = []
+    lock = threading.Lock()
+    def borrow():
+        try:
+            with db_utils.get_conn():
+                with lock:
+                    active.append(1)
+                    max_active.append(len(active))
+                time.sleep(0.05)
+                with lock:
+                    active.pop()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=borrow) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # borrowers wait for a free connection instead of getting a PoolError
+    assert errors == []
+    assert max(max_active) <= 2
+    assert stats["connects"] <= 2
+
+def test_retired_pool_closed_after_return(stats):
+    pool = db_utils.get_pool()
+    with db_utils.get_conn() as conn:
+        pool.retire()
+        # still borrowed: the pool stays open
+        assert not pool.closed
+        assert not conn.closed
+    assert pool.closed
+    assert conn.closed
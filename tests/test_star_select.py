@@ -0,0 +1,124 @@
+# import
+## batteries
+import os
+import sys
+## 3rd party
+import pandas as pd
+import pytest
+## pipeline
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin"))
+from star_select import GROUP_COLUMNS, format_star_params, score_param_groups, successive_halving
+
+# constants
+## recorded STARsolo GeneFull Summary.csv files: <round>/<barcodes_name>_<organism>_<strand>.csv
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "star_summary")
+ROUNDS = [10000, 100000]
+
+# functions
+def make_param_sets() -> list:
+    """
+    All pairwise parameter sets of one accession (as makeParamSets): 2 whitelists x 2 STAR indices x 2 strands.
+    """
+    param_sets = []
+    for barcodes_name,cb_len,umi_len in [("10x_v3", 16, 12), ("10x_v2", 16, 10)]:
+        for organism in ["human", "mouse"]:
+            for strand in ["Forward", "Reverse"]:
+                param_sets.append({
+                    "sample": "SRX0000001",
+                    "accession": "SRR0000001",
+                    "strand": strand,
+                    "barcodes_name": barcodes_name,
+                    "barcodes_file": f"barcodes/{barcodes_name}.txt",
+                    "cell_barcode_length": cb_len,
+                    "umi_length": umi_len,
+                    "organism": organism,
+                    "star_index": f"star_indices/{organism}",
+                })
+    return param_sets
+
+def recorded_round(i: int, num_reads: int, param_sets: list):
+    """
+    STAR param search table of a round, from the recorded summaries (instead of running STAR).
+    A missing fixture (a parameter set that should have been pruned) fails the test.
+    """
+    rows = []
+    for params in param_sets:
+        infile = os.path.join(
+            FIXTURES, f"round{i + 1}", f"{params['barcodes_name']}_{params['organism']}_{params['strand']}.csv"
+        )
+        rows.append(format_star_params(infile, params))
+    return pd.concat(rows, ignore_index=True)
+
+def group_names(df) -> list:
+    """
+    (barcodes_name, organism) of each row.
+    """
+    return list(zip(df["barcodes_name"], df["organism"]))
+
+@pytest.fixture
+def round1():
+    return recorded_round(0, ROUNDS[0], make_param_sets())
+
+# tests
+def test_score_param_groups(round1):
+    scores = score_param_groups(round1)
+    # one row per group (both strands), sorted by score
+    assert scores.shape[0] == 4
+    assert group_names(scores) == [("10x_v3", "human"), ("10x_v3", "mouse"), ("10x_v2", "human"), ("10x_v2", "mouse")]
+    assert scores["score"].is_monotonic_decreasing
+    # valid barcodes x GeneFull, of the proper strand
+    assert (scores["proper_strand"] == "Forward").all()
+    assert scores["score"].iloc[0] == pytest.approx(0.962 * 0.712)
+    assert scores["score"].iloc[1] == pytest.approx(0.958 * 0.083)
+
+def test_score_param_groups_single_strand(round1):
+    # a group with only one strand run (e.g., a failed STAR run) is still scored
+    scores = score_param_groups(round1[round1["strand"] == "Forward"])
+    assert scores.shape[0] == 4
+    assert group_names(scores)[0] == ("10x_v3", "human")
+
+def test_score_param_groups_empty(round1):
+    scores = score_param_groups(round1.iloc[0:0])
+    assert scores.shape[0] == 0
+    assert list(scores.columns) == GROUP_COLUMNS + ["proper_strand", "score"]
+
+def test_successive_halving_prunes():
+    called = []
+    def run_round(i, num_reads, param_sets):
+        called.append((i, num_reads, len(param_sets)))
+        return recorded_round(i, num_reads, param_sets)
+    data,history = successive_halving(make_param_sets(), ROUNDS, run_round, eta=3, min_keep=2)
+
+    # round 1: all 8 parameter sets; round 2: the 2 best groups (max(min_keep, ceil(4 / eta)))
+    assert called == [(0, 10000, 8), (1, 100000, 4)]
+    round1 = history[history["round"] == 1]
+    assert group_names(round1[round1["kept"]]) == [("10x_v3", "human"), ("10x_v3", "mouse")]
+    assert group_names(round1[~round1["kept"]]) == [("10x_v2", "human"), ("10x_v2", "mouse")]
+    # all groups of the last round are kept
+    round2 = history[history["round"] == 2]
+    assert round2.shape[0] == 2
+    assert round2["kept"].all()
+    assert (round2["num_reads"] == 100000).all()
+
+def test_successive_halving_keeps_both_strands():
+    data,_ = successive_halving(make_param_sets(), ROUNDS, recorded_round, eta=3, min_keep=2)
+    # both strands of each kept group are run again (the proper strand is labeled from both)
+    strands = data.groupby(["barcodes_name", "organism"])["strand"].apply(sorted).to_dict()
+    assert strands == {
+        ("10x_v3", "human"): ["Forward", "Reverse"],
+        ("10x_v3", "mouse"): ["Forward", "Reverse"],
+    }
+
+def test_successive_halving_last_round_output():
+    data,_ = successive_halving(make_param_sets(), ROUNDS, recorded_round, eta=3, min_keep=2)
+    # the STAR param search table of the last round (the larger subsample) is returned
+    assert data.shape[0] == 4
+    assert (data["Number of Reads"] == 100000).all()
+    best = data[(data["barcodes_name"] == "10x_v3") & (data["organism"] == "human") & (data["strand"] == "Forward")]
+    assert best["Reads Mapped to GeneFull: Unique+Multiple GeneFull"].iloc[0] == pytest.approx(0.715)
+
+def test_successive_halving_single_round():
+    # a single round is the last round: nothing is pruned
+    data,history = successive_halving(make_param_sets(), ROUNDS[:1], recorded_round, eta=3, min_keep=2)
+    assert data.shape[0] == 8
+    assert history["kept"].all()
@@ -39,6 +39,7 @@ process GET_DB_ACCESSIONS {
     get-db-accessions.py \\
       --organisms "${params.organisms}" \\
       --max-srx ${params.max_samples} \\
+      --max-sra-size ${params.max_sra_size} \\
       2>&1 | tee ${task.process}.log
     """
 }
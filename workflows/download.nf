@@ -1,6 +1,5 @@
 include { readAccessions; } from '../lib/download.groovy'
 include { joinReads; addStats; } from '../lib/utils.nf'
-include { SRA_STAT } from '../lib/utils.nf'
 
 workflow DOWNLOAD_WF {
     take:
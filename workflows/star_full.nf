@@ -1,4 +1,4 @@
-include { joinReads; saveAsLog; } from '../lib/utils.groovy'
+include { joinReads; saveAsLog; hintMemory; hintTime; hintLocalSsd; } from '../lib/utils.groovy'
 
 // Workflow to run STAR alignment on scRNA-seq data
 workflow STAR_FULL_WF{
@@ -12,47 +12,94 @@ workflow STAR_FULL_WF{
     ch_accessions_filt = ch_accessions.combine(
         ch_star_params.map{ it[0] }.unique(), by: 0
     )
-
-    // fasterq-dump to download all reads
-    ch_fastq = FASTERQ_DUMP(ch_accessions_filt)
-    ch_fastq = joinReads(ch_fastq.R1, ch_fastq.R2)
-
-    // For accessions lacking paired reads from fasterq-dump, fallback to fastq-dump
-    ch_accessions_fallback = ch_accessions_filt
-        .join(
-            ch_fastq.map{ it -> [it[0], it[1], true] }, 
-            by: [0,1],
-            remainder: true
-        )
-        .filter{ it -> it[4] != true }
-        .map{ it -> it[0..3] }
-
-    // run fastq-dump on the fallback accessions
-    ch_fastq_fallback = FASTQ_DUMP(ch_accessions_fallback)
-    ch_fastq_fallback = joinReads(ch_fastq_fallback.R1, ch_fastq_fallback.R2)
-    ch_fastq_fallback.count().view{ count -> "No. of fastq-dump fallback accessions: $count" }
-
-    // combine the fasterq-dump and fastq-dump results
-    ch_fastq = ch_fastq.mix(ch_fastq_fallback)
-    ch_fastq.count().view{ count -> "No. of fast(er)q-dump accessions: $count" }
-
-    // combine reads and star params
-    ch_fastq = ch_fastq
-        .map{ sample, accession, metadata, R1, R2 -> [sample, R1, R2] }
+    // total SRA file size per sample (used for the resource hints of STAR_FULL)
+    ch_sample_size = ch_accessions_filt
+        .map{ sample, accession, metadata, sra_file_size_gb -> [sample, sra_file_size_gb] }
         .groupTuple()
-        .join(ch_star_params)
-
-    //-- Run STAR with the selected parameters on all reads --//
-    // run STAR
-    STAR_FULL(ch_fastq)
+        .map{ sample, sizes -> [sample, sizes.sum()] }
+
+    if (params.stream_reads) {
+        //-- Stream reads from fasterq-dump directly into STAR --//
+        ch_stream = ch_accessions_filt
+            .map{ sample, accession, metadata, sra_file_size_gb -> [sample, accession, sra_file_size_gb] }
+            .groupTuple()
+            .map{ sample, accessions, sizes -> [sample, accessions, sizes.sum()] }
+            .join(ch_star_params)
+        STAR_FULL_STREAM(ch_stream)
+        ch_star = STAR_FULL_STREAM.out
+    } else if (params.download_per_sample) {
+        //-- Download all accessions of a sample in one task --//
+        ch_sample_acc = ch_accessions_filt
+            .map{ sample, accession, metadata, sra_file_size_gb -> [sample, accession, sra_file_size_gb] }
+            .groupTuple()
+        ch_fastq = FASTERQ_DUMP_SAMPLE(ch_sample_acc)
+        ch_fastq = ch_fastq.R1.join(ch_fastq.R2, by: 0)
+
+        // For samples lacking paired reads, fallback to fastq-dump (per accession)
+        ch_accessions_fallback = ch_accessions_filt
+            .combine(ch_fastq.map{ it -> it[0] }.toList().map{ it -> [it] })
+            .filter{ sample, accession, metadata, sra_file_size_gb, samples_ok -> !(sample in samples_ok) }
+            .map{ it -> it[0..3] }
+        ch_fastq_fallback = FASTQ_DUMP(ch_accessions_fallback)
+        ch_fastq_fallback = joinReads(ch_fastq_fallback.R1, ch_fastq_fallback.R2)
+            .map{ sample, accession, metadata, R1, R2 -> [sample, R1, R2] }
+            .groupTuple()
+        ch_fastq_fallback.count().view{ count -> "No. of fastq-dump fallback samples: $count" }
+
+        // combine reads and star params
+        ch_fastq = ch_fastq
+            .map{ sample, R1, R2 -> [sample, [R1], [R2]] }
+            .mix(ch_fastq_fallback)
+            .join(ch_star_params)
+            .join(ch_sample_size)
+
+        //-- Run STAR with the selected parameters on all reads --//
+        STAR_FULL(ch_fastq)
+        ch_star = STAR_FULL.out
+    } else {
+        // fasterq-dump to download all reads
+        ch_fastq = FASTERQ_DUMP(ch_accessions_filt)
+        ch_fastq = joinReads(ch_fastq.R1, ch_fastq.R2)
+
+        // For accessions lacking paired reads from fasterq-dump, fallback to fastq-dump
+        ch_accessions_fallback = ch_accessions_filt
+            .join(
+                ch_fastq.map{ it -> [it[0], it[1], true] }, 
+                by: [0,1],
+                remainder: true
+            )
+            .filter{ it -> it[4] != true }
+            .map{ it -> it[0..3] }
+
+        // run fastq-dump on the fallback accessions
+        ch_fastq_fallback = FASTQ_DUMP(ch_accessions_fallback)
+        ch_fastq_fallback = joinReads(ch_fastq_fallback.R1, ch_fastq_fallback.R2)
+        ch_fastq_fallback.count().view{ count -> "No. of fastq-dump fallback accessions: $count" }
+
+        // combine the fasterq-dump and fastq-dump results
+        ch_fastq = ch_fastq.mix(ch_fastq_fallback)
+        ch_fastq.count().view{ count -> "No. of fast(er)q-dump accessions: $count" }
+
+        // combine reads and star params
+        ch_fastq = ch_fastq
+            .map{ sample, accession, metadata, R1, R2 -> [sample, R1, R2] }
+            .groupTuple()
+            .join(ch_star_params)
+            .join(ch_sample_size)
+
+        //-- Run STAR with the selected parameters on all reads --//
+        // run STAR
+        STAR_FULL(ch_fastq)
+        ch_star = STAR_FULL.out
+    }
 
     // summarize the STAR results
     STAR_FULL_SUMMARY(
-        STAR_FULL.out.gene_summary,
-        STAR_FULL.out.gene_full_summary,
-        STAR_FULL.out.gene_ex50_summary,
-        STAR_FULL.out.gene_ex_int_summary,
-        STAR_FULL.out.velocyto_summary
+        ch_star.gene_summary,
+        ch_star.gene_full_summary,
+        ch_star.gene_ex50_summary,
+        ch_star.gene_ex_int_summary,
+        ch_star.velocyto_summary
     )
 }
 
@@ -73,6 +120,7 @@ process STAR_FULL_SUMMARY {
     output:
     tuple val(sample), path("Summary.csv"), emit: "csv"
     path "${task.process}.log",             emit: "log"
+    path "${task.process}_log_spill.jsonl", emit: "spill", optional: true
 
     script:
     """
@@ -80,6 +128,7 @@ process STAR_FULL_SUMMARY {
     export GCP_SQL_DB_NAME="${params.db_name}"
     export GCP_SQL_DB_USERNAME="${params.db_username}"
 
+    export SCRECOUNTER_LOG_SPILL="${task.process}_log_spill.jsonl"
     star-summary.py \\
       --sample ${sample} \\
       gene_summary.csv \\
@@ -94,9 +143,14 @@ process STAR_FULL_SUMMARY {
 process STAR_FULL {
     publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsSTAR(sample, filename) }
     publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsLog(filename, sample) }
+    tag "${sample}"
     label "star_env"
-    label "process_high"
+    // process_high resources, without the label: config selectors override the memory & time hints
+    cpus 8
+    maxRetries 3
     errorStrategy { task.attempt <= maxRetries ? 'retry' : 'ignore' }
+    memory { hintMemory(task, sra_file_size_gb, 72.GB * task.attempt) }
+    time { hintTime(task, sra_file_size_gb, 10.h * task.attempt) }
     disk { [request: (375 * (task.attempt > 1 ? 2 : 1)).GB, type: 'local-ssd'] }
     machineType { 
         def options = ['n2-*', 'n2d-*']
@@ -106,7 +160,7 @@ process STAR_FULL {
     input:
     tuple val(sample), path("input*_R1.fastq"), path("input*_R2.fastq"), 
           path(barcodes_file), path(star_index),
-          val(cell_barcode_length), val(umi_length), val(strand)
+          val(cell_barcode_length), val(umi_length), val(strand), val(sra_file_size_gb)
 
     output: 
     tuple val(sample), path("resultsSolo.out/Gene/Summary.csv"),                    emit: gene_summary
@@ -121,6 +175,7 @@ process STAR_FULL {
     path "${task.process}.log",                                                     emit: "log"
 
     script:
+    def read_files_cmd = [zstd: "--readFilesCommand zstd -dc", bgzf: "--readFilesCommand zcat"].get(params.fastq_compress, "")
     """
     echo "Running STAR for ${sample}" > ${task.process}.log
 
@@ -129,7 +184,7 @@ process STAR_FULL {
     R2=\$(printf "%s," input*_R2.fastq)
     R2=\${R2%,}
     STAR \\
-      --readFilesIn \$R2 \$R1 \\
+      --readFilesIn \$R2 \$R1 ${read_files_cmd} \\
       --runThreadN ${task.cpus} \\
       --genomeDir ${star_index} \\
       --soloCBwhitelist ${barcodes_file} \\
@@ -160,6 +215,95 @@ process STAR_FULL {
     """
 }
 
+process STAR_FULL_STREAM {
+    publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsSTAR(sample, filename) }
+    publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsLog(filename, sample) }
+    tag "${sample}"
+    label "star_env"
+    // process_high resources, without the label: config selectors override the memory & time hints
+    cpus 8
+    maxRetries 3
+    errorStrategy { task.attempt <= maxRetries ? 'retry' : 'ignore' }
+    memory { hintMemory(task, sra_file_size_gb, 72.GB * task.attempt) }
+    time { hintTime(task, sra_file_size_gb, (10.h + (sra_file_size_gb * 0.8).h) * task.attempt) }
+    disk { [request: (375 * task.attempt).GB, type: 'local-ssd'] }
+    machineType { 
+        def options = ['n2-*', 'n2d-*']
+        return options[new Random().nextInt(options.size())]
+    }
+
+    input:
+    tuple val(sample), val(accessions), val(sra_file_size_gb),
+          path(barcodes_file), path(star_index),
+          val(cell_barcode_length), val(umi_length), val(strand)
+
+    output: 
+    tuple val(sample), path("resultsSolo.out/Gene/Summary.csv"),                    emit: gene_summary
+    tuple val(sample), path("resultsSolo.out/GeneFull/Summary.csv"),                emit: gene_full_summary
+    tuple val(sample), path("resultsSolo.out/GeneFull_Ex50pAS/Summary.csv"),        emit: gene_ex50_summary
+    tuple val(sample), path("resultsSolo.out/GeneFull_ExonOverIntron/Summary.csv"), emit: gene_ex_int_summary
+    tuple val(sample), path("resultsSolo.out/Velocyto/Summary.csv"),                emit: velocyto_summary
+    tuple val(sample), path("resultsSolo.out/*/raw/*"),                             emit: raw
+    tuple val(sample), path("resultsSolo.out/*/filtered/*"),                        emit: filt, optional: true
+    tuple val(sample), path("resultsSolo.out/*/*.stats.gz"),                        emit: stats, optional: true
+    tuple val(sample), path("resultsSolo.out/*/*.txt.gz"),                          emit: txt, optional: true
+    path "${task.process}.log",                                                     emit: "log"
+    path "${task.process}_log_spill.jsonl",                                         emit: "spill", optional: true
+
+    script:
+    """
+    export GCP_SQL_DB_HOST="${params.db_host}"
+    export GCP_SQL_DB_NAME="${params.db_name}"
+    export GCP_SQL_DB_USERNAME="${params.db_username}"
+
+    echo "Streaming reads into STAR for ${sample}" > ${task.process}.log
+    echo "sra-stat file size: ${sra_file_size_gb} GB" >> ${task.process}.log
+
+    # prefetch + fasterq-dump, with reads piped into STAR via FIFOs
+    export SCRECOUNTER_LOG_SPILL="${task.process}_log_spill.jsonl"
+    fq-stream.py \\
+      --sample ${sample} \\
+      --threads 4 \\
+      --bufsize 200MB \\
+      --curcache 1GB \\
+      --mem 12GB \\
+      --max-size-gb ${params.max_sra_size} \\
+      --min-read-length ${params.min_read_len} \\
+      --temp ${params.fasterq_tmp} \\
+      --fifo-dir fifos \\
+      ${accessions.join(' ')} \\
+      -- \\
+      STAR \\
+      --readFilesIn {R2} {R1} \\
+      --runThreadN ${task.cpus} \\
+      --genomeDir ${star_index} \\
+      --soloCBwhitelist ${barcodes_file} \\
+      --soloUMIlen ${umi_length} \\
+      --soloStrand ${strand} \\
+      --soloCBlen ${cell_barcode_length} \\
+      --soloType CB_UMI_Simple \\
+      --clipAdapterType CellRanger4 \\
+      --outFilterScoreMin 30 \\
+      --soloCBmatchWLtype 1MM_multi_Nbase_pseudocounts \\
+      --soloCellFilter EmptyDrops_CR \\
+      --soloUMIfiltering MultiGeneUMI_CR \\
+      --soloUMIdedup 1MM_CR \\
+      --soloFeatures Gene GeneFull GeneFull_ExonOverIntron GeneFull_Ex50pAS Velocyto \\
+      --soloMultiMappers EM Uniform \\
+      --outSAMtype None \\
+      --soloBarcodeReadLength 0 \\
+      --outFileNamePrefix results \\
+      2>&1 | tee -a ${task.process}.log
+
+    # gzip the results
+    mkdir -p resultsSolo.out
+    find resultsSolo.out -type f -name "*.stats" | xargs -P ${task.cpus} gzip
+    find resultsSolo.out -type f -name "*.txt" | xargs -P ${task.cpus} gzip
+    find resultsSolo.out -type f -name "*.tsv" | xargs -P ${task.cpus} gzip
+    find resultsSolo.out -type f -name "*.mtx" | xargs -P ${task.cpus} gzip
+    """
+}
+
 def saveAsSTAR(sample, filename) {
     def extensions = [".mtx.gz", ".tsv.gz", ".txt.gz", ".stats.gz", ".csv"]
     if (extensions.any { filename.endsWith(it) }) {
@@ -175,13 +319,14 @@ def saveAsSTAR(sample, filename) {
 
 process FASTQ_DUMP {
     publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsLog(filename, sample, accession) }
+    tag "${sample}:${accession}"
     label "download_env"
     maxRetries 1
     errorStrategy { task.attempt <= maxRetries ? 'retry' : 'ignore' }
     cpus 4
-    memory { 4.GB * task.attempt }
-    time { (6.h + (sra_file_size_gb * 0.8).h) * task.attempt }
-    disk {[request: 375.GB, type: 'local-ssd']}
+    memory { hintMemory(task, sra_file_size_gb, 4.GB * task.attempt) }
+    time { hintTime(task, sra_file_size_gb, (6.h + (sra_file_size_gb * 0.8).h) * task.attempt) }
+    disk { hintLocalSsd(task, sra_file_size_gb, [request: 375.GB, type: 'local-ssd']) }
     machineType { 
         def options = ['n2-*', 'c2-*', 'n2d-*', 'c2d-*']
         return options[new Random().nextInt(options.size())]
@@ -191,9 +336,10 @@ process FASTQ_DUMP {
     tuple val(sample), val(accession), val(metadata), val(sra_file_size_gb)
 
     output:
-    tuple val(sample), val(accession), val(metadata), path("reads/read_1.fastq"), emit: "R1"
-    tuple val(sample), val(accession), val(metadata), path("reads/read_2.fastq"), emit: "R2", optional: true
+    tuple val(sample), val(accession), val(metadata), path("reads/read_1.fastq*"), emit: "R1"
+    tuple val(sample), val(accession), val(metadata), path("reads/read_2.fastq*"), emit: "R2", optional: true
     path "${task.process}.log",                                                   emit: "log"
+    path "${task.process}_log_spill.jsonl",                                       emit: "spill", optional: true
 
     script:
     """
@@ -205,12 +351,14 @@ process FASTQ_DUMP {
     echo "sra-stat file size: ${sra_file_size_gb} GB" >> ${task.process}.log
 
     echo "Running fastq-dump as backup for fasterq-dump" >> ${task.process}.log
+    export SCRECOUNTER_LOG_SPILL="${task.process}_log_spill.jsonl"
     fq-dump.py \\
       --sample ${sample} \\
       --accession ${accession} \\
       --threads ${task.cpus} \\
       --min-read-length ${params.min_read_len} \\
       --outdir reads \\
+      --compress ${params.fastq_compress} \\
       --maxSpotId ${params.fallback_max_spots} \\
       ${accession} \\
       2>&1 | tee -a ${task.process}.log
@@ -225,23 +373,26 @@ process FASTQ_DUMP {
 
 process FASTERQ_DUMP {
     publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsLog(filename, sample, accession) }
+    tag "${sample}:${accession}"
     label "download_env"
     maxRetries 1
     errorStrategy { task.attempt <= maxRetries ? 'retry' : 'ignore' }
     cpus 6
-    memory { 16.GB * task.attempt }
-    time { (10.h + (sra_file_size_gb * 0.8).h) * task.attempt }
+    memory { hintMemory(task, sra_file_size_gb, 16.GB * task.attempt) }
+    time { hintTime(task, sra_file_size_gb, (10.h + (sra_file_size_gb * 0.8).h) * task.attempt) }
     disk { 
+        // compressed fastq files are ~3x smaller
+        def fastq_gb = params.fastq_compress == "none" ? sra_file_size_gb : sra_file_size_gb / 3
         def disk_size = 
-            sra_file_size_gb > 260 ? 2625.GB :
-            sra_file_size_gb > 220 ? 2250.GB :
-            sra_file_size_gb > 170 ? 1875.GB :
-            sra_file_size_gb > 120 ? 1500.GB :
-            sra_file_size_gb > 60 ? 1125.GB :
-            sra_file_size_gb > 30 ? 750.GB :
+            fastq_gb > 260 ? 2625.GB :
+            fastq_gb > 220 ? 2250.GB :
+            fastq_gb > 170 ? 1875.GB :
+            fastq_gb > 120 ? 1500.GB :
+            fastq_gb > 60 ? 1125.GB :
+            fastq_gb > 30 ? 750.GB :
             375.GB
         disk_size = disk_size + (375 * (task.attempt - 1)).GB
-        [request: disk_size, type: 'local-ssd'] 
+        hintLocalSsd(task, sra_file_size_gb, [request: disk_size, type: 'local-ssd'])
     }
     machineType { 
         def options = ['n2-*', 'c2-*', 'n2d-*', 'c2d-*'] //, 'n1-*']
@@ -252,9 +403,10 @@ process FASTERQ_DUMP {
     tuple val(sample), val(accession), val(metadata), val(sra_file_size_gb)
 
     output:
-    tuple val(sample), val(accession), val(metadata), path("reads/read_1.fastq"), emit: "R1", optional: true
-    tuple val(sample), val(accession), val(metadata), path("reads/read_2.fastq"), emit: "R2", optional: true
+    tuple val(sample), val(accession), val(metadata), path("reads/read_1.fastq*"), emit: "R1", optional: true
+    tuple val(sample), val(accession), val(metadata), path("reads/read_2.fastq*"), emit: "R2", optional: true
     path "${task.process}.log",                                                   emit: "log"
+    path "${task.process}_log_spill.jsonl",                                       emit: "spill", optional: true
 
     script:
     """
@@ -266,6 +418,7 @@ process FASTERQ_DUMP {
     echo "sra-stat file size: ${sra_file_size_gb} GB" >> ${task.process}.log
 
     # run prefetch and fasterq-dump
+    export SCRECOUNTER_LOG_SPILL="${task.process}_log_spill.jsonl"
     fq-dump.py \\
       --sample ${sample} \\
       --accession ${accession} \\
@@ -277,6 +430,7 @@ process FASTERQ_DUMP {
       --min-read-length ${params.min_read_len} \\
       --temp ${params.fasterq_tmp} \\
       --outdir reads \\
+      --compress ${params.fastq_compress} \\
       ${accession} \\
       2>&1 | tee -a ${task.process}.log
     """
@@ -287,3 +441,77 @@ process FASTERQ_DUMP {
     touch reads/read_1.fastq reads/read_2.fastq ${task.process}.log
     """
 }
+
+process FASTERQ_DUMP_SAMPLE {
+    publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsLog(filename, sample) }
+    tag "${sample}"
+    label "download_env"
+    maxRetries 1
+    errorStrategy { task.attempt <= maxRetries ? 'retry' : 'ignore' }
+    cpus 8
+    memory { hintMemory(task, sra_file_size_gb.sum(), 16.GB * task.attempt) }
+    time { hintTime(task, sra_file_size_gb.sum(), (10.h + (sra_file_size_gb.sum() * 0.8).h) * task.attempt) }
+    disk { 
+        // reads of all accessions, plus the SRA files in flight
+        def fastq_gb = sra_file_size_gb.sum() * (params.fastq_compress == "none" ? 1 : 1 / 3) + 
+            Math.min(sra_file_size_gb.sum(), params.max_inflight_gb as float)
+        def disk_size = 
+            fastq_gb > 260 ? 2625.GB :
+            fastq_gb > 220 ? 2250.GB :
+            fastq_gb > 170 ? 1875.GB :
+            fastq_gb > 120 ? 1500.GB :
+            fastq_gb > 60 ? 1125.GB :
+            fastq_gb > 30 ? 750.GB :
+            375.GB
+        disk_size = disk_size + (375 * (task.attempt - 1)).GB
+        hintLocalSsd(task, sra_file_size_gb.sum(), [request: disk_size, type: 'local-ssd'])
+    }
+    machineType { 
+        def options = ['n2-*', 'c2-*', 'n2d-*', 'c2d-*']
+        return options[new Random().nextInt(options.size())]
+    }
+    
+    input:
+    tuple val(sample), val(accessions), val(sra_file_size_gb)
+
+    output:
+    tuple val(sample), path("reads/read_1.fastq*"), emit: "R1", optional: true
+    tuple val(sample), path("reads/read_2.fastq*"), emit: "R2", optional: true
+    path "${task.process}.log",                     emit: "log"
+    path "${task.process}_log_spill.jsonl",         emit: "spill", optional: true
+
+    script:
+    """
+    export GCP_SQL_DB_HOST="${params.db_host}"
+    export GCP_SQL_DB_NAME="${params.db_name}"
+    export GCP_SQL_DB_USERNAME="${params.db_username}"
+
+    echo "Downloading ${accessions.join(', ')} for ${sample}" > ${task.process}.log
+    echo "sra-stat file sizes: ${sra_file_size_gb.join(', ')} GB" >> ${task.process}.log
+
+    # concurrent prefetch + fasterq-dump of all accessions
+    export SCRECOUNTER_LOG_SPILL="${task.process}_log_spill.jsonl"
+    fq-dump.py \\
+      --sample ${sample} \\
+      --threads ${task.cpus} \\
+      --bufsize 200MB \\
+      --curcache 1GB \\
+      --mem 12GB \\
+      --max-size-gb ${params.max_sra_size} \\
+      --min-read-length ${params.min_read_len} \\
+      --temp ${params.fasterq_tmp} \\
+      --outdir reads \\
+      --compress ${params.fastq_compress} \\
+      --prefetch-jobs ${params.prefetch_jobs} \\
+      --max-inflight-gb ${params.max_inflight_gb} \\
+      --sra-size-gb "${sra_file_size_gb.join(',')}" \\
+      ${accessions.join(' ')} \\
+      2>&1 | tee -a ${task.process}.log
+    """
+
+    stub:
+    """
+    mkdir -p reads
+    touch reads/read_1.fastq reads/read_2.fastq ${task.process}.log
+    """
+}
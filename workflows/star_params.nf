@@ -1,5 +1,5 @@
 include { joinReads; saveAsLog; subsampleByGroup; } from '../lib/utils.groovy'
-include { makeParamSets; validateRequiredColumns; loadBarcodes; loadStarIndices; expandStarParams } from '../lib/star_params.groovy'
+include { makeParamSets; filterParamSets; collectParamSets; filterCachedParamSets; groupParamSets; batchSelectInputs; validateRequiredColumns; loadBarcodes; loadStarIndices; expandStarParams } from '../lib/star_params.groovy'
 
 // Workflow to run STAR alignment on scRNA-seq data
 workflow STAR_PARAMS_WF{
@@ -31,21 +31,58 @@ workflow STAR_PARAMS_WF{
     // Pairwise combine samples with barcodes, strand, and star index
     ch_params = makeParamSets(ch_fastq, ch_barcodes, ch_star_indices)
 
-    // Run STAR on subsampled reads, for all pairwise parameter combinations
-    STAR_PARAM_SEARCH(ch_params)
+    // Pre-screen the barcode whitelists (read 1 prefixes); only test the plausible whitelists
+    if (params.barcode_screen) {
+        ch_whitelists = ch_barcodes.toList().map { rows ->
+            [file(params.barcodes), rows.collect { it[0] }, rows.collect { it[1] }, rows.collect { file(it[3]) }]
+        }
+        BARCODE_SCREEN(
+            ch_fastq.map { sample, accession, metadata, r1, r2 -> [sample, accession, r1] }.combine(ch_whitelists)
+        )
+        ch_params = filterParamSets(ch_params, BARCODE_SCREEN.out.csv)
+    }
+
+    if (params.param_search_rounds || params.param_prior) {
+        // All parameter combinations of an accession in one task: the parameters of sibling samples
+        // (same study) first, if param_prior; then successive halving (small subsample first; only the best on more reads)
+        STAR_PARAM_SEARCH_SAMPLE(groupParamSets(ch_params))
+        ch_star_params_csv = STAR_PARAM_SEARCH_SAMPLE.out.csv
+    } else {
+        // Look up cached results (same reads & parameters); only run STAR for the rest
+        ch_cached = Channel.empty()
+        if (params.param_cache) {
+            STAR_PARAM_CACHE(collectParamSets(ch_params))
+            ch_params = filterCachedParamSets(ch_params, STAR_PARAM_CACHE.out.uncached)
+            ch_cached = STAR_PARAM_CACHE.out.cached
+        }
+
+        // Run STAR on subsampled reads, for all pairwise parameter combinations
+        STAR_PARAM_SEARCH(ch_params)
+
+        // Format the STAR parameters into a CSV file
+        STAR_FORMAT_PARAMS(STAR_PARAM_SEARCH.out.csv)
+        ch_star_params_csv = STAR_FORMAT_PARAMS.out.csv
+            .mix(ch_cached)
+            .groupTuple(by: [0,1])
+    }
 
-    // Format the STAR parameters into a CSV file
-    STAR_FORMAT_PARAMS(STAR_PARAM_SEARCH.out.csv)
-    
     // Get best parameters
-    ch_params_all = STAR_FORMAT_PARAMS.out.csv
-        .groupTuple(by: [0,1])
+    ch_params_all = ch_star_params_csv
         .join(SEQKIT_STATS.out, by: [0,1])
         .join(ch_sra_stat, by: [0,1])
-    STAR_SELECT_PARAMS(ch_params_all)
+    if (params.select_batch) {
+        // All samples & accessions in one task
+        STAR_SELECT_PARAMS_BATCH(batchSelectInputs(ch_params_all))
+        ch_selected_json = STAR_SELECT_PARAMS_BATCH.out.json
+            .flatten()
+            .map { json_file -> [json_file.parent.parent.name, json_file.parent.name, json_file] }
+    } else {
+        STAR_SELECT_PARAMS(ch_params_all)
+        ch_selected_json = STAR_SELECT_PARAMS.out.json
+    }
 
     // Filter empty params
-    ch_star_params_json = STAR_SELECT_PARAMS.out.json
+    ch_star_params_json = ch_selected_json
         .filter { sample, accession, json_file -> 
             if(json_file.size() < 5) {
                 println "WARNING: No valid STAR parameters found for ${sample}; skipping"
@@ -103,8 +140,9 @@ process STAR_SAVE_FINAL_PARAMS {
     tuple val(sample), val(barcodes), val(star_index), val(cell_barcode_length), val(umi_length), val(strand)
 
     output:
-    path "star_params.csv",     emit: "csv"
-    path "${task.process}.log", emit: "log"
+    path "star_params.csv",                 emit: "csv"
+    path "${task.process}.log",             emit: "log"
+    path "${task.process}_log_spill.jsonl", emit: "spill", optional: true
 
     script:
     """
@@ -112,6 +150,7 @@ process STAR_SAVE_FINAL_PARAMS {
     export GCP_SQL_DB_NAME="${params.db_name}"
     export GCP_SQL_DB_USERNAME="${params.db_username}"
 
+    export SCRECOUNTER_LOG_SPILL="${task.process}_log_spill.jsonl"
     upload-final-star-params.py \\
       --sample ${sample} \\
       --barcodes ${barcodes} \\
@@ -137,6 +176,14 @@ def saveAsParams(sample, accession, filename) {
     return null
 }
 
+def saveAsBatchParams(filename) {
+    // results/<sample>/<accession>/<file> => STAR/<sample>/<accession>/<file> (see saveAsParams)
+    if (filename.startsWith("results/") && (filename.endsWith(".csv") || filename.endsWith(".json"))){
+        return "STAR/" + filename.tokenize("/")[1..-1].join("/")
+    }
+    return null
+}
+
 process STAR_SELECT_PARAMS {
     publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsParams(sample, accession, filename) }
     publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsLog(filename, sample, accession) }
@@ -151,6 +198,7 @@ process STAR_SELECT_PARAMS {
     tuple val(sample), val(accession), path("results/merged_star_params.csv"),    emit: "csv"
     tuple val(sample), val(accession), path("results/selected_star_params.json"), emit: "json"
     path "${task.process}.log",  emit: "log"
+    path "${task.process}_log_spill.jsonl", emit: "spill", optional: true
     
     script:
     """
@@ -158,6 +206,7 @@ process STAR_SELECT_PARAMS {
     export GCP_SQL_DB_NAME="${params.db_name}"
     export GCP_SQL_DB_USERNAME="${params.db_username}"
     
+    export SCRECOUNTER_LOG_SPILL="${task.process}_log_spill.jsonl"
     select-star-params.py \\
       --sample ${sample} \\
       --accession ${accession} \\
@@ -171,6 +220,49 @@ process STAR_SELECT_PARAMS {
     """
 }
 
+// Select the best STAR parameters of all samples & accessions in one task
+process STAR_SELECT_PARAMS_BATCH {
+    publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsBatchParams(filename) }
+    publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsLog(filename) }
+    label "star_env"
+    errorStrategy { task.attempt <= maxRetries ? 'retry' : 'ignore' }
+    disk 10.GB
+
+    input:
+    tuple path(star_params, stageAs: "star_params*.csv"), path(read_stats, stageAs: "read_stats*.tsv"), path(sra_stats, stageAs: "sra_stats*.csv"), val(manifest)
+
+    output:
+    path "results/*/*/merged_star_params.csv",    emit: "csv"
+    path "results/*/*/selected_star_params.json", emit: "json"
+    path "${task.process}.log",  emit: "log"
+    path "${task.process}_log_spill.jsonl", emit: "spill", optional: true
+
+    script:
+    """
+    export GCP_SQL_DB_HOST="${params.db_host}"
+    export GCP_SQL_DB_NAME="${params.db_name}"
+    export GCP_SQL_DB_USERNAME="${params.db_username}"
+
+    cat <<'MANIFEST' > manifest.json
+${manifest}
+MANIFEST
+
+    export SCRECOUNTER_LOG_SPILL="${task.process}_log_spill.jsonl"
+    select-star-params-batch.py \\
+      --manifest manifest.json \\
+      --star-params ${star_params} \\
+      --read-stats ${read_stats} \\
+      --sra-stats ${sra_stats} \\
+      2>&1 | tee ${task.process}.log
+    """
+
+    stub:
+    """
+    mkdir -p results
+    touch ${task.process}.log
+    """
+}
+
 process STAR_FORMAT_PARAMS {
     publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsLog(filename, sample, accession) }
     label "star_env"
@@ -178,30 +270,38 @@ process STAR_FORMAT_PARAMS {
     disk 10.GB
 
     input:
-    tuple val(sample), val(accession), val(metadata), val(params), path(star_summary)
+    tuple val(sample), val(accession), val(metadata), val(param_set), path(star_summary)
 
     output:
     tuple val(sample), val(accession), path("star_params.csv"), emit: "csv"
     path "${task.process}*.log",                                emit: "log"
 
     script:
+    def read_fingerprint = param_set.read_fingerprint ? "--read-fingerprint ${param_set.read_fingerprint}" : ""
     """
-    BARCODES_FILE=\$(basename ${params.barcodes_file})
-    STAR_INDEX=\$(basename ${params.star_index})
+    export GCP_SQL_DB_HOST="${params.db_host}"
+    export GCP_SQL_DB_NAME="${params.db_name}"
+    export GCP_SQL_DB_USERNAME="${params.db_username}"
+
+    BARCODES_FILE=\$(basename ${param_set.barcodes_file})
+    STAR_INDEX=\$(basename ${param_set.star_index})
 
     format-star-params.py \\
-      --sample ${params.sample} \\
-      --accession ${params.accession} \\
-      --strand ${params.strand} \\
-      --barcodes-name ${params.barcodes_name} \\
-      --barcodes-file ${params.barcodes_file} \\
-      --cell-barcode-length ${params.cell_barcode_length} \\
-      --umi-length ${params.umi_length} \\
-      --organism ${params.organism} \\
-      --star-index ${params.star_index} \\
+      --sample ${param_set.sample} \\
+      --accession ${param_set.accession} \\
+      --strand ${param_set.strand} \\
+      --barcodes-name ${param_set.barcodes_name} \\
+      --barcodes-file ${param_set.barcodes_file} \\
+      --cell-barcode-length ${param_set.cell_barcode_length} \\
+      --umi-length ${param_set.umi_length} \\
+      --organism ${param_set.organism} \\
+      --star-index ${param_set.star_index} \\
+      --barcodes-stamp "${param_set.barcodes_stamp ?: ''}" \\
+      --star-index-stamp "${param_set.star_index_stamp ?: ''}" \\
       --outfile star_params.csv \\
+      ${read_fingerprint} \\
       $star_summary \\
-      2>&1 | tee ${task.process}:\${STAR_INDEX}:\${BARCODES_FILE}:${params.strand}.log
+      2>&1 | tee ${task.process}:\${STAR_INDEX}:\${BARCODES_FILE}:${param_set.strand}.log
     """
 }
 
@@ -263,6 +363,132 @@ process STAR_PARAM_SEARCH {
     """
 }
 
+// Run the STAR parameter search (prior parameters and/or successive halving): all parameter sets of an accession in one task
+process STAR_PARAM_SEARCH_SAMPLE {
+    publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsParams(sample, accession, filename) }
+    publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsLog(filename, sample, accession) }
+    label "star_env"
+    label "process_medium"
+    errorStrategy { task.attempt <= maxRetries ? 'retry' : 'ignore' }
+    disk 10.GB
+
+    input:
+    tuple val(sample), val(accession), path(fastq_1), path(fastq_2), path(barcodes_files, stageAs: "barcodes?/*"), path(star_indices, stageAs: "star_index?/*"), val(param_sets)
+
+    output:
+    tuple val(sample), val(accession), path("star_params.csv"), emit: "csv"
+    path "param_search_rounds.csv",                             emit: "rounds"
+    path "${task.process}.log",                                 emit: "log"
+    path "${task.process}_log_spill.jsonl",                     emit: "spill", optional: true
+
+    script:
+    def prior = params.param_prior ? "--prior --prior-reads ${params.param_prior_reads}" : ""
+    """
+    export GCP_SQL_DB_HOST="${params.db_host}"
+    export GCP_SQL_DB_NAME="${params.db_name}"
+    export GCP_SQL_DB_USERNAME="${params.db_username}"
+
+    cat <<'PARAM_SETS' > param_sets.json
+${param_sets}
+PARAM_SETS
+
+    export SCRECOUNTER_LOG_SPILL="${task.process}_log_spill.jsonl"
+    star-param-search.py \\
+      --sample ${sample} \\
+      --accession ${accession} \\
+      --param-sets param_sets.json \\
+      --barcodes-files ${barcodes_files} \\
+      --star-indices ${star_indices} \\
+      --rounds "${params.param_search_rounds}" \\
+      --eta ${params.param_search_eta} \\
+      ${prior} \\
+      --threads ${task.cpus} \\
+      $fastq_1 $fastq_2 \\
+      2>&1 | tee ${task.process}.log
+    """
+
+    stub:
+    """
+    touch star_params.csv param_search_rounds.csv ${task.process}.log
+    """
+}
+
+// Look up cached STAR param search results, keyed by the read fingerprint & parameters
+process STAR_PARAM_CACHE {
+    publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsLog(filename, sample, accession) }
+    label "star_env"
+    label "process_low"
+    errorStrategy { task.attempt <= maxRetries ? 'retry' : 'ignore' }
+    disk 10.GB
+
+    input:
+    tuple val(sample), val(accession), path(fastq_1), path(fastq_2), val(param_sets)
+
+    output:
+    tuple val(sample), val(accession), path("cached_star_params.csv"),   emit: "cached", optional: true
+    tuple val(sample), val(accession), path("uncached_param_sets.json"), emit: "uncached"
+    path "${task.process}.log",                                          emit: "log"
+
+    script:
+    """
+    export GCP_SQL_DB_HOST="${params.db_host}"
+    export GCP_SQL_DB_NAME="${params.db_name}"
+    export GCP_SQL_DB_USERNAME="${params.db_username}"
+
+    cat <<'PARAM_SETS' > param_sets.json
+${param_sets}
+PARAM_SETS
+
+    param-cache.py \\
+      --param-sets param_sets.json \\
+      $fastq_1 $fastq_2 \\
+      2>&1 | tee ${task.process}.log
+    """
+
+    stub:
+    """
+    echo "[]" > uncached_param_sets.json
+    touch ${task.process}.log
+    """
+}
+
+// Fraction of reads matching each barcode whitelist (exact or 1 mismatch), to skip implausible whitelists
+process BARCODE_SCREEN {
+    publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsParams(sample, accession, filename) }
+    publishDir file(params.output_dir), mode: "copy", overwrite: true, saveAs: { filename -> saveAsLog(filename, sample, accession) }
+    label "star_env"
+    label "process_low"
+    errorStrategy { task.attempt <= maxRetries ? 'retry' : 'ignore' }
+    disk 10.GB
+
+    input:
+    tuple val(sample), val(accession), path(fastq_1), path(barcodes_csv), val(names), val(cb_lens), path(whitelists, stageAs: "whitelist?/*")
+
+    output:
+    tuple val(sample), val(accession), path("plausible_barcodes.csv"), emit: "csv"
+    path "barcode_screen.csv",                                        emit: "screen"
+    path "${task.process}.log",                                       emit: "log"
+
+    script:
+    def whitelist_args = [names, cb_lens, [whitelists].flatten()].transpose()
+        .collect { name, cb_len, whitelist -> "--whitelist ${name}:${cb_len}:${whitelist}" }
+        .join(" ")
+    """
+    barcode-screen.py \\
+      --barcodes ${barcodes_csv} \\
+      ${whitelist_args} \\
+      --num-reads ${params.barcode_screen_reads} \\
+      --min-frac ${params.barcode_screen_min_frac} \\
+      $fastq_1 \\
+      2>&1 | tee ${task.process}.log
+    """
+
+    stub:
+    """
+    touch plausible_barcodes.csv barcode_screen.csv ${task.process}.log
+    """
+}
+
 // Get read lengths via `seqkit stats`
 process SEQKIT_STATS {
     label "download_env"
@@ -305,6 +531,7 @@ process FASTQ_DUMP {
     tuple val(sample), val(accession), val(metadata), path("reads/read_1.fastq"), emit: "R1"
     tuple val(sample), val(accession), val(metadata), path("reads/read_2.fastq"), emit: "R2", optional: true
     path "${task.process}.log",                                                   emit: "log"
+    path "${task.process}_log_spill.jsonl",                                       emit: "spill", optional: true
 
     script:
     """
@@ -312,6 +539,7 @@ process FASTQ_DUMP {
     export GCP_SQL_DB_NAME="${params.db_name}"
     export GCP_SQL_DB_USERNAME="${params.db_username}"
 
+    export SCRECOUNTER_LOG_SPILL="${task.process}_log_spill.jsonl"
     fq-dump.py \\
       --sample ${sample} \\
       --accession ${accession} \\